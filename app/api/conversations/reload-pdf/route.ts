@@ -4,6 +4,41 @@ import { downloadPDFFromStorage } from '@/lib/supabase/storage'
 import { getPDFByConversationServer, updatePDFServer } from '@/lib/supabase/database-server'
 
 const BACKEND_URL = process.env.BACKEND_URL || 'http://localhost:8000'
+const REQUEST_TIMEOUT_MS = 30000 // per backend request
+const JOB_TIMEOUT_MS = 600000 // 10 minutes for the whole job
+const JOB_POLL_INTERVAL_MS = 1000
+
+async function fetchWithTimeout(url: string, init: RequestInit = {}) {
+  const controller = new AbortController()
+  const timeoutId = setTimeout(() => controller.abort(), REQUEST_TIMEOUT_MS)
+  try {
+    return await fetch(url, { ...init, signal: controller.signal })
+  } finally {
+    clearTimeout(timeoutId)
+  }
+}
+
+/**
+ * Polls a backend job until it finishes. Returns the finished job, or null if it is still
+ * running after JOB_TIMEOUT_MS (the job is cancelled in that case).
+ */
+async function waitForJob(jobId: string) {
+  const deadline = Date.now() + JOB_TIMEOUT_MS
+  while (Date.now() < deadline) {
+    const response = await fetchWithTimeout(`${BACKEND_URL}/api/jobs/${jobId}`)
+    if (!response.ok) {
+      const error = await response.json().catch(() => ({ detail: 'Unknown error' }))
+      throw new Error(error.detail || 'Failed to get job status')
+    }
+    const job = await response.json()
+    if (['succeeded', 'failed', 'cancelled'].includes(job.status)) {
+      return job
+    }
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS))
+  }
+  await fetchWithTimeout(`${BACKEND_URL}/api/jobs/${jobId}`, { method: 'DELETE' }).catch(() => {})
+  return null
+}
 
 /**
  * POST /api/conversations/reload-pdf
@@ -51,28 +86,44 @@ export async function POST(request: NextRequest) {
     const formData = new FormData()
     formData.append('file', blob, pdf.filename)
 
-    // Forward to FastAPI backend for processing
-    const controller = new AbortController()
-    const timeoutId = setTimeout(() => controller.abort(), 120000) // 2 minute timeout
-
+    // Forward to FastAPI backend as a background job, then poll it; large PDFs can take
+    // longer than any single request should stay open
     try {
-      const response = await fetch(`${BACKEND_URL}/api/upload`, {
+      const submit = await fetchWithTimeout(`${BACKEND_URL}/api/upload?job=true`, {
         method: 'POST',
         body: formData,
-        signal: controller.signal,
       })
 
-      clearTimeout(timeoutId)
-
-      if (!response.ok) {
-        const error = await response.json().catch(() => ({ detail: 'Unknown error' }))
+      if (!submit.ok) {
+        const error = await submit.json().catch(() => ({ detail: 'Unknown error' }))
         return NextResponse.json(
           { error: error.detail || 'Failed to process PDF' },
-          { status: response.status }
+          { status: submit.status }
         )
       }
 
-      const data = await response.json()
+      const job = await waitForJob((await submit.json()).job_id)
+      if (!job) {
+        return NextResponse.json(
+          { error: 'Request timeout. Please try again.' },
+          { status: 504 }
+        )
+      }
+      if (job.status === 'cancelled') {
+        return NextResponse.json(
+          { error: job.error || 'PDF processing was cancelled' },
+          { status: 409 }
+        )
+      }
+      if (job.status !== 'succeeded') {
+        // error_status is what the synchronous upload would have returned, e.g. 400 for an unreadable PDF
+        return NextResponse.json(
+          { error: job.error || 'Failed to process PDF' },
+          { status: job.error_status || 500 }
+        )
+      }
+
+      const data = job.result
 
       // Update PDF with new session ID
       if (pdf.id && data.session_id) {
@@ -87,8 +138,6 @@ export async function POST(request: NextRequest) {
         message: 'PDF reloaded and processed successfully',
       })
     } catch (fetchError: any) {
-      clearTimeout(timeoutId)
-      
       if (fetchError.name === 'AbortError') {
         return NextResponse.json(
           { error: 'Request timeout. Please try again.' },
@@ -0,0 +1,147 @@
+"""Semantic cache of chat answers, keyed by document hash and question embedding.
+
+A question whose embedding has cosine similarity >= ANSWER_CACHE_THRESHOLD with a
+previously answered question about the same document gets the cached answer back
+without calling the LLM.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+import settings
+
+
+def normalize(vector: Sequence[float]) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm > 0 else array
+
+
+class _DocumentAnswers:
+    """Cached answers for one document; vectors are stacked for a single matrix product."""
+
+    def __init__(self, dimension: int):
+        self.vectors = np.empty((0, dimension), dtype=np.float32)
+        self.questions: List[str] = []
+        self.answers: List[str] = []
+        self.created: List[float] = []
+
+    def __len__(self) -> int:
+        return len(self.answers)
+
+    def drop(self, keep: np.ndarray):
+        self.vectors = self.vectors[keep]
+        self.questions = [q for q, k in zip(self.questions, keep) if k]
+        self.answers = [a for a, k in zip(self.answers, keep) if k]
+        self.created = [c for c, k in zip(self.created, keep) if k]
+
+
+class AnswerCache:
+    def __init__(self, threshold: float, ttl: float, max_per_document: int, max_documents: int):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_per_document = max_per_document
+        self.max_documents = max_documents
+        self._documents: "OrderedDict[str, _DocumentAnswers]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.expired = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_per_document > 0 and self.max_documents > 0
+
+    def _expire(self, doc_hash: str, entries: _DocumentAnswers):
+        if self.ttl <= 0 or not len(entries):
+            return
+        cutoff = time.time() - self.ttl
+        keep = np.array([created >= cutoff for created in entries.created], dtype=bool)
+        if not keep.all():
+            self.expired += int((~keep).sum())
+            entries.drop(keep)
+        if not len(entries):
+            del self._documents[doc_hash]
+
+    def lookup(self, doc_hash: str, vector: Sequence[float]) -> Optional[str]:
+        """Return the cached answer closest to `vector` if it clears the threshold."""
+        if not self.enabled:
+            return None
+        query = normalize(vector)
+        with self._lock:
+            entries = self._documents.get(doc_hash)
+            if entries is not None:
+                self._expire(doc_hash, entries)
+            if entries is None or not len(entries):
+                self.misses += 1
+                return None
+            self._documents.move_to_end(doc_hash)
+            scores = entries.vectors @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entries.answers[best]
+
+    def store(self, doc_hash: str, vector: Sequence[float], question: str, answer: str):
+        if not self.enabled:
+            return
+        query = normalize(vector)
+        with self._lock:
+            entries = self._documents.get(doc_hash)
+            if entries is None:
+                entries = _DocumentAnswers(query.shape[0])
+                self._documents[doc_hash] = entries
+            self._documents.move_to_end(doc_hash)
+            entries.vectors = np.vstack([entries.vectors, query[None, :]])
+            entries.questions.append(question)
+            entries.answers.append(answer)
+            entries.created.append(time.time())
+            if len(entries) > self.max_per_document:
+                # Oldest entries go first
+                keep = np.zeros(len(entries), dtype=bool)
+                keep[-self.max_per_document:] = True
+                entries.drop(keep)
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+            self.stores += 1
+
+    def status(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "threshold": self.threshold,
+                "documents": len(self._documents),
+                "entries": sum(len(entries) for entries in self._documents.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "stores": self.stores,
+                "expired": self.expired,
+            }
+
+
+def cache_key_text(question: str, chat_history: List[tuple]) -> str:
+    """Text that gets embedded for the cache lookup.
+
+    Only the question by default; with ANSWER_CACHE_INCLUDE_HISTORY the previous
+    exchange is prepended so follow-up questions only match in the same context.
+    """
+    if settings.ANSWER_CACHE_INCLUDE_HISTORY and chat_history:
+        last_question, last_answer = chat_history[-1]
+        return f"Q: {last_question}\nA: {last_answer}\n\n{question}"
+    return question
+
+
+answer_cache = AnswerCache(
+    threshold=settings.ANSWER_CACHE_THRESHOLD,
+    ttl=settings.ANSWER_CACHE_TTL_SECONDS,
+    max_per_document=settings.ANSWER_CACHE_MAX_PER_DOCUMENT,
+    max_documents=settings.ANSWER_CACHE_MAX_DOCUMENTS,
+)
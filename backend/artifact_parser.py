@@ -0,0 +1,186 @@
+"""Parse quiz and flashcard LLM output into validated QuizQuestion / Flashcard items.
+
+JSON (what the model returns in JSON mode, also when wrapped in prose or a code fence)
+is read first. Otherwise the plain-text "Q1: / A) / Correct:" and "Front: / Back:" formats
+are read in a single pass with one compiled pattern. Incomplete items are dropped
+instead of failing the whole answer, so the caller can ask the model for just the rest.
+"""
+import json
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+from pydantic import BaseModel, ValidationError
+
+
+class QuizQuestion(BaseModel):
+    question: str
+    a: str
+    b: str
+    c: str
+    d: str
+    correct: str
+
+
+class Flashcard(BaseModel):
+    front: str
+    back: str
+
+
+OPTION_KEYS = ("a", "b", "c", "d")
+
+# One alternative per line kind. Markdown bullets, quotes and headings before it are ignored,
+# as is bold/italic emphasis around a label ("**Answer:** C", "__Q1:__", "**A)** ...").
+# "A - Paris" is an option too, but a dash needs a space after it so "B-tree ..." isn't one.
+QUIZ_LINE = re.compile(
+    r"^[ \t>#*_-]*(?:"
+    r"(?:correct(?:[ \t]+answer)?|answer)[*_ \t]*[:=-][*_ \t]*\(?(?P<correct>[A-D])\b"
+    r"|(?P<letter>[A-D])[ \t]*(?:[).:\]]|[-\u2013\u2014](?=[ \t]))[*_ \t]*(?P<option>[^*_\s][^\n]*)"
+    r"|(?:Q(?:uestion)?[ \t]*\d*|\d+)[ \t]*[:.)][*_ \t]*(?P<question>[^*_\s][^\n]*)"
+    r")",
+    re.IGNORECASE | re.MULTILINE,
+)
+CARD_LINE = re.compile(
+    r"^[ \t>#*_-]*(?:\d+[.)][ \t]*)?[*_]*"
+    r"(?:(?P<front>front|term|concept)|(?P<back>back|definition))"
+    r"[*_ \t]*[:=-][*_ \t]*(?P<text>[^*_\s][^\n]*)",
+    re.IGNORECASE | re.MULTILINE,
+)
+OPTION_PREFIX = re.compile(r"^[ \t]*\(?[A-Da-d](?:[).:\]]|[ \t]*[-\u2013\u2014](?=[ \t]))[ \t]*")
+ANSWER_LETTER = re.compile(r"^(?:option[ \t]*)?\(?([A-Da-d])\b", re.IGNORECASE)
+
+_decoder = json.JSONDecoder()
+
+
+def _json_items(text: str, key: str) -> Optional[List[Any]]:
+    """The list of objects under `key` (or at the top level) of the first JSON value in `text`.
+
+    None when there is none, e.g. for plain-text answers that merely contain brackets.
+    """
+    for opener in ("{", "["):
+        start = text.find(opener)
+        while start != -1:
+            try:
+                value, end = _decoder.raw_decode(text, start)
+            except ValueError:
+                start = text.find(opener, start + 1)
+                continue
+            if isinstance(value, dict):
+                value = value.get(key, next((v for v in value.values() if isinstance(v, list)), None))
+            if isinstance(value, list) and any(isinstance(item, dict) for item in value):
+                return value
+            start = text.find(opener, end)
+    return None
+
+
+def _clean(value: Any) -> str:
+    return str(value).replace("**", "").strip() if value is not None else ""
+
+
+def _letter(value: Any, options: Dict[str, str]) -> str:
+    """Normalise a correct answer given as "B", "b)", "Option B" or the option's text."""
+    text = _clean(value)
+    match = ANSWER_LETTER.match(text)
+    if match:
+        return match.group(1).upper()
+    for key, option in options.items():
+        if option and option.lower() == text.lower():
+            return key.upper()
+    return ""
+
+
+def _quiz_from_json(item: Any) -> Optional[QuizQuestion]:
+    if not isinstance(item, dict):
+        return None
+    fields = {str(key).strip().lower(): value for key, value in item.items()}
+    options = fields.get("options") or fields.get("choices")
+    if isinstance(options, list):
+        options = dict(zip(OPTION_KEYS, options))
+    if isinstance(options, dict):
+        fields.update({str(key).strip().lower()[:1]: value for key, value in options.items()})
+    answers = {key: OPTION_PREFIX.sub("", _clean(fields.get(key))) for key in OPTION_KEYS}
+    return _validate(QuizQuestion, {
+        "question": _clean(fields.get("question")),
+        **answers,
+        "correct": _letter(fields.get("correct", fields.get("answer")), answers),
+    })
+
+
+def _card_from_json(item: Any) -> Optional[Flashcard]:
+    if not isinstance(item, dict):
+        return None
+    fields = {str(key).strip().lower(): value for key, value in item.items()}
+    return _validate(Flashcard, {
+        "front": _clean(fields.get("front", fields.get("term", fields.get("question")))),
+        "back": _clean(fields.get("back", fields.get("definition", fields.get("answer")))),
+    })
+
+
+def _validate(model, values: Dict[str, str]):
+    """The model instance, or None if a field is empty or invalid."""
+    if not all(values.values()):
+        return None
+    try:
+        return model(**values)
+    except ValidationError:
+        return None
+
+
+def _unique(items: Iterable, key) -> List:
+    seen = set()
+    result = []
+    for item in items:
+        if item is None:
+            continue
+        identity = key(item).lower()
+        if identity not in seen:
+            seen.add(identity)
+            result.append(item)
+    return result
+
+
+def parse_quiz(text: str) -> List[QuizQuestion]:
+    """Every complete question in the response, in order, without duplicates."""
+    items = _json_items(text, "questions")
+    if items is not None:
+        return _unique((_quiz_from_json(item) for item in items), lambda q: q.question)
+
+    questions = []
+    current: Optional[Dict[str, str]] = None
+    for match in QUIZ_LINE.finditer(text):
+        if match["question"] is not None:
+            questions.append(current)
+            current = {"question": _clean(match["question"])}
+        elif current is None:
+            continue
+        elif match["letter"] is not None:
+            current.setdefault(match["letter"].lower(), _clean(match["option"]))
+        else:
+            current["correct"] = match["correct"].upper()
+    questions.append(current)
+    return _unique(
+        (_validate(QuizQuestion, {field: q.get(field, "") for field in QuizQuestion.model_fields})
+         for q in questions if q is not None),
+        lambda q: q.question,
+    )
+
+
+def parse_flashcards(text: str) -> List[Flashcard]:
+    """Every complete card in the response, in order, without duplicates."""
+    items = _json_items(text, "flashcards")
+    if items is not None:
+        return _unique((_card_from_json(item) for item in items), lambda card: card.front)
+
+    cards = []
+    current: Optional[Dict[str, str]] = None
+    for match in CARD_LINE.finditer(text):
+        if match["front"] is not None:
+            cards.append(current)
+            current = {"front": _clean(match["text"])}
+        elif current is not None and "back" not in current:
+            current["back"] = _clean(match["text"])
+    cards.append(current)
+    return _unique(
+        (_validate(Flashcard, {"front": card.get("front", ""), "back": card.get("back", "")})
+         for card in cards if card is not None),
+        lambda card: card.front,
+    )
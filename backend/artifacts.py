@@ -0,0 +1,154 @@
+"""Per-document cache of generated study artifacts (quiz, flashcards, conversation name).
+
+Artifacts are keyed by the PDF's SHA-256, so every session on the same document shares
+them. They can be generated in the background right after upload, and concurrent
+requests for the same artifact wait on a single generation instead of each calling the LLM.
+"""
+import asyncio
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+import settings
+from metrics import detached_context
+
+Generator = Callable[[], Awaitable[Any]]
+
+
+class ArtifactStore:
+    def __init__(self, root: Optional[Path], memory_entries: int):
+        self.root = root
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._pending: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._background: Set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.failed = 0
+
+    def _path(self, doc_hash: str, kind: str) -> Optional[Path]:
+        if self.root is None:
+            return None
+        return self.root / doc_hash / f"{kind}.json"
+
+    def _remember(self, key: Tuple[str, str], value: Any):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, doc_hash: str, kind: str) -> Optional[Any]:
+        """Return a stored artifact from memory or disk, or None."""
+        key = (doc_hash, kind)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        path = self._path(doc_hash, kind)
+        if path is None or not path.exists():
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._remember(key, value)
+        return value
+
+    def put(self, doc_hash: str, kind: str, value: Any):
+        self._remember((doc_hash, kind), value)
+        path = self._path(doc_hash, kind)
+        if path is None:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{kind}-{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    async def _generate(self, doc_hash: str, kind: str, generate: Generator) -> Any:
+        try:
+            value = await generate()
+        except Exception:
+            self.failed += 1
+            raise
+        await asyncio.to_thread(self.put, doc_hash, kind, value)
+        self.generated += 1
+        return value
+
+    def _start(self, doc_hash: str, kind: str, generate: Generator, force: bool = False) -> asyncio.Task:
+        key = (doc_hash, kind)
+        task = self._pending.get(key)
+        if task is None or force:
+            # Shared by every waiting request, so its stages aren't attributed to the first one
+            task = detached_context().run(asyncio.create_task, self._generate(doc_hash, kind, generate))
+            self._pending[key] = task
+            task.add_done_callback(lambda done: self._pending.pop(key, None) if self._pending.get(key) is done else None)
+        return task
+
+    async def get_or_generate(self, doc_hash: str, kind: str, generate: Generator,
+                              refresh: bool = False) -> Any:
+        """Serve the stored artifact, or generate (once, even under concurrency) and store it.
+
+        `refresh=True` always regenerates and replaces the stored value.
+        """
+        if refresh:
+            pending = self._pending.get((doc_hash, kind))
+            if pending is not None:
+                # Let the in-flight generation land first so it can't overwrite the refreshed value
+                await asyncio.wait([pending])
+            task = self._start(doc_hash, kind, generate, force=True)
+        else:
+            value = await asyncio.to_thread(self.get, doc_hash, kind)
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+            task = self._start(doc_hash, kind, generate)
+        # shield: a client disconnect shouldn't cancel a generation other requests may be waiting on
+        return await asyncio.shield(task)
+
+    def precompute(self, doc_hash: str, generators: Dict[str, Generator]):
+        """Start background generation of any artifacts not stored yet."""
+        for kind, generate in generators.items():
+            if (doc_hash, kind) in self._pending:
+                continue
+            path = self._path(doc_hash, kind)
+            with self._lock:
+                in_memory = (doc_hash, kind) in self._memory
+            if in_memory or (path is not None and path.exists()):
+                continue
+            task = self._start(doc_hash, kind, generate)
+            self._background.add(task)
+            task.add_done_callback(self._background_done)
+
+    def _background_done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Background artifact generation failed: {task.exception()}")
+
+    def status(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "precompute": list(settings.ARTIFACT_PRECOMPUTE),
+            "in_memory": len(self._memory),
+            "pending": len(self._pending),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "generated": self.generated,
+            "failed": self.failed,
+        }
+
+
+artifact_store = ArtifactStore(
+    root=Path(settings.ARTIFACT_CACHE_DIR) if settings.ARTIFACT_CACHE_DIR else None,
+    memory_entries=settings.ARTIFACT_MEMORY_ENTRIES,
+)
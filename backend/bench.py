@@ -0,0 +1,589 @@
+"""Offline benchmark of the ingest, retrieval and generation paths.
+
+Drives the FastAPI app in-process (no server, no network) with synthetic PDFs and a
+deterministic stand-in for ChatGroq, and reports throughput, p50/p95/p99 latency and
+peak RSS per scenario:
+
+    ingest         POST /api/upload, every PDF new (extract, split, embed, index)
+    ingest_cached  POST /api/upload of the same PDFs again (index cache hits)
+    retrieval      question embedding, hybrid search and context building for chat
+    chat           POST /api/chat (retrieval + fake LLM; the answer cache is off)
+    quiz           POST /api/quiz with refresh=true
+    flashcards     POST /api/flashcards with refresh=true
+    parse          parse_quiz / parse_flashcards on the canned text and JSON LLM output
+
+Usage (from backend/):
+
+    python bench.py --pages 20 --uploads 8 --requests 64 --concurrency 8 --json bench.json
+    python bench.py --embeddings hash --baseline bench.json --max-regression 0.25
+
+`--compare-indexes N` also builds every index backend over N synthetic vectors and
+prints each one's build time, memory footprint and recall@4 against exact search.
+
+`--embeddings model` (default) uses the configured sentence-transformers model, which
+must already be in the local Hugging Face cache; `--embeddings hash` swaps in a hashing
+embedder so the run needs nothing downloaded. Token counts are exact only if the tiktoken
+encoding is cached too; otherwise the report notes that they were approximated. With
+`--baseline`, the exit status is 1 if any scenario's p95 latency or throughput is more
+than `--max-regression` worse.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+import settings
+
+SCENARIOS = ["ingest", "ingest_cached", "retrieval", "chat", "quiz", "flashcards", "parse"]
+
+# Canned LLM output, in the formats the prompts ask for
+FAKE_QUIZ = "\n\n".join(
+    f"Q{i}: Which statement about topic {i} is correct?\n"
+    f"A) The first option\nB) The second option\nC) The third option\nD) The fourth option\n"
+    f"Correct: {'ABCD'[i % 4]}"
+    for i in range(1, 6)
+)
+FAKE_FLASHCARDS = "\n\n".join(
+    f"Front: Key term {i}\nBack: A one-sentence definition of key term {i} taken from the document."
+    for i in range(1, 11)
+)
+# The same items as Groq's JSON mode returns them
+FAKE_QUIZ_JSON = json.dumps({"questions": [
+    {"question": f"Which statement about topic {i} is correct?", "a": "The first option",
+     "b": "The second option", "c": "The third option", "d": "The fourth option", "correct": "ABCD"[i % 4]}
+    for i in range(1, 6)
+]})
+FAKE_FLASHCARDS_JSON = json.dumps({"flashcards": [
+    {"front": f"Key term {i}", "back": f"A one-sentence definition of key term {i} taken from the document."}
+    for i in range(1, 11)
+]})
+FAKE_TITLE = "Synthetic Benchmark Document"
+FAKE_SUMMARY = "The user asked about the document's main topics and the assistant summarized them."
+FAKE_ANSWER = (
+    "According to the document, the process converts the inputs described in the context into "
+    "the outputs listed on the cited page. The key figures are given in the second section, and "
+    "the limitations are discussed at the end of the chapter."
+)
+
+WORDS = (
+    "energy light chlorophyll membrane protein enzyme reaction carbon oxygen water glucose cell "
+    "structure function process system model theory evidence result measure sample method analysis "
+    "rate pressure temperature volume density force mass signal network layer data value error "
+    "history economy market policy trade growth capital labour region culture language society"
+).split()
+
+
+# --- Synthetic PDFs ----------------------------------------------------------------
+
+def synthetic_pages(pages: int, words_per_page: int, seed: int) -> List[str]:
+    """Pseudo-English pages; the same seed always gives the same text."""
+    rng = random.Random(seed)
+    result = []
+    for page in range(1, pages + 1):
+        lines = [f"Chapter {seed}.{page}: {rng.choice(WORDS).title()} and {rng.choice(WORDS)}"]
+        line: List[str] = []
+        for position in range(words_per_page):
+            line.append(rng.choice(WORDS) if position % 13 else str(rng.randint(1, 9999)))
+            if len(line) >= 12:
+                lines.append(" ".join(line) + ".")
+                line = []
+        if line:
+            lines.append(" ".join(line) + ".")
+        result.append("\n".join(lines))
+    return result
+
+
+def make_pdf(pages: List[str]) -> bytes:
+    """Minimal PDF with one Helvetica text line per input line."""
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+            " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages))), len(pages)
+        ),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(pages):
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>"
+        )
+        commands = []
+        y = 760
+        for line in text.split("\n"):
+            line = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            commands.append(f"BT /F1 9 Tf 36 {y} Td ({line}) Tj ET")
+            y -= 12
+        stream = "\n".join(commands)
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    out = "%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    return out.encode("latin-1")
+
+
+# --- Offline stand-ins for the model and the Groq API ------------------------------------
+
+class HashingEmbeddings:
+    """Drop-in for HuggingFaceEmbeddings: signed feature hashing of lowercase words.
+
+    Deterministic and needs no model files; texts sharing words get similar vectors, so
+    retrieval still returns sensible chunks.
+    """
+
+    def __init__(self, model_name: str = "hashing", model_kwargs: Optional[dict] = None, dimension: int = 384):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.client = self
+
+    def encode(self, texts: List[str], normalize_embeddings: bool = True, **kwargs) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                digest = zlib.crc32(word.encode("utf-8"))
+                vectors[row, digest % self.dimension] += 1.0 if digest & 0x80000000 else -1.0
+        if normalize_embeddings:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors /= np.where(norms == 0, 1, norms)
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text])[0].tolist()
+
+
+def canned_response(prompt: str, json_mode: bool = False) -> str:
+    """Pick the canned output for a prompt by what it asks for."""
+    if "multiple-choice" in prompt:
+        return FAKE_QUIZ_JSON if json_mode else FAKE_QUIZ
+    if "flashcards" in prompt:
+        return FAKE_FLASHCARDS_JSON if json_mode else FAKE_FLASHCARDS
+    if "conversation title" in prompt:
+        return FAKE_TITLE
+    if "Update the summary" in prompt:
+        return FAKE_SUMMARY
+    return FAKE_ANSWER
+
+
+class FakeChatGroq(BaseChatModel):
+    """Deterministic ChatGroq stand-in with Groq-like latency and usage reports.
+
+    A call waits `first_token_ms`, then `token_ms` per output token (approximated as
+    4 characters); streaming yields one word at a time on that schedule.
+    """
+
+    model_name: str = "fake-groq"
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+    first_token_ms: float = 300.0
+    token_ms: float = 2.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-groq"
+
+    def _reply(self, messages: List[BaseMessage], response_format: Optional[dict] = None):
+        prompt = "\n".join(str(message.content) for message in messages)
+        text = canned_response(prompt, json_mode=(response_format or {}).get("type") == "json_object")
+        usage = {
+            "input_tokens": math.ceil(len(prompt) / 4),
+            "output_tokens": math.ceil(len(text) / 4),
+        }
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        return text, usage
+
+    def _duration(self, text: str) -> float:
+        return (self.first_token_ms + self.token_ms * math.ceil(len(text) / 4)) / 1000
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        text, usage = self._reply(messages, kwargs.get("response_format"))
+        time.sleep(self._duration(text))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                         **kwargs: Any) -> ChatResult:
+        text, usage = self._reply(messages, kwargs.get("response_format"))
+        await asyncio.sleep(self._duration(text))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        text, usage = self._reply(messages, kwargs.get("response_format"))
+        time.sleep(self.first_token_ms / 1000)
+        for word in re.findall(r"\S+\s*", text):
+            time.sleep(self.token_ms * math.ceil(len(word) / 4) / 1000)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=usage))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any):
+        text, usage = self._reply(messages, kwargs.get("response_format"))
+        await asyncio.sleep(self.first_token_ms / 1000)
+        for word in re.findall(r"\S+\s*", text):
+            await asyncio.sleep(self.token_ms * math.ceil(len(word) / 4) / 1000)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=usage))
+
+
+def fake_chat_groq_factory(first_token_ms: float, token_ms: float) -> Callable[..., FakeChatGroq]:
+    """Callable with ChatGroq's constructor signature, as used by LLMPool."""
+    def create(model_name: str = "fake-groq", temperature: Optional[float] = None,
+               max_tokens: Optional[int] = None, **kwargs: Any) -> FakeChatGroq:
+        return FakeChatGroq(
+            model_name=model_name, temperature=temperature, max_tokens=max_tokens,
+            first_token_ms=first_token_ms, token_ms=token_ms,
+        )
+    return create
+
+
+# --- Measurement -------------------------------------------------------------------
+
+def current_rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):  # no /proc, or no os.sysconf on Windows
+        return None
+
+
+class RssSampler:
+    """Samples resident memory in a thread while a scenario runs.
+
+    Falls back to the process-lifetime peak (getrusage) where /proc isn't available, and
+    reports no peak (None) where neither is, as on Windows.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak: Optional[int] = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        self.peak = current_rss_bytes() or 0
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = current_rss_bytes()
+            if rss is not None:
+                self.peak = max(self.peak, rss)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        if not self.peak:
+            try:
+                import resource
+            except ImportError:
+                self.peak = None
+                return False
+            # ru_maxrss is in kilobytes on Linux, bytes on macOS
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.peak = maxrss if sys.platform == "darwin" else maxrss * 1024
+        return False
+
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+async def run_load(operation: Callable[[int], Awaitable[Any]], count: int, concurrency: int) -> Dict:
+    """Run `operation(i)` for i in range(count), at most `concurrency` at a time.
+
+    An operation fails by raising; failures count as errors and are left out of latencies.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    latencies: List[float] = []
+    errors: List[str] = []
+
+    async def one(index: int):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await operation(index)
+            except Exception as e:
+                errors.append(str(e))
+                return
+            latencies.append(time.perf_counter() - start)
+
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(index) for index in range(count)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    ms = lambda seconds: round(seconds * 1000, 2) if seconds is not None else None
+    return {
+        "requests": count,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "first_error": errors[0][:200] if errors else None,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "peak_rss_mb": round(rss.peak / (1024 * 1024), 1) if rss.peak is not None else None,
+    }
+
+
+def compare(report: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    """Scenarios whose p95 latency or throughput regressed by more than `max_regression`."""
+    regressions = []
+    for name, result in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        if result["p95_ms"] and before.get("p95_ms") and result["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {result['p95_ms']}ms")
+        if (result["throughput_rps"] is not None and before.get("throughput_rps")
+                and result["throughput_rps"] < before["throughput_rps"] * (1 - max_regression)):
+            regressions.append(f"{name}: throughput {before['throughput_rps']} -> {result['throughput_rps']} req/s")
+        if result["errors"] > before.get("errors", 0):
+            regressions.append(f"{name}: {result['errors']} errors (baseline {before.get('errors', 0)})")
+    return regressions
+
+
+def print_report(report: Dict):
+    columns = ["requests", "concurrency", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "peak_rss_mb"]
+    print()
+    print(f"{'scenario':<14}" + "".join(f"{column:>15}" for column in columns))
+    for name, result in report["scenarios"].items():
+        cells = ["-" if result[column] is None else str(result[column]) for column in columns]
+        print(f"{name:<14}" + "".join(f"{cell:>15}" for cell in cells))
+        if result["first_error"]:
+            print(f"{'':<14}first error: {result['first_error']}")
+
+
+def print_index_comparison(rows: List[Dict]):
+    columns = ["backend", "vectors", "bytes", "flat_bytes", "recall_at_4", "build_ms"]
+    print()
+    print(f"{'requested':<14}" + "".join(f"{column:>15}" for column in columns))
+    for row in rows:
+        print(f"{row['requested']:<14}" + "".join(f"{str(row.get(column, '-')):>15}" for column in columns))
+
+
+def synthetic_vectors(count: int, dimension: int, seed: int) -> np.ndarray:
+    """Normalized vectors in clusters of ~50, roughly like chunks of related passages."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, count // 50), dimension))
+    vectors = centers[rng.integers(0, len(centers), count)] + 0.5 * rng.normal(size=(count, dimension))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+# --- Scenarios -----------------------------------------------------------------------
+
+def configure(args, workdir: str):
+    """Point every on-disk store at `workdir` and swap in the offline stand-ins.
+
+    Runs before `main` is imported, because module-level singletons read settings then.
+    """
+    settings.GROQ_API_KEY = settings.GROQ_API_KEY or "offline-benchmark"
+    settings.INDEX_CACHE_DIR = os.path.join(workdir, "indexes")
+    settings.SESSION_SPILL_DIR = os.path.join(workdir, "sessions")
+    settings.ARTIFACT_CACHE_DIR = os.path.join(workdir, "artifacts")
+    settings.JOBS_DB = os.path.join(workdir, "jobs.sqlite3")
+    settings.SESSION_SHARED_DIR = os.path.join(workdir, "shared")
+    settings.ANSWER_CACHE_MAX_PER_DOCUMENT = 0  # every chat request goes through retrieval and the LLM
+    settings.ARTIFACT_PRECOMPUTE = ["name", "quiz", "flashcards"] if args.precompute else []
+    settings.SESSION_MEMORY_BUDGET_MB = max(settings.SESSION_MEMORY_BUDGET_MB, 4096)
+
+    import llm
+    llm.ChatGroq = fake_chat_groq_factory(args.llm_first_token_ms, args.llm_token_ms)
+    if args.embeddings == "hash":
+        import embeddings
+        embeddings.HuggingFaceEmbeddings = HashingEmbeddings
+
+
+async def run_scenarios(args, selected: List[str]) -> Dict[str, Dict]:
+    import httpx
+    import main
+
+    pdfs = [
+        make_pdf(synthetic_pages(args.pages, args.words_per_page, seed=args.seed + index))
+        for index in range(args.uploads)
+    ]
+    questions = [
+        f"What does the document say about {WORDS[index % len(WORDS)]} and {WORDS[(index * 7) % len(WORDS)]}?"
+        for index in range(args.requests)
+    ]
+    results: Dict[str, Dict] = {}
+    session_ids: List[str] = []
+
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+            async def post(path: str, **kwargs) -> Dict:
+                response = await client.post(path, **kwargs)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{path} -> {response.status_code}: {response.text[:200]}")
+                return response.json()
+
+            async def upload(index: int):
+                body = await post("/api/upload", files={"file": (f"bench-{index}.pdf", pdfs[index], "application/pdf")})
+                session_ids.append(body["session_id"])
+
+            needs_sessions = any(name not in ("ingest", "ingest_cached", "parse") for name in selected)
+            if "ingest" in selected:
+                results["ingest"] = await run_load(upload, args.uploads, args.ingest_concurrency)
+            elif needs_sessions or "ingest_cached" in selected:
+                # Later scenarios need indexed sessions; build them without timing
+                for index in range(args.uploads):
+                    await upload(index)
+            if "ingest_cached" in selected:
+                results["ingest_cached"] = await run_load(upload, args.uploads, args.ingest_concurrency)
+            if not session_ids and needs_sessions:
+                raise RuntimeError("No session could be created; see the ingest errors above")
+
+            def session_for(index: int) -> str:
+                return session_ids[index % len(session_ids)]
+
+            async def retrieve(index: int):
+                session = await main.sessions.aget(session_for(index))
+                await main.prepare_chat(session, questions[index])
+
+            async def chat(index: int):
+                await post("/api/chat", json={"question": questions[index], "session_id": session_for(index)})
+
+            async def quiz(index: int):
+                await post("/api/quiz", json={"session_id": session_for(index), "refresh": True})
+
+            async def flashcards(index: int):
+                await post("/api/flashcards", json={"session_id": session_for(index), "refresh": True})
+
+            for name, operation, count in (
+                ("retrieval", retrieve, args.requests),
+                ("chat", chat, args.requests),
+                ("quiz", quiz, args.generations),
+                ("flashcards", flashcards, args.generations),
+            ):
+                if name in selected:
+                    results[name] = await run_load(operation, count, args.concurrency)
+
+    if "parse" in selected:
+        async def parse(index: int):
+            main.parse_quiz(FAKE_QUIZ)
+            main.parse_quiz(FAKE_QUIZ_JSON)
+            main.parse_flashcards(FAKE_FLASHCARDS)
+            main.parse_flashcards(FAKE_FLASHCARDS_JSON)
+        results["parse"] = await run_load(parse, args.parse_iterations, 1)
+    return results
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--pages", type=int, default=20, help="pages per synthetic PDF")
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--uploads", type=int, default=8, help="distinct PDFs (and sessions)")
+    parser.add_argument("--ingest-concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=64, help="retrieval and chat requests")
+    parser.add_argument("--generations", type=int, default=16, help="quiz and flashcard requests")
+    parser.add_argument("--parse-iterations", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent retrieval/chat/generation requests")
+    parser.add_argument("--llm-first-token-ms", type=float, default=300.0, help="fake LLM time to first token")
+    parser.add_argument("--llm-token-ms", type=float, default=2.0, help="fake LLM time per output token")
+    parser.add_argument("--embeddings", choices=["model", "hash"], default="model",
+                        help="locally cached embedding model, or a hashing embedder that needs no files")
+    parser.add_argument("--precompute", action="store_true",
+                        help="generate the title, quiz and flashcards in the background after uploads")
+    parser.add_argument("--compare-indexes", type=int, default=0, metavar="N",
+                        help="also compare the index backends over N synthetic 384-d vectors")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", dest="json_path", help="write the report to this file")
+    parser.add_argument("--baseline", help="report to compare against; exit 1 on regression")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="allowed relative slowdown of p95 or throughput against --baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    selected = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = sorted(set(selected) - set(SCENARIOS))
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    workdir = tempfile.mkdtemp(prefix="pdfchat-bench-")
+    try:
+        configure(args, workdir)
+        results = asyncio.run(run_scenarios(args, selected))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    from context import token_counter
+    report = {
+        "config": {
+            key: value for key, value in vars(args).items()
+            if key not in ("scenarios", "json_path", "baseline", "max_regression", "compare_indexes")
+        },
+        "python": sys.version.split()[0],
+        "cpus": os.cpu_count(),
+        "exact_token_counts": token_counter.exact,
+        "scenarios": results,
+    }
+    print_report(report)
+    if not report["exact_token_counts"]:
+        print(f"\nNote: tokenizer '{settings.CONTEXT_TOKENIZER}' was not available locally, so context "
+              "budgets used approximate token counts (~4 characters per token)")
+    if args.compare_indexes:
+        from vector_index import compare_backends
+        report["indexes"] = compare_backends(synthetic_vectors(args.compare_indexes, 384, args.seed))
+        print_index_comparison(report["indexes"])
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if (baseline.get("config") != report["config"]
+                or baseline.get("exact_token_counts", True) != report["exact_token_counts"]):
+            print("Warning: baseline was recorded with different settings", file=sys.stderr)
+        regressions = compare(report, baseline, args.max_regression)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            return 1
+        print(f"\nNo regressions beyond {args.max_regression:.0%} of the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""Chunk clean-up between text extraction and indexing.
+
+PDF pages repeat running headers, footers and page numbers ("page furniture"), and
+documents repeat boilerplate. Left in, these become near-identical chunks that take
+index space and crowd real passages out of the top-k results. Each document goes
+through these steps:
+
+- FurnitureFilter drops lines that recur at the top or bottom of most nearby pages.
+- deduplicate() drops chunks that repeat an earlier chunk exactly, or nearly (MinHash
+  over word shingles, with candidates found by LSH banding).
+- group_segments() (CHUNK_SEMANTIC only) joins short, already-embedded segments into
+  chunks, cutting where neighbouring segments are least similar. A chunk's vector is
+  the normalized mean of its segments' vectors, so no text is embedded twice.
+"""
+import hashlib
+import math
+import re
+import zlib
+from collections import Counter, deque
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+# A line must recur on at least this many pages to count as furniture
+MIN_FURNITURE_PAGES = 3
+# Headers and footers are short; longer lines are body text even when they repeat
+MAX_FURNITURE_LINE_CHARS = 160
+# Words per shingle for near-duplicate detection
+SHINGLE_WORDS = 3
+# MinHash permutations, split into LSH bands of equal size
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+MERSENNE_PRIME = (1 << 31) - 1
+
+WHITESPACE = re.compile(r"\s+")
+DIGITS = re.compile(r"\d+")
+WORD = re.compile(r"\w+")
+
+_rng = np.random.default_rng(20240611)
+_PERMUTATION_A = _rng.integers(1, MERSENNE_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+_PERMUTATION_B = _rng.integers(0, MERSENNE_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+class FurnitureFilter:
+    """Strips repeated page furniture from a stream of (page_index, text).
+
+    A line is furniture when it is among the first or last `edge_lines` non-blank lines
+    of at least `min_fraction` of the non-empty pages in a window of `window` pages
+    around it, and is short enough to be a header or footer. Digits are ignored when
+    comparing lines, so "Page 3 of 40" matches "Page 4 of 40". Pages are yielded in
+    order, `window // 2` pages behind the input.
+    """
+
+    def __init__(self, edge_lines: int = 3, min_fraction: float = 0.5, window: int = 12):
+        self.edge_lines = max(1, edge_lines)
+        self.min_fraction = min_fraction
+        self.half_window = max(1, window // 2)
+        self.lines_removed = 0
+        self.chars_removed = 0
+
+    @staticmethod
+    def _key(line: str) -> str:
+        return DIGITS.sub("#", WHITESPACE.sub(" ", line.strip().lower()))
+
+    def _edges(self, lines: List[str]) -> List[int]:
+        """Positions of the edge lines of a page."""
+        nonblank = [position for position, line in enumerate(lines) if line.strip()]
+        if len(nonblank) > 2 * self.edge_lines:
+            nonblank = nonblank[:self.edge_lines] + nonblank[-self.edge_lines:]
+        return [position for position in nonblank if len(lines[position].strip()) <= MAX_FURNITURE_LINE_CHARS]
+
+    def _clean(self, lines: List[str], edges: List[int], window: Iterable[Set[str]]) -> str:
+        window = list(window)
+        pages = sum(1 for keys in window if keys)
+        needed = max(MIN_FURNITURE_PAGES, math.ceil(self.min_fraction * pages))
+        if pages < needed:
+            return "\n".join(lines)
+        counts = Counter(key for keys in window for key in keys)
+        removed = {position for position in edges if counts[self._key(lines[position])] >= needed}
+        for position in removed:
+            self.lines_removed += 1
+            self.chars_removed += len(lines[position])
+        return "\n".join(line for position, line in enumerate(lines) if position not in removed)
+
+    def filter(self, pages: Iterable[Tuple[int, str]]) -> Iterator[Tuple[int, str]]:
+        # (number, lines, edge positions, edge keys) of the pages around the next one to yield
+        pending: Deque[Tuple[int, List[str], List[int], Set[str]]] = deque()
+        first = 0  # position of pending[0] in the stream
+        emitted = 0  # pages yielded so far
+        received = 0
+
+        def emit() -> Tuple[int, str]:
+            number, lines, edges, _ = pending[emitted - first]
+            window = (keys for position, (_, _, _, keys) in enumerate(pending, first)
+                      if abs(position - emitted) <= self.half_window)
+            return number, self._clean(lines, edges, window)
+
+        for number, text in pages:
+            lines = text.split("\n")
+            edges = self._edges(lines)
+            pending.append((number, lines, edges, {self._key(lines[position]) for position in edges}))
+            received += 1
+            if received - emitted > self.half_window:
+                yield emit()
+                emitted += 1
+                while emitted - first > self.half_window:
+                    pending.popleft()
+                    first += 1
+        while emitted < received:
+            yield emit()
+            emitted += 1
+
+
+def _normalized(text: str) -> str:
+    return WHITESPACE.sub(" ", text).strip().lower()
+
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    """MinHash signature of the text's word shingles; None when it has too few words."""
+    words = WORD.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return None
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+    # (a * x + b) mod p for each permutation; a, b < 2^31 and x < 2^32 keep this within uint64
+    permuted = (_PERMUTATION_A[:, None] * hashes[None, :] + _PERMUTATION_B[:, None]) % MERSENNE_PRIME
+    return permuted.min(axis=1)
+
+
+def deduplicate(chunks: List[Document], near_threshold: float = 0.85) -> Tuple[List[Document], Dict[str, int]]:
+    """Drop chunks that repeat an earlier one, keeping the first occurrence.
+
+    Exact duplicates are compared after whitespace and case normalization. Near duplicates
+    have an estimated Jaccard similarity of at least `near_threshold` between their word
+    shingles; a threshold of 0 or more than 1 disables near-duplicate detection.
+    """
+    rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+    check_near = 0 < near_threshold <= 1
+    seen: Set[bytes] = set()
+    buckets: Dict[Tuple[int, bytes], List[int]] = {}
+    signatures: List[np.ndarray] = []
+    kept: List[Document] = []
+    stats = {"exact_duplicates": 0, "near_duplicates": 0, "duplicate_chars": 0}
+
+    for chunk in chunks:
+        digest = hashlib.blake2b(_normalized(chunk.page_content).encode(), digest_size=16).digest()
+        if digest in seen:
+            stats["exact_duplicates"] += 1
+            stats["duplicate_chars"] += len(chunk.page_content)
+            continue
+        seen.add(digest)
+
+        signature = minhash(chunk.page_content) if check_near else None
+        if signature is not None:
+            bands = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(MINHASH_BANDS)]
+            candidates = {candidate for band in bands for candidate in buckets.get(band, ())}
+            if any(np.mean(signatures[candidate] == signature) >= near_threshold for candidate in candidates):
+                stats["near_duplicates"] += 1
+                stats["duplicate_chars"] += len(chunk.page_content)
+                continue
+            for band in bands:
+                buckets.setdefault(band, []).append(len(signatures))
+            signatures.append(signature)
+        kept.append(chunk)
+    return kept, stats
+
+
+def group_segments(segments: List[Document], vectors: np.ndarray,
+                   max_chars: int) -> Tuple[List[Document], np.ndarray]:
+    """Join consecutive segments into chunks of at most `max_chars` characters.
+
+    Segments are concatenated as they are, and only where one ends at the next one's
+    `start_index`, so each chunk is the source text at its `start_index`. A segment
+    dropped as a duplicate leaves a gap, and the chunk ends there.
+    Each chunk is cut after the segment least similar to the one that follows it, among
+    the cuts that leave the chunk at least half full. Chunks keep the metadata of their
+    first segment.
+    """
+    if len(segments) == 0:
+        return [], vectors
+    # Vectors are normalized, so neighbouring dot products are cosine similarities
+    similarity = np.einsum("ij,ij->i", vectors[:-1], vectors[1:]) if len(segments) > 1 else np.zeros(0)
+    lengths = [len(segment.page_content) for segment in segments]
+    starts = [segment.metadata.get("start_index") for segment in segments]
+    contiguous = [start is not None and start + length == next_start
+                  for start, length, next_start in zip(starts, lengths, starts[1:])]
+    chunks: List[Document] = []
+    chunk_vectors: List[np.ndarray] = []
+    start = 0
+    while start < len(segments):
+        end = start + 1  # exclusive
+        size = lengths[start]
+        while end < len(segments) and contiguous[end - 1] and size + lengths[end] <= max_chars:
+            size += lengths[end]
+            end += 1
+        if end < len(segments) and contiguous[end - 1]:
+            # Cut positions whose chunk is at least half full; the last segment always qualifies
+            cuts = [cut for cut in range(start + 1, end + 1)
+                    if sum(lengths[start:cut]) >= max_chars // 2] or [end]
+            end = min(cuts, key=lambda cut: similarity[cut - 1])
+        # Trailing whitespace only, so the chunk still starts at its start_index
+        text = "".join(segment.page_content for segment in segments[start:end]).rstrip()
+        mean = vectors[start:end].mean(axis=0)
+        chunks.append(Document(page_content=text, metadata=dict(segments[start].metadata)))
+        chunk_vectors.append(mean / (np.linalg.norm(mean) or 1.0))
+        start = end
+    return chunks, np.stack(chunk_vectors).astype(vectors.dtype, copy=False)
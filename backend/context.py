@@ -0,0 +1,274 @@
+"""Token-budgeted prompt context shared by chat, quiz, flashcard and title generation.
+
+Retrieved chunks are taken in relevance order until the endpoint's token budget is full.
+Text repeated by the splitter's chunk overlap is dropped, a chunk that doesn't fit is cut
+at a sentence boundary, and the kept text is laid out in document order so neighbouring
+chunks read as one passage.
+"""
+import math
+import re
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage
+
+import settings
+from metrics import CONTEXT_TOKENS, PROMPT_TOKENS, RETRIEVED_CHUNKS
+
+# Role markers and separators the chat template adds around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+# Don't bother adding a fragment of a chunk shorter than this
+MIN_FRAGMENT_TOKENS = 24
+# Allowance for a "[file.pdf, page N]" label in multi-document contexts
+LABEL_TOKENS = 12
+# Blank line between passages
+SEPARATOR_TOKENS = 1
+
+# A sentence ends at . ! or ? followed by whitespace, or at a line break
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+|\n+")
+WORD_BREAK = re.compile(r"\s+")
+
+
+class TokenCounter:
+    """Counts tokens with tiktoken when the encoding is available locally.
+
+    Otherwise falls back to ~4 characters per token, and `exact` is False.
+    """
+
+    def __init__(self, encoding_name: str):
+        self.encoding_name = encoding_name
+        self.exact = False
+        self._encoding = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            try:
+                import tiktoken
+                self._encoding = tiktoken.get_encoding(self.encoding_name)
+                self.exact = True
+            except Exception as e:
+                print(f"Tokenizer '{self.encoding_name}' unavailable, approximating token counts: {e}")
+
+    def count(self, text: str) -> int:
+        if not self._loaded:
+            self.load()
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode_ordinary(text))
+        return math.ceil(len(text) / 4)
+
+    def count_messages(self, messages: Sequence[BaseMessage]) -> int:
+        return sum(self.count(str(message.content)) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+    def truncate(self, text: str, budget: int, hard: bool = False) -> str:
+        """Longest prefix of whole sentences within `budget` tokens.
+
+        With `hard`, text whose first sentence is already too long is cut between words
+        instead of returning "".
+        """
+        if self.count(text) <= budget:
+            return text
+        for pattern in (SENTENCE_BREAK, WORD_BREAK) if hard else (SENTENCE_BREAK,):
+            cuts = [match.start() for match in pattern.finditer(text) if match.start() > 0]
+            # Token count grows with the prefix, so binary search for the last cut that fits
+            low, high, best = 0, len(cuts) - 1, None
+            while low <= high:
+                middle = (low + high) // 2
+                if self.count(text[:cuts[middle]]) <= budget:
+                    best = middle
+                    low = middle + 1
+                else:
+                    high = middle - 1
+            if best is not None:
+                return text[:cuts[best]]
+        return ""
+
+    def status(self) -> dict:
+        return {"encoding": self.encoding_name, "exact": self.exact}
+
+
+class Context:
+    """Assembled prompt context and what went into it."""
+
+    def __init__(self, text: str, tokens: int, documents: List[Document], truncated: bool, retrieved: int):
+        self.text = text
+        self.tokens = tokens
+        self.documents = documents  # retrieved chunks that contributed text, in relevance order
+        self.truncated = truncated  # some retrieved text didn't fit in the budget
+        self.retrieved = retrieved  # chunks offered to the builder
+
+
+def _uncovered(start: int, end: int, covered: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Parts of [start, end) not inside any of the `covered` intervals."""
+    pieces = [(start, end)]
+    for covered_start, covered_end in covered:
+        next_pieces = []
+        for piece_start, piece_end in pieces:
+            if covered_end <= piece_start or covered_start >= piece_end:
+                next_pieces.append((piece_start, piece_end))
+                continue
+            if piece_start < covered_start:
+                next_pieces.append((piece_start, covered_start))
+            if covered_end < piece_end:
+                next_pieces.append((covered_end, piece_end))
+        pieces = next_pieces
+    return pieces
+
+
+def build_context(docs: Sequence[Document], budget: int,
+                  documents: Optional[Dict[str, dict]] = None) -> Context:
+    """Fill `budget` tokens with the most relevant chunks first.
+
+    `docs` must be in relevance order. Overlap between chunks of the same document is
+    removed using their `start_index`; chunks without one are only deduplicated when
+    identical. When `documents` (the session's registry) is given and the chunks come
+    from several of them, each passage is labelled with its file name and page so
+    answers can cite it.
+    """
+    multi_document = documents is not None and len({doc.metadata.get("document_id") for doc in docs}) > 1
+    overhead = SEPARATOR_TOKENS + (LABEL_TOKENS if multi_document else 0)
+    covered: Dict[str, List[Tuple[int, int]]] = {}
+    seen_texts = set()
+    taken: List[Tuple[str, int, str, dict]] = []  # (document_id, start, text, metadata)
+    used: List[Document] = []
+    document_order: Dict[str, int] = {}
+    remaining = budget
+    truncated = False
+
+    for doc in docs:
+        text = doc.page_content
+        document_id = str(doc.metadata.get("document_id", ""))
+        start = doc.metadata.get("start_index")
+        if start is None:
+            if text in seen_texts:
+                continue
+            seen_texts.add(text)
+            pieces = [(len(taken), text)]  # keep relevance order among unpositioned chunks
+        else:
+            spans = covered.setdefault(document_id, [])
+            pieces = [(s, text[s - start:e - start]) for s, e in _uncovered(start, start + len(text), spans)]
+
+        contributed = False
+        for piece_start, piece in pieces:
+            if not piece.strip():
+                continue
+            cost = token_counter.count(piece) + overhead
+            if cost > remaining:
+                truncated = True
+                if remaining < MIN_FRAGMENT_TOKENS:
+                    continue
+                # Only the most relevant chunk may be cut mid-sentence; otherwise it would be dropped
+                piece = token_counter.truncate(piece, remaining - overhead, hard=not taken)
+                if not piece.strip():
+                    continue
+                cost = token_counter.count(piece) + overhead
+            taken.append((document_id, piece_start, piece, doc.metadata))
+            document_order.setdefault(document_id, len(document_order))
+            if start is not None:
+                covered[document_id].append((piece_start, piece_start + len(piece)))
+            remaining -= cost
+            contributed = True
+        if contributed:
+            used.append(doc)
+        if remaining < MIN_FRAGMENT_TOKENS:
+            truncated = truncated or len(used) < len(docs)
+            break
+
+    # Document order, merging pieces that continue one another
+    taken.sort(key=lambda item: (document_order[item[0]], item[1]))
+    passages: List[Tuple[str, int, str, dict]] = []
+    for document_id, piece_start, piece, metadata in taken:
+        if passages:
+            last_id, last_start, last_text, last_metadata = passages[-1]
+            if last_id == document_id and last_start + len(last_text) == piece_start:
+                passages[-1] = (last_id, last_start, last_text + piece, last_metadata)
+                continue
+        passages.append((document_id, piece_start, piece, metadata))
+
+    blocks = []
+    for document_id, _, passage, metadata in passages:
+        passage = passage.strip()
+        if multi_document:
+            filename = documents.get(document_id, {}).get("filename") or document_id[:12]
+            page = metadata.get("page")
+            label = f"[{filename}, page {page}]" if page is not None else f"[{filename}]"
+            passage = f"{label}\n{passage}"
+        blocks.append(passage)
+    text = "\n\n".join(blocks)
+    return Context(text, token_counter.count(text), used, truncated, len(docs))
+
+
+def fit_history(history: Sequence[tuple], budget: int, max_turns: int = 3) -> str:
+    """The most recent exchanges (up to `max_turns`) that fit in `budget` tokens, oldest first."""
+    turns: List[str] = []
+    remaining = budget
+    for question, answer in reversed(history[-max_turns:] if max_turns else history):
+        turn = f"Q: {question}\nA: {answer}"
+        cost = token_counter.count(turn)
+        if cost > remaining:
+            break
+        turns.append(turn)
+        remaining -= cost
+    return "\n".join(reversed(turns))
+
+
+class ContextStats:
+    """Per-endpoint prompt sizes, for tuning the token budgets."""
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, messages: Sequence[BaseMessage], context: Optional[Context] = None) -> int:
+        """Record one prompt; returns its token count."""
+        prompt_tokens = token_counter.count_messages(messages)
+        PROMPT_TOKENS.observe(prompt_tokens, endpoint)
+        if context is not None:
+            CONTEXT_TOKENS.observe(context.tokens, endpoint)
+            RETRIEVED_CHUNKS.observe(context.retrieved, endpoint, "retrieved")
+            RETRIEVED_CHUNKS.observe(len(context.documents), endpoint, "used")
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, {
+                "calls": 0, "prompt_tokens": 0, "prompt_tokens_max": 0, "context_tokens": 0, "truncated": 0,
+            })
+            stats["calls"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["prompt_tokens_max"] = max(stats["prompt_tokens_max"], prompt_tokens)
+            if context is not None:
+                stats["context_tokens"] += context.tokens
+                stats["truncated"] += int(context.truncated)
+        return prompt_tokens
+
+    def status(self) -> dict:
+        with self._lock:
+            endpoints = {}
+            for endpoint, stats in self._stats.items():
+                calls = stats["calls"]
+                endpoints[endpoint] = {
+                    "calls": calls,
+                    "budget_tokens": CONTEXT_BUDGETS.get(endpoint),
+                    "prompt_tokens_mean": round(stats["prompt_tokens"] / calls, 1),
+                    "prompt_tokens_max": stats["prompt_tokens_max"],
+                    "context_tokens_mean": round(stats["context_tokens"] / calls, 1),
+                    "truncated": stats["truncated"],
+                }
+            return {"tokenizer": token_counter.status(), "endpoints": endpoints}
+
+
+# Context token budget per endpoint
+CONTEXT_BUDGETS = {
+    "chat": settings.CONTEXT_TOKENS_CHAT,
+    "quiz": settings.CONTEXT_TOKENS_QUIZ,
+    "flashcards": settings.CONTEXT_TOKENS_FLASHCARDS,
+    "name": settings.CONTEXT_TOKENS_NAME,
+}
+
+token_counter = TokenCounter(settings.CONTEXT_TOKENIZER)
+context_stats = ContextStats()
@@ -0,0 +1,284 @@
+"""Process-wide embedding model shared by every endpoint.
+
+Encode requests from concurrent uploads and chat questions are coalesced by a single
+worker thread into micro-batches of up to EMBEDDING_BATCH_SIZE texts. The first request
+in a batch waits at most EMBEDDING_BATCH_WAIT_MS for others to join it.
+"""
+import asyncio
+import itertools
+import queue
+import time
+import threading
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
+
+import settings
+from metrics import Histogram, metrics
+
+# Queue priorities: questions jump ahead of document chunks
+QUERY_PRIORITY = 0
+DOCUMENT_PRIORITY = 1
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+QUEUE_LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class _Request:
+    __slots__ = ("texts", "future", "enqueued")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: Future = Future()
+        self.enqueued = time.monotonic()
+
+
+class BatchedEmbeddings(Embeddings):
+    """LangChain adapter so FAISS vector stores encode through the shared batcher."""
+
+    def __init__(self, engine: "EmbeddingEngine"):
+        self.engine = engine
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.engine.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.engine.encode([text], query=True)[0].tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return (await self.engine.aencode(texts)).tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.engine.aencode([text], query=True))[0].tolist()
+
+
+class EmbeddingEngine:
+    """Loads the sentence-transformers model once and batches encode calls across requests.
+
+    Vectors are returned as L2-normalized float32 arrays, so inner product and L2
+    distance rank results the same way as cosine similarity.
+    """
+
+    def __init__(self, model_name: str, device: str = "cpu", local_files_only: bool = True,
+                 batch_size: int = 64, batch_wait_ms: float = 5.0):
+        self.model_name = model_name
+        self.device = device
+        self.local_files_only = local_files_only
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = max(0.0, batch_wait_ms) / 1000
+        self.embeddings: Optional[HuggingFaceEmbeddings] = None
+        self.adapter = BatchedEmbeddings(self)
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.dimension: Optional[int] = None
+        self._lock = threading.Lock()
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._worker: Optional[threading.Thread] = None
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_latency_ms = Histogram(QUEUE_LATENCY_BUCKETS_MS)
+        self.batches = 0
+        self.texts = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.embeddings is not None
+
+    def load(self) -> HuggingFaceEmbeddings:
+        """Load the model, run a warm-up encode and start the batching worker.
+
+        Raises if the model is not cached locally.
+        """
+        with self._lock:
+            if self.embeddings is not None:
+                return self.embeddings
+
+            start = time.perf_counter()
+            try:
+                embeddings = HuggingFaceEmbeddings(
+                    model_name=self.model_name,
+                    model_kwargs={"device": self.device, "local_files_only": self.local_files_only},
+                )
+            except Exception as e:
+                raise RuntimeError(
+                    f"Could not load embedding model '{self.model_name}'"
+                    f"{' from the local cache' if self.local_files_only else ''}: {e}"
+                ) from e
+            self.load_seconds = time.perf_counter() - start
+
+            # Warm-up encode so the first real request doesn't pay for lazy initialisation
+            start = time.perf_counter()
+            self.dimension = len(embeddings.embed_query("warm-up"))
+            self.warmup_seconds = time.perf_counter() - start
+
+            self.embeddings = embeddings
+            self._start_worker()
+            print(
+                f"Embedding model '{self.model_name}' loaded in {self.load_seconds:.2f}s "
+                f"(warm-up {self.warmup_seconds * 1000:.0f}ms, dim={self.dimension})"
+            )
+            return embeddings
+
+    def get(self) -> Embeddings:
+        """Return the shared (batched) embeddings, loading the model on first use if startup didn't."""
+        if self.embeddings is None:
+            self.load()
+        return self.adapter
+
+    def _start_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+            self._worker.start()
+
+    def shutdown(self):
+        """Stop the batching worker once the requests already queued are done."""
+        worker = self._worker
+        if worker is None:
+            return
+        # Sorts after every real request
+        self._queue.put((DOCUMENT_PRIORITY + 1, 0, next(self._sequence), None))
+        worker.join()
+        self._worker = None
+
+    def _encode_now(self, texts: List[str]) -> np.ndarray:
+        vectors = self.embeddings.client.encode(
+            texts,
+            batch_size=len(texts),
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def _submit(self, texts: List[str], priority: int, round_index: int) -> Future:
+        request = _Request(texts)
+        self._queue.put((priority, round_index, next(self._sequence), request))
+        return request.future
+
+    def submit(self, texts: Sequence[str], query: bool = False) -> List[Future]:
+        """Queue `texts` for encoding, one future per slice of at most `batch_size` texts.
+
+        Slice i of every upload is queued at round i, so a large document cannot hold back
+        a smaller one that arrives after it; questions go ahead of all document chunks.
+        """
+        if self.embeddings is None:
+            self.load()
+        texts = list(texts)
+        priority = QUERY_PRIORITY if query else DOCUMENT_PRIORITY
+        return [
+            self._submit(texts[start:start + self.batch_size], priority, round_index)
+            for round_index, start in enumerate(range(0, len(texts), self.batch_size))
+        ]
+
+    def _empty(self) -> np.ndarray:
+        return np.empty((0, self.dimension or 0), dtype=np.float32)
+
+    def encode(self, texts: Sequence[str], query: bool = False,
+               on_progress: Optional[Callable[[float], None]] = None) -> np.ndarray:
+        """Embed `texts` through the batcher; returns a (len(texts), dim) float32 array.
+
+        `on_progress` is called with the fraction of slices done as each one completes.
+        """
+        futures = self.submit(texts, query=query)
+        if not futures:
+            return self._empty()
+        parts = []
+        for future in futures:
+            parts.append(future.result())
+            if on_progress is not None:
+                on_progress(len(parts) / len(futures))
+        return np.vstack(parts)
+
+    async def aencode(self, texts: Sequence[str], query: bool = False) -> np.ndarray:
+        """Async `encode`: waits on the batcher without blocking the event loop."""
+        futures = self.submit(texts, query=query)
+        if not futures:
+            return self._empty()
+        parts = await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+        return np.vstack(parts)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()[-1]
+            if item is None:
+                return
+            batch = [item]
+            size = len(item.texts)
+            deadline = time.monotonic() + self.batch_wait
+            stopping = False
+            while size < self.batch_size:
+                # Once the deadline has passed, still take whatever is already queued
+                timeout = max(0.0, deadline - time.monotonic())
+                try:
+                    entry = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                item = entry[-1]
+                if item is None:
+                    stopping = True
+                    break
+                if size + len(item.texts) > self.batch_size:
+                    # Doesn't fit; it keeps its place at the head of the queue for the next batch
+                    self._queue.put(entry)
+                    break
+                batch.append(item)
+                size += len(item.texts)
+            self._encode_batch(batch, size)
+            if stopping:
+                return
+
+    def _encode_batch(self, batch: List[_Request], size: int):
+        started = time.monotonic()
+        for request in batch:
+            self.queue_latency_ms.observe((started - request.enqueued) * 1000)
+        self.batch_sizes.observe(size)
+        texts = [text for request in batch for text in request.texts]
+        try:
+            vectors = self._encode_now(texts)
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        self.batches += 1
+        self.texts += size
+        offset = 0
+        for request in batch:
+            request.future.set_result(vectors[offset:offset + len(request.texts)])
+            offset += len(request.texts)
+
+    def status(self) -> dict:
+        return {
+            "model": self.model_name,
+            "ready": self.ready,
+            "dimension": self.dimension,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            "warmup_seconds": round(self.warmup_seconds, 3) if self.warmup_seconds is not None else None,
+            "batching": {
+                "max_batch_size": self.batch_size,
+                "max_wait_ms": self.batch_wait * 1000,
+                "queued": self._queue.qsize(),
+                "batches": self.batches,
+                "texts": self.texts,
+                "batch_size": self.batch_sizes.status(),
+                "queue_latency_ms": self.queue_latency_ms.status(),
+            },
+        }
+
+
+embedding_engine = EmbeddingEngine(
+    model_name=settings.EMBEDDING_MODEL,
+    device=settings.EMBEDDING_DEVICE,
+    local_files_only=settings.EMBEDDING_LOCAL_FILES_ONLY,
+    batch_size=settings.EMBEDDING_BATCH_SIZE,
+    batch_wait_ms=settings.EMBEDDING_BATCH_WAIT_MS,
+)
+metrics.register_histogram(
+    "pdfchat_embedding_batch_size", "Texts per embedding model call.", embedding_engine.batch_sizes
+)
+metrics.register_histogram(
+    "pdfchat_embedding_queue_latency_milliseconds", "Time encode requests wait for the batcher.",
+    embedding_engine.queue_latency_ms,
+)
@@ -0,0 +1,232 @@
+"""Content-addressed on-disk cache of FAISS indexes and their chunk stores.
+
+Each entry lives in its own directory named after the SHA-256 of the uploaded PDF
+(plus the embedding model, so switching models never serves stale vectors):
+
+    <INDEX_CACHE_DIR>/<key>/index.faiss   FAISS index
+    <INDEX_CACHE_DIR>/<key>/chunks.json   chunk text + metadata, in index order
+    <INDEX_CACHE_DIR>/<key>/bm25.npz      BM25 inverted index over the same chunks
+
+The directory mtime doubles as the LRU timestamp and is bumped on every hit.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+import faiss
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+import settings
+from retrieval import BM25Index, HybridFAISS
+from vector_index import configure_search
+
+# Bump when chunking or vector layout changes so stale entries are never served
+CACHE_VERSION = 4
+
+INDEX_FILE = "index.faiss"
+CHUNKS_FILE = "chunks.json"
+SPARSE_FILE = "bm25.npz"
+
+# Zero-copy mmap of the vector codes where this faiss build supports it
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+
+def save_index(vector_store: FAISS, directory: Path):
+    """Write a FAISS vector store to `directory` (index + JSON chunk store + BM25 index)."""
+    directory.mkdir(parents=True, exist_ok=True)
+    faiss.write_index(vector_store.index, str(directory / INDEX_FILE))
+    chunks = []
+    for position in range(vector_store.index.ntotal):
+        doc_id = vector_store.index_to_docstore_id[position]
+        doc = vector_store.docstore.search(doc_id)
+        chunks.append({"id": doc_id, "text": doc.page_content, "metadata": doc.metadata})
+    with open(directory / CHUNKS_FILE, "w", encoding="utf-8") as f:
+        json.dump(chunks, f, ensure_ascii=False)
+    if isinstance(vector_store, HybridFAISS):
+        vector_store.sparse_index.save(directory / SPARSE_FILE)
+
+
+def load_index(directory: Path, embeddings: Embeddings, mmap: bool = False) -> HybridFAISS:
+    """Load a vector store written by `save_index`.
+
+    Entries saved without a BM25 index get one rebuilt from the chunks on first search.
+
+    A memory-mapped index is read-only; HybridFAISS copies it into memory before modifying it.
+    """
+    index_path = str(directory / INDEX_FILE)
+    index = None
+    if mmap:
+        try:
+            index = faiss.read_index(index_path, MMAP_FLAGS)
+        except RuntimeError:
+            index = None
+    read_only = index is not None
+    if index is None:
+        index = faiss.read_index(index_path)
+    configure_search(index)
+
+    with open(directory / CHUNKS_FILE, encoding="utf-8") as f:
+        chunks = json.load(f)
+    docstore = InMemoryDocstore({
+        chunk["id"]: Document(page_content=chunk["text"], metadata=chunk.get("metadata") or {})
+        for chunk in chunks
+    })
+    index_to_docstore_id = {position: chunk["id"] for position, chunk in enumerate(chunks)}
+    sparse_path = directory / SPARSE_FILE
+    sparse_index = BM25Index.load(sparse_path) if sparse_path.exists() else None
+    return HybridFAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+        sparse_index=sparse_index,
+        read_only=read_only,
+    )
+
+
+def directory_size(directory: Path) -> int:
+    return sum(f.stat().st_size for f in directory.iterdir() if f.is_file())
+
+
+def prune_lru(directories: List[Path], max_bytes: int) -> int:
+    """Delete the least recently touched directories until they fit in `max_bytes`.
+
+    Returns the number of directories removed.
+    """
+    entries = []
+    for directory in directories:
+        try:
+            entries.append((directory.stat().st_mtime, directory_size(directory), directory))
+        except FileNotFoundError:
+            continue
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, directory in sorted(entries, key=lambda entry: entry[0]):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(directory, ignore_errors=True)
+        total -= size
+        removed += 1
+    return removed
+
+
+class IndexCache:
+    """LRU-bounded cache of saved indexes keyed by document hash."""
+
+    def __init__(self, root: Path, max_bytes: int, namespace: str, mmap: bool = True):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.mmap = mmap
+        # Entries are only valid for the embedding model and chunking settings that produced them
+        self.namespace = hashlib.sha256(f"{namespace}|v{CACHE_VERSION}".encode("utf-8")).hexdigest()[:12]
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _entry_dir(self, doc_hash: str) -> Path:
+        return self.root / f"{doc_hash}-{self.namespace}"
+
+    def load(self, doc_hash: str, embeddings: Embeddings) -> Optional[FAISS]:
+        """Return the cached vector store for `doc_hash`, or None on a miss."""
+        if not self.enabled:
+            return None
+        directory = self._entry_dir(doc_hash)
+        if not (directory / CHUNKS_FILE).exists():
+            self.misses += 1
+            return None
+        try:
+            vector_store = load_index(directory, embeddings, mmap=self.mmap)
+        except Exception as e:
+            print(f"Index cache entry {directory.name} is unreadable, discarding: {e}")
+            shutil.rmtree(directory, ignore_errors=True)
+            self.misses += 1
+            return None
+        os.utime(directory)
+        self.hits += 1
+        return vector_store
+
+    def store(self, doc_hash: str, vector_store: FAISS):
+        """Persist a vector store under `doc_hash`, then evict old entries over the size cap."""
+        if not self.enabled:
+            return
+        directory = self._entry_dir(doc_hash)
+        if directory.exists():
+            os.utime(directory)
+            return
+        # Write to a scratch directory and rename so readers never see a partial entry
+        scratch = self.root / f".tmp-{uuid.uuid4().hex}"
+        try:
+            save_index(vector_store, scratch)
+            os.replace(scratch, directory)
+            self.stores += 1
+        except OSError:
+            # Another worker stored the same document first
+            if not directory.exists():
+                raise
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        self.evict()
+
+    def _entries(self):
+        if not self.root.exists():
+            return []
+        return [d for d in self.root.iterdir() if d.is_dir() and not d.name.startswith(".tmp-")]
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in `max_bytes`."""
+        with self._lock:
+            self.evictions += prune_lru(self._entries(), self.max_bytes)
+
+    def status(self) -> dict:
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(entries),
+            "bytes": sum(directory_size(d) for d in entries),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
+
+
+def cache_namespace() -> str:
+    """The embedding model plus every setting that changes a document's chunks."""
+    return "|".join(str(value) for value in (
+        settings.EMBEDDING_MODEL,
+        settings.CHUNK_SIZE,
+        settings.CHUNK_OVERLAP,
+        settings.CHUNK_STRIP_FURNITURE,
+        settings.CHUNK_FURNITURE_EDGE_LINES,
+        settings.CHUNK_FURNITURE_WINDOW,
+        settings.CHUNK_FURNITURE_MIN_FRACTION,
+        settings.CHUNK_DEDUPE,
+        settings.CHUNK_NEAR_DUPLICATE_THRESHOLD,
+        settings.CHUNK_SEMANTIC,
+        settings.CHUNK_SEMANTIC_SEGMENT_SIZE,
+    ))
+
+
+index_cache = IndexCache(
+    root=Path(settings.INDEX_CACHE_DIR),
+    max_bytes=settings.INDEX_CACHE_MAX_MB * 1024 * 1024,
+    namespace=cache_namespace(),
+    mmap=settings.INDEX_CACHE_MMAP,
+)
@@ -0,0 +1,413 @@
+"""PDF ingestion pipeline, run off the event loop in a bounded worker pool."""
+import asyncio
+import bisect
+import hashlib
+import math
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from itertools import repeat
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from pypdf import PdfReader
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_community.docstore.in_memory import InMemoryDocstore
+
+import settings
+from chunking import FurnitureFilter, deduplicate, group_segments
+from embeddings import embedding_engine
+from metrics import record_stage
+from retrieval import HybridFAISS
+from vector_index import create_index, describe, reconstruct
+
+SPOOL_BLOCK_SIZE = 1024 * 1024
+
+# Fresh interpreters for worker processes: forking a server that has torch threads running can deadlock
+PROCESS_CONTEXT = multiprocessing.get_context("spawn")
+
+
+class PoolSaturated(Exception):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+class IngestPool:
+    """Bounded pool for CPU-heavy ingestion stages.
+
+    Extraction and splitting run on the configured executor (threads or processes).
+    Embedding always runs on a thread because the model lives in this process.
+    """
+
+    def __init__(self, kind: str = "thread", workers: int = 2, queue_size: int = 4):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"INGEST_EXECUTOR must be 'thread' or 'process', got '{kind}'")
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self._executor: Optional[Executor] = None
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._in_flight = 0
+        self.rejected = 0
+        self.completed = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_size
+
+    def start(self):
+        if self._threads is not None:
+            return
+        self._threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ingest")
+        if self.kind == "process":
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=PROCESS_CONTEXT)
+        else:
+            self._executor = self._threads
+
+    def shutdown(self):
+        if self._executor is not None and self._executor is not self._threads:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._threads is not None:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._threads = None
+        shutdown_page_pool()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Reserve room for one upload, or raise PoolSaturated if the queue is full."""
+        if self._in_flight >= self.capacity:
+            self.rejected += 1
+            raise PoolSaturated(f"Ingestion queue is full ({self._in_flight}/{self.capacity})")
+        self._in_flight += 1
+        try:
+            yield
+            self.completed += 1
+        finally:
+            self._in_flight -= 1
+
+    async def run(self, fn: Callable, *args):
+        """Run a picklable stage function on the configured executor."""
+        self.start()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def run_in_thread(self, fn: Callable, *args):
+        """Run a stage that needs this process's state (e.g. the embedding model)."""
+        self.start()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._threads, fn, *args)
+
+    def status(self) -> dict:
+        return {
+            "executor": self.kind,
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "in_flight": self._in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+class StageTimer:
+    """Collects wall-clock milliseconds per pipeline stage.
+
+    An optional `progress` observer (a jobs.JobProgress) is told when each stage starts,
+    finishes, fails or is skipped.
+    """
+
+    def __init__(self, progress=None):
+        self.timings: Dict[str, float] = {}
+        self.progress = progress
+
+    async def run(self, stage: str, awaitable):
+        start = time.perf_counter()
+        if self.progress is not None:
+            self.progress.start(stage)
+        try:
+            result = await awaitable
+        except BaseException:
+            if self.progress is not None:
+                self.progress.fail(stage)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[stage] = round(elapsed * 1000, 1)
+            record_stage(stage, elapsed)
+        if self.progress is not None:
+            self.progress.finish(stage)
+        return result
+
+    def advance(self, stage: str, fraction: float):
+        """Progress within a running stage; callable from worker threads."""
+        if self.progress is not None:
+            self.progress.advance(stage, fraction)
+
+    def skip(self, *stages: str):
+        if self.progress is not None:
+            self.progress.skip(*stages)
+
+
+# Stage functions. These are module-level so they can be shipped to a process pool.
+
+def spool_to_disk(source: BinaryIO) -> Tuple[str, str]:
+    """Copy an uploaded file object to a temporary .pdf file.
+
+    Returns the temp file path and the SHA-256 hex digest of its bytes.
+    """
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+        while True:
+            block = source.read(SPOOL_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            tmp_file.write(block)
+        return tmp_file.name, digest.hexdigest()
+
+
+def _page_has_text_resources(page) -> bool:
+    """Cheap pre-check: a page whose resources have no fonts or XObjects cannot contain text."""
+    resources = page.get("/Resources")
+    if resources is None:
+        # Resources may be inherited from the page tree; let extraction decide
+        return True
+    resources = resources.get_object()
+    return "/Font" in resources or "/XObject" in resources
+
+
+def _extract_page(page) -> str:
+    return (page.extract_text() or "") if _page_has_text_resources(page) else ""
+
+
+def _extract_page_range(pdf_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Extract pages [start, end) of a PDF. Runs inside an extraction worker process."""
+    reader = PdfReader(pdf_path)
+    return [(number, _extract_page(reader.pages[number])) for number in range(start, end)]
+
+
+_page_pool: Optional[ProcessPoolExecutor] = None
+_page_pool_lock = threading.Lock()
+
+
+def _get_page_pool() -> ProcessPoolExecutor:
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            _page_pool = ProcessPoolExecutor(
+                max_workers=settings.PDF_EXTRACT_PROCESSES,
+                mp_context=PROCESS_CONTEXT,
+            )
+        return _page_pool
+
+
+def shutdown_page_pool():
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is not None:
+            _page_pool.shutdown(wait=False, cancel_futures=True)
+            _page_pool = None
+
+
+def iter_pages(pdf_path: str) -> Iterator[Tuple[int, str]]:
+    """Yield (page_index, text) in page order.
+
+    Large PDFs are extracted in page ranges across worker processes; results are
+    yielded as soon as each range (in order) is done, so splitting can start early.
+    """
+    reader = PdfReader(pdf_path)
+    page_count = len(reader.pages)
+    if settings.PDF_EXTRACT_PROCESSES <= 1 or page_count < settings.PDF_PARALLEL_MIN_PAGES:
+        for number, page in enumerate(reader.pages):
+            yield number, _extract_page(page)
+        return
+    del reader
+    # Each task re-opens the PDF, so give every process a few large ranges rather than many small ones
+    batch = settings.PDF_PAGES_PER_TASK or math.ceil(page_count / (settings.PDF_EXTRACT_PROCESSES * 4))
+    starts = list(range(0, page_count, batch))
+    ends = [min(start + batch, page_count) for start in starts]
+    for pages in _get_page_pool().map(_extract_page_range, repeat(pdf_path), starts, ends):
+        yield from pages
+
+
+def split_pages(pages: Iterable[Tuple[int, str]],
+                document_id: Optional[str] = None) -> Tuple[List[Document], Dict[str, int]]:
+    """Split a stream of page texts into chunks carrying source, page and offset metadata.
+
+    Consecutive pages are buffered until there is enough text for a couple of chunks, so
+    short pages don't each become their own tiny chunk. `start_index` is the chunk's offset
+    in the whole (furniture-stripped) document text; `page` is the 1-based page the chunk
+    starts on; `document_id` identifies the PDF within a multi-document session.
+
+    Repeated headers/footers are stripped first and duplicate chunks dropped afterwards
+    (see chunking.py). With CHUNK_SEMANTIC the result is short segments that keep the
+    whitespace between them, which `embed_document` joins into chunks once they are embedded.
+    """
+    if settings.CHUNK_SEMANTIC:
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=settings.CHUNK_SEMANTIC_SEGMENT_SIZE, chunk_overlap=0, add_start_index=True
+        )
+    else:
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=settings.CHUNK_SIZE, chunk_overlap=settings.CHUNK_OVERLAP, add_start_index=True
+        )
+    flush_at = max(splitter._chunk_size, settings.CHUNK_SIZE) * 2
+    chunks: List[Document] = []
+    stats = {"pages": 0, "empty_pages": 0, "chars": 0}
+    furniture = None
+    if settings.CHUNK_STRIP_FURNITURE:
+        furniture = FurnitureFilter(
+            edge_lines=settings.CHUNK_FURNITURE_EDGE_LINES,
+            min_fraction=settings.CHUNK_FURNITURE_MIN_FRACTION,
+            window=settings.CHUNK_FURNITURE_WINDOW,
+        )
+        pages = furniture.filter(_count_chars(pages, stats))
+    else:
+        pages = _count_chars(pages, stats)
+
+    buffer: List[str] = []
+    buffer_pages: List[int] = []  # page index for each entry in buffer
+    buffer_starts: List[int] = []  # offset of each entry within the buffer
+    buffer_length = 0
+    buffer_offset = 0  # offset of the buffer within the document
+
+    def flush():
+        text = "".join(buffer)
+        pieces = splitter.create_documents([text])
+        if settings.CHUNK_SEMANTIC and pieces:
+            # Segments are joined into chunks after embedding; make them tile the text (each runs
+            # up to where the next one starts) so that neighbours joined together are a slice of it
+            starts = [piece.metadata["start_index"] for piece in pieces]
+            for piece, start, end in zip(pieces, starts, starts[1:] + [len(text)]):
+                piece.page_content = text[start:end]
+            if chunks and starts[0]:
+                chunks[-1].page_content += text[:starts[0]]
+        for chunk in pieces:
+            start = chunk.metadata["start_index"]
+            entry = max(bisect.bisect_right(buffer_starts, start) - 1, 0)
+            chunk.metadata = {"page": buffer_pages[entry] + 1, "start_index": buffer_offset + start}
+            if document_id is not None:
+                chunk.metadata["document_id"] = document_id
+            chunks.append(chunk)
+
+    for number, text in pages:
+        stats["pages"] += 1
+        if not text.strip():
+            stats["empty_pages"] += 1
+            continue
+        buffer.append(text)
+        buffer_pages.append(number)
+        buffer_starts.append(buffer_length)
+        buffer_length += len(text)
+        if buffer_length >= flush_at:
+            flush()
+            buffer_offset += buffer_length
+            buffer, buffer_pages, buffer_starts, buffer_length = [], [], [], 0
+    if buffer:
+        flush()
+
+    stats["split_chunks"] = len(chunks)
+    stats["furniture_lines"] = furniture.lines_removed if furniture else 0
+    stats["furniture_chars"] = furniture.chars_removed if furniture else 0
+    if settings.CHUNK_DEDUPE:
+        chunks, dedupe_stats = deduplicate(chunks, settings.CHUNK_NEAR_DUPLICATE_THRESHOLD)
+        stats.update(dedupe_stats)
+    return chunks, stats
+
+
+def _count_chars(pages: Iterable[Tuple[int, str]], stats: Dict[str, int]) -> Iterator[Tuple[int, str]]:
+    """Pass pages through, adding up their extracted characters in `stats`."""
+    for number, text in pages:
+        stats["chars"] += len(text)
+        yield number, text
+
+
+def chunking_report(stats: Dict[str, int], chunks: int) -> Dict:
+    """What furniture stripping and deduplication kept out of the index, for the upload response."""
+    removed_chars = stats.get("furniture_chars", 0) + stats.get("duplicate_chars", 0)
+    return {
+        "furniture_lines": stats.get("furniture_lines", 0),
+        "split_chunks": stats.get("split_chunks", chunks),
+        "exact_duplicates": stats.get("exact_duplicates", 0),
+        "near_duplicates": stats.get("near_duplicates", 0),
+        "chunks": chunks,
+        # Share of the extracted text that was not indexed; index size shrinks about as much
+        "text_reduction": round(removed_chars / stats["chars"], 3) if stats.get("chars") else 0.0,
+    }
+
+
+def extract_chunks(pdf_path: str, document_id: Optional[str] = None) -> Tuple[List[Document], Dict[str, int]]:
+    """Extract and split a PDF, streaming pages from the extractors into the splitter."""
+    return split_pages(iter_pages(pdf_path), document_id)
+
+
+def embed_chunks(chunks: List[Document], on_progress: Optional[Callable[[float], None]] = None) -> np.ndarray:
+    """Embed chunk texts through the shared batcher, so concurrent uploads share model calls."""
+    return embedding_engine.encode([chunk.page_content for chunk in chunks], on_progress=on_progress)
+
+
+def embed_document(chunks: List[Document],
+                   on_progress: Optional[Callable[[float], None]] = None) -> Tuple[List[Document], np.ndarray]:
+    """Embed the output of `split_pages`; with CHUNK_SEMANTIC its segments are then joined into chunks."""
+    vectors = embed_chunks(chunks, on_progress=on_progress)
+    if settings.CHUNK_SEMANTIC:
+        return group_segments(chunks, vectors, settings.CHUNK_SIZE)
+    return chunks, vectors
+
+
+def build_vector_store(chunks: List[Document], vectors: Optional[np.ndarray] = None) -> Tuple[HybridFAISS, Dict]:
+    """Index chunks with the backend chosen for their count, plus BM25.
+
+    Chunks are embedded first unless their `vectors` are given. Returns the vector store
+    and an index report (backend, memory footprint, recall@k).
+    """
+    texts = [chunk.page_content for chunk in chunks]
+    if vectors is None:
+        vectors = embed_chunks(chunks)
+    vector_store = HybridFAISS(
+        embedding_function=embedding_engine.get(),
+        index=create_index(vectors),
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+    vector_store.add_embeddings(zip(texts, vectors), metadatas=[chunk.metadata for chunk in chunks])
+    # Build the BM25 index now rather than on the first question
+    vector_store.build_sparse_index()
+    return vector_store, describe(vector_store.index, vectors, max_vectors=settings.INDEX_EVAL_MAX_VECTORS)
+
+
+def indexed_chunks(vector_store: HybridFAISS) -> Tuple[List[Document], Optional[np.ndarray]]:
+    """Chunks of a vector store in index order, plus their vectors if the index stores them exactly."""
+    positions = list(range(vector_store.index.ntotal))
+    chunks = [vector_store.docstore.search(vector_store.index_to_docstore_id[p]) for p in positions]
+    return chunks, reconstruct(vector_store.index, positions)
+
+
+def append_to_vector_store(vector_store: HybridFAISS, chunks: List[Document],
+                           vectors: Optional[np.ndarray] = None) -> List[str]:
+    """Add a document's chunks to an existing vector store without touching what is already there.
+
+    Chunks are embedded unless their `vectors` are given. Returns the new docstore ids.
+    """
+    texts = [chunk.page_content for chunk in chunks]
+    if vectors is None:
+        vectors = embedding_engine.encode(texts)
+    return vector_store.add_embeddings(zip(texts, vectors), metadatas=[chunk.metadata for chunk in chunks])
+
+
+def remove_file(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+ingest_pool = IngestPool(
+    kind=settings.INGEST_EXECUTOR,
+    workers=settings.INGEST_WORKERS,
+    queue_size=settings.INGEST_QUEUE_SIZE,
+)
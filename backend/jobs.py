@@ -0,0 +1,420 @@
+"""Background jobs for long-running requests (PDF ingestion, quiz and flashcard generation).
+
+A job runs the same pipeline as the synchronous endpoint, reporting each stage as it
+starts and finishes so clients can poll `/api/jobs/{id}` instead of holding a connection
+open. At most JOBS_MAX_CONCURRENCY jobs run at once; the rest wait in order. Job state is
+kept in a SQLite file so finished results and failures survive a restart. The worker
+running a job renews its lease (`updated_at`) while the job is queued or running; a job
+whose lease is older than JOBS_LEASE_SECONDS belonged to a worker that stopped, and is
+marked failed.
+With several workers sharing the file, any of them can report or cancel any job: a
+cancel request for another worker's job is recorded in the file, and the worker running
+the job picks it up at its next progress report or within JOBS_CANCEL_POLL_SECONDS.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import settings
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+INTERRUPTED = "Interrupted: the worker running it stopped"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    stages TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    error_status INTEGER,
+    session_id TEXT,
+    worker INTEGER,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+class JobCancelled(Exception):
+    """Raised inside a job whose client asked to cancel it."""
+
+
+class JobQueueFull(Exception):
+    """Raised when JOBS_MAX_QUEUED jobs are already waiting or running."""
+
+
+def _report_write_error(future: Future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Saving job state failed: {future.exception()}")
+
+
+class JobStore:
+    """SQLite-backed job records. Safe to call from worker threads.
+
+    A write can wait on another worker's SQLite lock, so code on the event loop goes
+    through `write`, which runs it on the store's writer thread.
+    """
+
+    def __init__(self, path: Optional[Path]):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+
+    def open(self):
+        with self._lock:
+            if self._db is not None:
+                return
+            if self.path is None:
+                target = ":memory:"
+            else:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                target = str(self.path)
+            self._db = sqlite3.connect(target, check_same_thread=False, isolation_level=None)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(SCHEMA)
+            columns = {row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")}
+            if "worker" not in columns:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN worker INTEGER")
+            if "cancel_requested" not in columns:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0")
+            if "error_status" not in columns:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN error_status INTEGER")
+            # This process has no jobs yet, so any recorded under its PID are a previous process's
+            interrupted = self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? "
+                "WHERE status IN (?, ?) AND (worker IS NULL OR worker = ?)",
+                (FAILED, INTERRUPTED, time.time(), QUEUED, RUNNING, os.getpid()),
+            ).rowcount
+        interrupted += self.expire()
+        if interrupted:
+            print(f"Marked {interrupted} interrupted job(s) as failed")
+        self.prune()
+
+    def close(self):
+        # Let queued writes land first
+        self._writer.shutdown(wait=True)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def write(self, function: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """Run `function` on the writer thread.
+
+        Writes run one at a time in the order they were queued, so a progress report
+        queued before a job finished can't overwrite its final status.
+        """
+        return self._writer.submit(function, *args, **kwargs)
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        if self._db is None:
+            self.open()
+        with self._lock:
+            return self._db.execute(sql, params)
+
+    def create(self, job_id: str, kind: str, stages: List[str], session_id: Optional[str] = None) -> Dict:
+        now = time.time()
+        stage_list = [{"name": name, "status": "pending", "progress": 0.0, "ms": None} for name in stages]
+        self._execute(
+            "INSERT INTO jobs (id, kind, status, stages, session_id, worker, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, QUEUED, json.dumps(stage_list), session_id, os.getpid(), now, now),
+        )
+        return self.get(job_id)
+
+    def update(self, job_id: str, **fields: Any):
+        if "stages" in fields:
+            fields["stages"] = json.dumps(fields["stages"])
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"], ensure_ascii=False)
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self._execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def renew(self, job_ids: List[str]):
+        """Extend the lease of this worker's queued and running jobs."""
+        if not job_ids:
+            return
+        self._execute(
+            f"UPDATE jobs SET updated_at = ? WHERE status IN (?, ?) AND id IN ({', '.join('?' * len(job_ids))})",
+            (time.time(), QUEUED, RUNNING, *job_ids),
+        )
+
+    def expire(self) -> int:
+        """Fail queued and running jobs whose lease ran out; returns how many."""
+        now = time.time()
+        return self._execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE status IN (?, ?) AND updated_at < ?",
+            (FAILED, INTERRUPTED, now, QUEUED, RUNNING, now - settings.JOBS_LEASE_SECONDS),
+        ).rowcount
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        row = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        if row["status"] in (QUEUED, RUNNING) and row["updated_at"] < time.time() - settings.JOBS_LEASE_SECONDS:
+            # Its worker stopped without finishing it
+            self.expire()
+            row = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        job = dict(row)
+        job["stages"] = json.loads(job["stages"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def request_cancel(self, job_id: str) -> bool:
+        """Ask whichever worker runs the job to cancel it; False if it has already finished."""
+        return self._execute(
+            "UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status IN (?, ?)",
+            (time.time(), job_id, QUEUED, RUNNING),
+        ).rowcount > 0
+
+    def cancel_requested(self, job_ids: List[str]) -> List[str]:
+        """Those of `job_ids` that another worker asked to cancel."""
+        if not job_ids:
+            return []
+        rows = self._execute(
+            f"SELECT id FROM jobs WHERE cancel_requested = 1 AND id IN ({', '.join('?' * len(job_ids))})",
+            tuple(job_ids),
+        ).fetchall()
+        return [row["id"] for row in rows]
+
+    def prune(self):
+        """Delete finished jobs older than JOBS_TTL_SECONDS."""
+        if settings.JOBS_TTL_SECONDS <= 0:
+            return
+        cutoff = time.time() - settings.JOBS_TTL_SECONDS
+        self._execute(
+            f"DELETE FROM jobs WHERE updated_at < ? AND status IN ({', '.join('?' * len(FINISHED))})",
+            (cutoff, *FINISHED),
+        )
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["count"] for row in rows}
+
+
+class JobProgress:
+    """Handle a running job uses to report its stages; also checks for cancellation."""
+
+    def __init__(self, store: JobStore, job_id: str, stages: List[str]):
+        self.store = store
+        self.job_id = job_id
+        self.stages = [{"name": name, "status": "pending", "progress": 0.0, "ms": None} for name in stages]
+        self.cancelled = threading.Event()
+        self._started: Dict[str, float] = {}
+
+    def _stage(self, name: str) -> Dict:
+        for stage in self.stages:
+            if stage["name"] == name:
+                return stage
+        # Stages not declared up front are appended as they happen
+        stage = {"name": name, "status": "pending", "progress": 0.0, "ms": None}
+        self.stages.append(stage)
+        return stage
+
+    def _overall(self) -> float:
+        done = sum(1.0 if stage["status"] in ("done", "skipped") else stage["progress"] for stage in self.stages)
+        return round(done / len(self.stages), 3) if self.stages else 0.0
+
+    def _save(self, current: Optional[str]):
+        # Called from the event loop (stage start/finish) and from worker threads alike
+        stages = [dict(stage) for stage in self.stages]
+        future = self.store.write(self.store.update, self.job_id, stage=current, progress=self._overall(), stages=stages)
+        future.add_done_callback(_report_write_error)
+
+    def check(self):
+        """Raise JobCancelled if the job was cancelled; worker-thread stages call this between steps.
+
+        Also honours cancel requests recorded by other worker processes.
+        """
+        if not self.cancelled.is_set() and self.store.cancel_requested([self.job_id]):
+            self.cancelled.set()
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+    def start(self, name: str):
+        self.check()
+        stage = self._stage(name)
+        stage["status"] = "running"
+        self._started[name] = time.perf_counter()
+        self._save(name)
+
+    def advance(self, name: str, fraction: float):
+        """Report progress within a running stage (0..1). Callable from any thread."""
+        self.check()
+        self._stage(name)["progress"] = round(min(max(fraction, 0.0), 1.0), 3)
+        self._save(name)
+
+    def finish(self, name: str):
+        stage = self._stage(name)
+        stage["status"] = "done"
+        stage["progress"] = 1.0
+        if name in self._started:
+            stage["ms"] = round((time.perf_counter() - self._started.pop(name)) * 1000, 1)
+        self._save(name)
+
+    def fail(self, name: str):
+        stage = self._stage(name)
+        stage["status"] = "failed"
+        if name in self._started:
+            stage["ms"] = round((time.perf_counter() - self._started.pop(name)) * 1000, 1)
+        self._save(name)
+
+    def skip(self, *names: str):
+        for name in names:
+            self._stage(name)["status"] = "skipped"
+        self._save(None)
+
+
+JobFunction = Callable[[JobProgress], Awaitable[Any]]
+
+
+class JobRunner:
+    """Runs job coroutines in the background under a concurrency limit."""
+
+    def __init__(self, store: JobStore, concurrency: int, max_queued: int):
+        self.store = store
+        self.concurrency = max(1, concurrency)
+        self.max_queued = max(1, max_queued)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._progress: Dict[str, JobProgress] = {}
+        self._watcher: Optional[asyncio.Task] = None
+        self._submitting = 0
+
+    def start(self):
+        self.store.open()
+
+    async def shutdown(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.to_thread(self.store.close)
+
+    async def submit(self, kind: str, stages: List[str], run: JobFunction,
+                     session_id: Optional[str] = None, cleanup: Optional[Callable[[], None]] = None) -> Dict:
+        """Record a job and start it; returns the job record.
+
+        `run` receives a JobProgress and returns the JSON-serialisable result. `cleanup`
+        runs when the job ends, however it ends. Raises JobQueueFull when JOBS_MAX_QUEUED
+        jobs are already pending.
+        """
+        if len(self._tasks) + self._submitting >= self.max_queued:
+            raise JobQueueFull(f"{len(self._tasks)} jobs are already queued or running")
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.store.write(self.store.prune).add_done_callback(_report_write_error)
+        self.store.write(self.store.expire).add_done_callback(_report_write_error)
+        job_id = uuid.uuid4().hex
+        self._submitting += 1
+        try:
+            job = await asyncio.wrap_future(self.store.write(self.store.create, job_id, kind, stages, session_id=session_id))
+        finally:
+            self._submitting -= 1
+        progress = JobProgress(self.store, job_id, stages)
+        self._progress[job_id] = progress
+        task = asyncio.create_task(self._run(job_id, run, progress, cleanup))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._forget(job_id))
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.create_task(self._watch_cancel_requests())
+        return job
+
+    def _forget(self, job_id: str):
+        self._tasks.pop(job_id, None)
+        self._progress.pop(job_id, None)
+
+    async def _update(self, job_id: str, **fields: Any):
+        await asyncio.wrap_future(self.store.write(self.store.update, job_id, **fields))
+
+    async def _run(self, job_id: str, run: JobFunction, progress: JobProgress,
+                   cleanup: Optional[Callable[[], None]]):
+        try:
+            async with self._semaphore:
+                progress.check()
+                await self._update(job_id, status=RUNNING)
+                result = await run(progress)
+            await self._update(job_id, status=SUCCEEDED, stage=None, progress=1.0, result=result)
+        except (asyncio.CancelledError, JobCancelled):
+            if progress.cancelled.is_set():
+                await self._update(job_id, status=CANCELLED, error="Cancelled")
+            else:
+                await self._update(job_id, status=FAILED, error="Interrupted by server shutdown")
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e)
+            # An HTTPException keeps the status the synchronous endpoint would have returned
+            await self._update(job_id, status=FAILED, error=str(detail),
+                               error_status=getattr(e, "status_code", None) or 500)
+        finally:
+            if cleanup is not None:
+                await asyncio.to_thread(cleanup)
+
+    async def _watch_cancel_requests(self):
+        """Cancel this process's jobs that another worker was asked to cancel.
+
+        Progress reports check too; this catches jobs waiting in a single long stage.
+        Also renews the leases of this process's jobs.
+        """
+        renewed = time.monotonic()
+        while self._tasks:
+            await asyncio.sleep(settings.JOBS_CANCEL_POLL_SECONDS)
+            if time.monotonic() - renewed >= settings.JOBS_LEASE_SECONDS / 3:
+                renewed = time.monotonic()
+                self.store.write(self.store.renew, list(self._tasks)).add_done_callback(_report_write_error)
+            try:
+                requested = await asyncio.to_thread(self.store.cancel_requested, list(self._tasks))
+            except sqlite3.Error as e:
+                print(f"Checking for job cancel requests failed: {e}")
+                continue
+            for job_id in requested:
+                if job_id in self._tasks:
+                    asyncio.create_task(self.cancel(job_id))
+
+    async def cancel(self, job_id: str) -> bool:
+        """Stop a queued or running job; False if it isn't running in this process.
+
+        The job stops at its next await. Work already handed to a worker thread finishes
+        in the background (or at its next progress report) and its output is discarded.
+        """
+        task = self._tasks.get(job_id)
+        if task is None:
+            return False
+        self._progress[job_id].cancelled.set()
+        task.cancel()
+        await asyncio.wait([task])
+        return True
+
+    def status(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "max_queued": self.max_queued,
+            "active": len(self._tasks),
+            "by_status": self.store.counts() if self.store._db is not None else {},
+        }
+
+
+job_store = JobStore(Path(settings.JOBS_DB) if settings.JOBS_DB else None)
+job_runner = JobRunner(job_store, concurrency=settings.JOBS_MAX_CONCURRENCY, max_queued=settings.JOBS_MAX_QUEUED)
@@ -0,0 +1,89 @@
+"""Shared Groq chat clients with pooled keep-alive HTTP connections."""
+import threading
+from typing import Dict, Optional, Tuple
+
+import httpx
+from langchain_groq import ChatGroq
+
+import settings
+
+DEFAULT_MODEL = "llama-3.1-8b-instant"
+
+
+class LLMPool:
+    """Hands out one ChatGroq per (model, temperature, max_tokens) combination.
+
+    Every client shares the same sync and async httpx clients, so connections to the
+    Groq API stay open between requests instead of being set up per call.
+    """
+
+    def __init__(self, max_connections: int, keepalive_connections: int, timeout: float):
+        self.max_connections = max_connections
+        self.keepalive_connections = keepalive_connections
+        self.timeout = timeout
+        self.api_key: Optional[str] = None
+        self._http_client: Optional[httpx.Client] = None
+        self._http_async_client: Optional[httpx.AsyncClient] = None
+        self._clients: Dict[Tuple, ChatGroq] = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Validate configuration and open the shared HTTP clients. Raises if GROQ_API_KEY is missing."""
+        api_key = settings.GROQ_API_KEY
+        if not api_key:
+            raise RuntimeError("GROQ_API_KEY not configured. Add it to backend/.env and restart the server.")
+        self.api_key = api_key
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.keepalive_connections,
+        )
+        self._http_client = httpx.Client(limits=limits, timeout=self.timeout)
+        self._http_async_client = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+        print(f"Groq client pool ready (max {self.max_connections} connections)")
+
+    async def close(self):
+        with self._lock:
+            self._clients.clear()
+        if self._http_client is not None:
+            self._http_client.close()
+            self._http_client = None
+        if self._http_async_client is not None:
+            await self._http_async_client.aclose()
+            self._http_async_client = None
+
+    def get(self, model_name: str = DEFAULT_MODEL, temperature: Optional[float] = None,
+            max_tokens: Optional[int] = None) -> ChatGroq:
+        if self.api_key is None:
+            raise RuntimeError("LLM pool not started")
+        key = (model_name, temperature, max_tokens)
+        with self._lock:
+            llm = self._clients.get(key)
+            if llm is None:
+                kwargs = {}
+                if temperature is not None:
+                    kwargs["temperature"] = temperature
+                if max_tokens is not None:
+                    kwargs["max_tokens"] = max_tokens
+                llm = ChatGroq(
+                    api_key=self.api_key,
+                    model_name=model_name,
+                    http_client=self._http_client,
+                    http_async_client=self._http_async_client,
+                    **kwargs
+                )
+                self._clients[key] = llm
+            return llm
+
+    def status(self) -> dict:
+        return {
+            "configured": self.api_key is not None,
+            "clients": len(self._clients),
+            "max_connections": self.max_connections,
+        }
+
+
+llm_pool = LLMPool(
+    max_connections=settings.LLM_MAX_CONNECTIONS,
+    keepalive_connections=settings.LLM_KEEPALIVE_CONNECTIONS,
+    timeout=settings.LLM_TIMEOUT_SECONDS,
+)
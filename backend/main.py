@@ -1,27 +1,70 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import BackgroundTasks, FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict
-import os
-import tempfile
-from pathlib import Path
+from typing import List, Optional, Dict, Tuple
+from contextlib import asynccontextmanager
+import asyncio
+import functools
+import json
+import time
 from datetime import datetime
-from pypdf import PdfReader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_classic.chains.retrieval_qa.base import RetrievalQA
-from langchain_groq import ChatGroq
-from dotenv import load_dotenv
+from groq import BadRequestError
+from pypdf.errors import PdfReadError
+from langchain_core.messages import HumanMessage, SystemMessage
 import uuid
-import shutil
-import re   
+import numpy as np
 
-# Load environment variables from backend directory
-env_path = Path(__file__).parent / ".env"
-load_dotenv(dotenv_path=env_path, override=True)
+import settings  # loads backend/.env before anything reads the environment
+from embeddings import embedding_engine
+from index_cache import index_cache
+from sessions import SessionConflict, sessions, sweep_periodically
+from llm import llm_pool
+from answer_cache import answer_cache, cache_key_text
+from artifacts import artifact_store
+from artifact_parser import Flashcard, QuizQuestion, parse_flashcards, parse_quiz
+from vector_index import describe as describe_index
+from context import build_context, context_stats, token_counter
+from memory import memory_summarizer
+from jobs import FINISHED, JobQueueFull, job_runner, job_store
+from metrics import (
+    CONTENT_TYPE, DOCUMENT_CHUNKS, DOCUMENT_PAGES, DUPLICATE_CHUNKS, FURNITURE_LINES, MetricsMiddleware,
+    current_endpoint, metrics,
+    record_llm_usage, record_stage, stage,
+)
+from ingest import (
+    PoolSaturated,
+    StageTimer,
+    append_to_vector_store,
+    build_vector_store,
+    chunking_report,
+    embed_chunks,
+    embed_document,
+    extract_chunks,
+    indexed_chunks,
+    ingest_pool,
+    remove_file,
+    spool_to_disk,
+)
 
-app = FastAPI(title="PDF ChatBot API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the embedding model and check LLM configuration once per process; fail fast on errors
+    embedding_engine.load()
+    token_counter.load()
+    llm_pool.start()
+    ingest_pool.start()
+    job_runner.start()
+    sweeper = asyncio.create_task(sweep_periodically(sessions, settings.SESSION_SWEEP_INTERVAL_SECONDS))
+    yield
+    sweeper.cancel()
+    await job_runner.shutdown()
+    ingest_pool.shutdown()
+    embedding_engine.shutdown()
+    await llm_pool.close()
+    sessions.close()
+
+app = FastAPI(title="PDF ChatBot API", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -30,11 +73,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
-# In-memory storage for vector stores (in production, use a database)
-vector_stores: Dict[str, FAISS] = {}
-chat_histories: Dict[str, List[tuple]] = {}
+# Per-stage tracing and /metrics; not installed at all when metrics are disabled
+if metrics.enabled:
+    app.add_middleware(MetricsMiddleware)
+
+# Vector stores and chat histories live in the bounded session store (see sessions.py), backed by
+# the shared on-disk state when several workers serve the API (see shared_sessions.py)
 
 # Request/Response models
 class ChatRequest(BaseModel):
@@ -48,27 +95,21 @@ class ChatResponse(BaseModel):
     content: str
     sources: Optional[List[Dict[str, str]]] = None
     timestamp: str
+    cached: bool = False  # Served from the semantic answer cache
+    prompt_tokens: Optional[int] = None  # Size of the prompt sent to the LLM (None when cached)
 
 class QuizRequest(BaseModel):
     session_id: str
-
-class QuizQuestion(BaseModel):
-    question: str
-    a: str
-    b: str
-    c: str
-    d: str
-    correct: str
+    refresh: bool = False  # Regenerate instead of serving the cached quiz
+    job: bool = False  # Return a job to poll instead of waiting for the quiz
 
 class QuizResponse(BaseModel):
     questions: List[QuizQuestion]
 
 class FlashcardRequest(BaseModel):
     session_id: str
-
-class Flashcard(BaseModel):
-    front: str
-    back: str
+    refresh: bool = False  # Regenerate instead of serving the cached flashcards
+    job: bool = False  # Return a job to poll instead of waiting for the flashcards
 
 class FlashcardResponse(BaseModel):
     flashcards: List[Flashcard]
@@ -77,317 +118,765 @@ class UploadResponse(BaseModel):
     session_id: str
     message: str
     chunks_count: int
+    pages_count: Optional[int] = None  # Not reported when the index came from the cache
+    document_hash: Optional[str] = None  # SHA-256 of the uploaded PDF
+    cached: bool = False
+    timings: Optional[Dict[str, float]] = None  # Milliseconds spent in each ingestion stage
+    index: Optional[Dict] = None  # Index backend, memory footprint and (when built) recall@k
+    chunking: Optional[Dict] = None  # Furniture lines and duplicate chunks kept out of the index
 
-def parse_quiz(quiz_text: str) -> List[Dict]:
-    """Parse quiz questions from LLM response."""
-    questions = []
-    current_q = {}
-    lines = quiz_text.split('\n')
-    
-    for line in lines:
-        line = line.strip()
-        if not line:
-            if current_q and 'question' in current_q and 'correct' in current_q:
-                questions.append(current_q)
-                current_q = {}
-            continue
-            
-        if line.upper().startswith('Q') and (':' in line or (len(line) > 1 and line[1:2].isdigit())):
-            if current_q and 'question' in current_q and 'correct' in current_q:
-                questions.append(current_q)
-            if ':' in line:
-                current_q = {'question': line}
-            else:
-                current_q = {'question': line}
-        elif line.upper().startswith('A)') or (line.startswith('A.') and len(line) > 2):
-            current_q['a'] = line[2:].strip() if line[1] == ')' else line[2:].strip()
-        elif line.upper().startswith('B)') or (line.startswith('B.') and len(line) > 2):
-            current_q['b'] = line[2:].strip() if line[1] == ')' else line[2:].strip()
-        elif line.upper().startswith('C)') or (line.startswith('C.') and len(line) > 2):
-            current_q['c'] = line[2:].strip() if line[1] == ')' else line[2:].strip()
-        elif line.upper().startswith('D)') or (line.startswith('D.') and len(line) > 2):
-            current_q['d'] = line[2:].strip() if line[1] == ')' else line[2:].strip()
-        elif 'correct' in line.lower() and ':' in line:
-            parts = line.split(':', 1)
-            if len(parts) > 1:
-                correct_ans = parts[1].strip().upper()
-                if correct_ans:
-                    current_q['correct'] = correct_ans[0] if len(correct_ans) > 0 else correct_ans
-    
-    if current_q and 'question' in current_q and 'correct' in current_q:
-        questions.append(current_q)
-    
-    valid_questions = []
-    for q in questions:
-        if all(key in q for key in ['question', 'a', 'b', 'c', 'd', 'correct']):
-            # Clean question text
-            question_text = q['question'].strip()
-            if question_text.startswith('Q') and ':' in question_text:
-                question_text = question_text.split(':', 1)[1].strip()
-            q['question'] = question_text
-            valid_questions.append(q)
-    
-    return valid_questions[:5]
-
-def parse_flashcards(flashcard_text: str) -> List[Dict]:
-    """Parse flashcards from LLM response - improved with better error handling."""
-    flashcards = []
-    current_card = {}
-    lines = flashcard_text.split('\n')
-    
-    for line in lines:
-        line = line.strip()
-        if not line:
-            if current_card and 'front' in current_card and 'back' in current_card:
-                flashcards.append(current_card)
-                current_card = {}
-            continue
+class DocumentInfo(BaseModel):
+    document_id: str  # SHA-256 of the PDF
+    filename: Optional[str] = None
+    chunks: Optional[int] = None
+    pages: Optional[int] = None
+
+class SessionDocumentsResponse(BaseModel):
+    session_id: str
+    chunks_count: int
+    documents: List[DocumentInfo]
+
+class AppendResponse(SessionDocumentsResponse):
+    document_id: str
+    message: str
+    added_chunks: int
+    pages_count: Optional[int] = None
+    cached: bool = False  # Vectors reused from the index cache instead of re-embedding
+    timings: Optional[Dict[str, float]] = None
+    chunking: Optional[Dict] = None
+
+class JobStage(BaseModel):
+    name: str
+    status: str  # pending, running, done, failed or skipped
+    progress: float  # 0..1 within the stage
+    ms: Optional[float] = None
+
+class JobResponse(BaseModel):
+    job_id: str
+    kind: str  # upload, quiz or flashcards
+    status: str  # queued, running, succeeded, failed or cancelled
+    stage: Optional[str] = None  # Stage currently running
+    progress: float  # 0..1 over all stages
+    stages: List[JobStage]
+    result: Optional[Dict] = None  # The synchronous endpoint's response, once succeeded
+    error: Optional[str] = None
+    error_status: Optional[int] = None  # HTTP status the synchronous endpoint would have failed with
+    session_id: Optional[str] = None
+    cancel_requested: bool = False  # Cancel asked for; the worker running the job stops it shortly
+    created_at: float
+    updated_at: float
+
+def job_response(record: Dict) -> JobResponse:
+    return JobResponse(job_id=record["id"], **{key: value for key, value in record.items() if key != "id"})
+
+def job_accepted(record: Dict) -> JSONResponse:
+    return JSONResponse(
+        status_code=202,
+        content=job_response(record).model_dump(),
+        headers={"Location": f"/api/jobs/{record['id']}"}
+    )
+
+def job_queue_full(e: Exception) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=f"Too many background jobs. Please retry shortly. ({str(e)})",
+        headers={"Retry-After": str(settings.INGEST_RETRY_AFTER_SECONDS)}
+    )
+
+# Stages reported by upload jobs, in order
+UPLOAD_STAGES = ["cache_lookup", "extract_split", "embed", "index", "cache_store"]
+
+def record_chunking(page_stats: Dict[str, int], chunks: int) -> Dict:
+    """Count what chunking kept out of the index; returns the upload response's report."""
+    report = chunking_report(page_stats, chunks)
+    DUPLICATE_CHUNKS.inc(report["exact_duplicates"], "exact")
+    DUPLICATE_CHUNKS.inc(report["near_duplicates"], "near")
+    FURNITURE_LINES.inc(report["furniture_lines"])
+    return report
+
+async def extract_pdf(tmp_path: str, doc_hash: str, timer: StageTimer) -> Tuple[list, Dict[str, int]]:
+    """Extract and split a spooled PDF; unreadable or textless files are the client's error (400)."""
+    try:
+        chunks, page_stats = await timer.run(
+            "extract_split", ingest_pool.run(extract_chunks, tmp_path, doc_hash)
+        )
+    except PdfReadError as e:
+        raise HTTPException(status_code=400, detail=f"The file could not be read as a PDF: {str(e)}")
+    if not chunks:
+        raise HTTPException(status_code=400, detail="No text could be extracted from the PDF")
+    return chunks, page_stats
+
+async def process_upload(tmp_path: str, doc_hash: str, filename: str, timer: StageTimer) -> UploadResponse:
+    """Index a spooled PDF (or load its cached index) and open a session on it."""
+    session_id = str(uuid.uuid4())
+    
+    # Reuse the saved index if this exact PDF was processed before
+    vector_store = await timer.run(
+        "cache_lookup",
+        ingest_pool.run_in_thread(index_cache.load, doc_hash, embedding_engine.get())
+    )
+    cached = vector_store is not None
+    if cached:
+        index_report = describe_index(vector_store.index)
+        timer.skip("extract_split", "embed", "index", "cache_store")
+    
+    if not cached:
+        # Extract text page by page (in parallel for large PDFs) and split it as pages arrive
+        chunks, page_stats = await extract_pdf(tmp_path, doc_hash, timer)
+        
+        # Embed, then index the chunks; the index backend is picked by chunk count
+        chunks, vectors = await timer.run(
+            "embed",
+            ingest_pool.run_in_thread(embed_document, chunks, functools.partial(timer.advance, "embed"))
+        )
+        vector_store, index_report = await timer.run(
+            "index", ingest_pool.run_in_thread(build_vector_store, chunks, vectors)
+        )
         
-        # More flexible parsing - handle variations
-        line_lower = line.lower()
-        if line_lower.startswith('front:'):
-            if current_card and 'front' in current_card and 'back' in current_card:
-                flashcards.append(current_card)
-                current_card = {}
-            current_card['front'] = line[6:].strip()
-        elif line_lower.startswith('back:'):
-            current_card['back'] = line[5:].strip()
-        # Handle cases where front/back might be on separate lines
-        elif 'front' in line_lower and ':' in line:
-            parts = line.split(':', 1)
-            if len(parts) > 1:
-                current_card['front'] = parts[1].strip()
-        elif 'back' in line_lower and ':' in line and 'front' not in line_lower:
-            parts = line.split(':', 1)
-            if len(parts) > 1:
-                current_card['back'] = parts[1].strip()
-    
-    if current_card and 'front' in current_card and 'back' in current_card:
-        flashcards.append(current_card)
-    
-    # If we have incomplete cards, try to pair them up
-    if len(flashcards) < 5 and current_card:
-        # Try to extract any remaining pairs
-        pass
-    
-    return flashcards[:10]
+        await timer.run("cache_store", ingest_pool.run_in_thread(index_cache.store, doc_hash, vector_store))
+    
+    # Store vector store and initialize conversation memory
+    document = {
+        "document_id": doc_hash,
+        "filename": filename,
+        "chunks": vector_store.index.ntotal,
+        "pages": None if cached else page_stats["pages"],
+    }
+    chunking = None
+    if not cached:
+        DOCUMENT_CHUNKS.observe(len(chunks), current_endpoint())
+        DOCUMENT_PAGES.observe(page_stats["pages"], current_endpoint())
+        chunking = record_chunking(page_stats, len(chunks))
+    await asyncio.to_thread(sessions.create, session_id, vector_store, {doc_hash: document})
+    
+    # Generate the ARTIFACT_PRECOMPUTE artifacts (the title by default) in the background
+    precompute_artifacts(doc_hash, vector_store)
+    
+    return UploadResponse(
+        session_id=session_id,
+        message="PDF loaded from cache" if cached else "PDF processed successfully",
+        chunks_count=vector_store.index.ntotal,
+        pages_count=None if cached else page_stats["pages"],
+        document_hash=doc_hash,
+        cached=cached,
+        timings=timer.timings,
+        index=index_report,
+        chunking=chunking
+    )
 
 @app.post("/api/upload", response_model=UploadResponse)
-async def upload_pdf(file: UploadFile = File(...)):
-    """Upload and process a PDF file."""
+async def upload_pdf(file: UploadFile = File(...), job: bool = False):
+    """Upload and process a PDF file.
+
+    With `?job=true` the PDF is processed in the background: the response is a job (202)
+    to poll at `/api/jobs/{job_id}`, whose result is this endpoint's usual response.
+    """
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="File must be a PDF")
     
-    # Generate session ID
-    session_id = str(uuid.uuid4())
-    
-    try:
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            shutil.copyfileobj(file.file, tmp_file)
-            tmp_path = tmp_file.name
-        
-        # Extract text from PDF
-        reader = PdfReader(tmp_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() or ""
-        
-        # Clean up temp file
-        os.unlink(tmp_path)
-        
-        if not text.strip():
-            raise HTTPException(status_code=400, detail="No text could be extracted from the PDF")
-        
-        # Split text into chunks
-        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-        chunks = splitter.split_text(text)
-        
-        # Create embeddings
-        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    if job:
+        # The upload itself is read now; everything after it runs in the job
+        tmp_path, doc_hash = await ingest_pool.run_in_thread(spool_to_disk, file.file)
+        filename = file.filename
         
-        # Create FAISS vector store
-        vector_store = FAISS.from_texts(chunks, embedding=embeddings)
+        async def run(progress):
+            response = await process_upload(tmp_path, doc_hash, filename, StageTimer(progress))
+            return response.model_dump()
         
-        # Store vector store and initialize chat history
-        vector_stores[session_id] = vector_store
-        chat_histories[session_id] = []
-        
-        return UploadResponse(
-            session_id=session_id,
-            message="PDF processed successfully",
-            chunks_count=len(chunks)
+        try:
+            record = await job_runner.submit("upload", UPLOAD_STAGES, run, cleanup=functools.partial(remove_file, tmp_path))
+        except JobQueueFull as e:
+            remove_file(tmp_path)
+            raise job_queue_full(e)
+        return job_accepted(record)
+    
+    timer = StageTimer()
+    tmp_path = None
+    
+    try:
+        async with ingest_pool.slot():
+            # Save uploaded file temporarily, hashing it on the way
+            tmp_path, doc_hash = await timer.run("spool", ingest_pool.run_in_thread(spool_to_disk, file.file))
+            return await process_upload(tmp_path, doc_hash, file.filename, timer)
+    except PoolSaturated as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Server is busy processing other PDFs. Please retry shortly. ({str(e)})",
+            headers={"Retry-After": str(settings.INGEST_RETRY_AFTER_SECONDS)}
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process PDF: {str(e)}")
+    finally:
+        # Clean up temp file
+        if tmp_path:
+            remove_file(tmp_path)
 
-@app.post("/api/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    """Handle chat questions."""
-    if request.session_id not in vector_stores:
-        raise HTTPException(status_code=400, detail="No PDF uploaded for this session. Please upload a PDF first.")
+def session_documents(session) -> dict:
+    return {
+        "session_id": session.session_id,
+        "chunks_count": session.vector_store.index.ntotal,
+        "documents": list(session.documents.values()),
+    }
+
+@app.get("/api/sessions/{session_id}/documents", response_model=SessionDocumentsResponse)
+async def list_documents(session_id: str):
+    """List the PDFs in a session."""
+    session = await sessions.aget(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return SessionDocumentsResponse(**session_documents(session))
+
+@app.post("/api/sessions/{session_id}/documents", response_model=AppendResponse)
+async def append_pdf(session_id: str, file: UploadFile = File(...)):
+    """Add another PDF to an existing session's index.
+
+    Only the new PDF is extracted and embedded (or its vectors reused from the index
+    cache); the chunks already in the session are left untouched.
+    """
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="File must be a PDF")
+    session = await sessions.aget(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    timer = StageTimer()
+    tmp_path = None
     
     try:
-        vector_store = vector_stores[request.session_id]
-        chat_history = chat_histories.get(request.session_id, [])
-        
-        # Initialize LLM with Groq
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        print(f"Using GROQ_API_KEY: {groq_api_key is not None}")
-        if not groq_api_key:
-            raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
-        
-        llm = ChatGroq(
-            api_key=groq_api_key,
-            model_name="llama-3.1-8b-instant"
+        async with ingest_pool.slot():
+            tmp_path, doc_hash = await timer.run("spool", ingest_pool.run_in_thread(spool_to_disk, file.file))
+            if doc_hash in session.documents:
+                raise HTTPException(status_code=409, detail="This PDF is already part of the session")
+            
+            # A previously indexed copy of this PDF saves extraction, and embedding too if it stores exact vectors
+            chunks, vectors, page_stats = None, None, None
+            cached_store = await timer.run(
+                "cache_lookup",
+                ingest_pool.run_in_thread(index_cache.load, doc_hash, embedding_engine.get())
+            )
+            cached = cached_store is not None
+            if cached:
+                chunks, vectors = await timer.run("reuse", ingest_pool.run_in_thread(indexed_chunks, cached_store))
+            else:
+                chunks, page_stats = await extract_pdf(tmp_path, doc_hash, timer)
+            if cached and vectors is None:
+                vectors = await timer.run("embed", ingest_pool.run_in_thread(embed_chunks, chunks))
+            elif not cached:
+                chunks, vectors = await timer.run("embed", ingest_pool.run_in_thread(embed_document, chunks))
+        
+        async with session.lock:
+            if doc_hash in session.documents:
+                raise HTTPException(status_code=409, detail="This PDF is already part of the session")
+            await timer.run(
+                "append",
+                asyncio.to_thread(append_to_vector_store, session.vector_store, chunks, vectors)
+            )
+            session.documents[doc_hash] = {
+                "document_id": doc_hash,
+                "filename": file.filename,
+                "chunks": len(chunks),
+                "pages": page_stats["pages"] if page_stats else None,
+            }
+            await asyncio.to_thread(sessions.resize, session)
+        DOCUMENT_CHUNKS.observe(len(chunks), current_endpoint())
+        chunking = None
+        if page_stats:
+            DOCUMENT_PAGES.observe(page_stats["pages"], current_endpoint())
+            chunking = record_chunking(page_stats, len(chunks))
+        
+        # The session's content changed, so its quiz/flashcards/title are keyed anew. They are
+        # generated when asked for rather than precomputed, since more changes may follow
+        
+        return AppendResponse(
+            **session_documents(session),
+            document_id=doc_hash,
+            message="PDF added to session",
+            added_chunks=len(chunks),
+            pages_count=page_stats["pages"] if page_stats else None,
+            cached=cached,
+            timings=timer.timings,
+            chunking=chunking
         )
-        
-        # Build RetrievalQA chain with better retrieval settings
-        retriever = vector_store.as_retriever(
-            search_kwargs={"k": 4}  # Retrieve top 4 most relevant chunks
+    except PoolSaturated as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Server is busy processing other PDFs. Please retry shortly. ({str(e)})",
+            headers={"Retry-After": str(settings.INGEST_RETRY_AFTER_SECONDS)}
         )
-        
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            retriever=retriever,
-            chain_type="stuff",
-            return_source_documents=False
-        )
-        
-        # Combine history into prompt
-        history_text = "\n".join([f"Q: {q}\nA: {a}" for q, a in chat_history[-3:]])  # Last 3 exchanges
-        instruction = (
+    except SessionConflict as e:
+        raise HTTPException(status_code=409, detail=f"{str(e)}. Please retry.")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to add PDF: {str(e)}")
+    finally:
+        if tmp_path:
+            remove_file(tmp_path)
+
+@app.delete("/api/sessions/{session_id}/documents/{document_id}", response_model=SessionDocumentsResponse)
+async def remove_pdf(session_id: str, document_id: str):
+    """Remove one PDF's chunks from a multi-document session."""
+    session = await sessions.aget(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    async with session.lock:
+        if document_id not in session.documents:
+            raise HTTPException(status_code=404, detail="Document not found in this session")
+        if len(session.documents) == 1:
+            raise HTTPException(status_code=400, detail="Cannot remove the only PDF in a session")
+        try:
+            vector_store = session.vector_store
+            ids = [
+                doc_id for doc_id, doc in vector_store.docstore._dict.items()
+                if doc.metadata.get("document_id") == document_id
+            ]
+            if ids:
+                await asyncio.to_thread(vector_store.delete, ids)
+            del session.documents[document_id]
+            await asyncio.to_thread(sessions.resize, session)
+        except SessionConflict as e:
+            raise HTTPException(status_code=409, detail=f"{str(e)}. Please retry.")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to remove PDF: {str(e)}")
+    
+    return SessionDocumentsResponse(**session_documents(session))
+
+CHAT_INSTRUCTION = (
     "You are a helpful chatbot. If the user asks something related to the PDF, "
     "answer using the information found in the PDF. Otherwise, just answer normally. "
     "Be clear, friendly, and helpful."
 )
 
+# System prompt wrapping the retrieved context (LangChain's "stuff" chain wording)
+STUFF_SYSTEM_TEMPLATE = (
+    "Use the following pieces of context to answer the user's question. \n"
+    "If you don't know the answer, just say that you don't know, don't try to make up an answer.\n"
+    "----------------\n"
+    "{context}"
+)
 
+# Chunks retrieved per question; build_context keeps as many as fit the chat budget
+CHAT_RETRIEVAL_K = 6
+
+def build_chat_question(question: str, history_text: str) -> str:
+    """Combine the instruction, the conversation memory and the new question."""
+    if history_text:
+        return f"{CHAT_INSTRUCTION}\n\nPrevious conversation:\n{history_text}\n\nCurrent question: {question}"
+    return f"{CHAT_INSTRUCTION}\n\nQuestion: {question}"
+
+def format_sources(docs, documents: Optional[Dict[str, dict]] = None) -> List[Dict[str, str]]:
+    """Short, JSON-friendly previews of retrieved chunks, with the source file's name when known."""
+    sources = []
+    for doc in docs:
+        source = {key: str(value) for key, value in doc.metadata.items()}
+        filename = (documents or {}).get(doc.metadata.get("document_id"), {}).get("filename")
+        if filename:
+            source["source"] = filename
+        source["content"] = doc.page_content[:300]
+        sources.append(source)
+    return sources
+
+async def embed_question(text: str) -> np.ndarray:
+    # Goes through the embedding batcher, ahead of any queued document chunks
+    with stage("embed_query"):
+        return (await embedding_engine.aencode([text], query=True))[0]
+
+async def answer_cache_vector(session, question: str, question_vector: Optional[np.ndarray] = None):
+    """Embedding used as the answer cache key, or None when the session can't be cached."""
+    if session.doc_hash is None or not answer_cache.enabled:
+        return None
+    key_text = cache_key_text(question, session.memory.turns)
+    if key_text == question and question_vector is not None:
+        return question_vector
+    return await embed_question(key_text)
+
+async def prepare_chat(session, question: str, question_vector: Optional[np.ndarray] = None):
+    """Retrieve chunks for `question` and build the chat prompt within the token budget.
+
+    Returns (messages, context); `context.documents` are the chunks that made it in.
+    Conversation memory (summary, recalled and recent turns) fills HISTORY_TOKENS_CHAT.
+    """
+    if question_vector is None:
+        question_vector = await embed_question(question)
+    with stage("retrieve"):
+        docs = await asyncio.to_thread(
+            session.vector_store.hybrid_search_by_vector, question, question_vector, CHAT_RETRIEVAL_K
+        )
+    with stage("context"):
+        context = build_context(docs, settings.CONTEXT_TOKENS_CHAT, session.documents)
+        messages = [
+            SystemMessage(content=STUFF_SYSTEM_TEMPLATE.format(context=context.text)),
+            HumanMessage(content=build_chat_question(question, session.memory.prompt_text(question_vector))),
+        ]
+    return messages, context
+
+async def summarize_memory(session):
+    """Fold older turns into the conversation summary once the answer has been sent."""
+    memory = session.memory
+    if await memory_summarizer.update(memory):
+        await asyncio.to_thread(sessions.save_summary, session, memory)
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/api/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
+    """Handle chat questions."""
+    session = await sessions.aget(request.session_id)
+    if session is None:
+        raise HTTPException(status_code=400, detail="No PDF uploaded for this session. Please upload a PDF first.")
+    
+    try:
+        # One embedding of the question serves both the answer cache and retrieval
+        question_vector = await embed_question(request.question)
+        
+        # Serve repeated questions about the same document from the answer cache
+        cache_vector = await answer_cache_vector(session, request.question, question_vector)
+        with stage("answer_cache"):
+            answer = answer_cache.lookup(session.doc_hash, cache_vector) if cache_vector is not None else None
+        cached = answer is not None
+        prompt_tokens = None
+        
+        if not cached:
+            # Top chunks by BM25 + vector similarity, packed into the chat token budget
+            messages, context = await prepare_chat(session, request.question, question_vector)
+            prompt_tokens = context_stats.record("chat", messages, context)
+            with stage("llm"):
+                response = await llm_pool.get().ainvoke(messages)
+            record_llm_usage("chat", response)
+            answer = response.content
+            
+            if cache_vector is not None:
+                answer_cache.store(session.doc_hash, cache_vector, request.question, answer)
         
-        if history_text:
-            final_question = f"{instruction}\n\nPrevious conversation:\n{history_text}\n\nCurrent question: {request.question}"
-        else:
-            final_question = f"{instruction}\n\nQuestion: {request.question}"
-        
-        # Run QA
-        answer = qa_chain.run(final_question)
-        
-        # Save to history
-        chat_history.append((request.question, answer))
-        chat_histories[request.session_id] = chat_history
+        # Save to memory; older turns are folded into the summary after the response is sent
+        await asyncio.to_thread(sessions.add_turn, session, request.question, answer, question_vector)
+        background_tasks.add_task(summarize_memory, session)
         
         return ChatResponse(
             id=str(uuid.uuid4()),
             author="FasarliAI",
             content=answer,
             sources=[],
-            timestamp=datetime.now().isoformat()
+            timestamp=datetime.now().isoformat(),
+            cached=cached,
+            prompt_tokens=prompt_tokens
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get answer: {str(e)}")
 
-@app.post("/api/quiz", response_model=QuizResponse)
-async def generate_quiz(request: QuizRequest):
-    """Generate quiz questions from the PDF."""
-    if request.session_id not in vector_stores:
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest, background_tasks: BackgroundTasks):
+    """Stream a chat answer as Server-Sent Events.
+
+    Events, in order: `sources` (chunks used in the prompt), `token` (one per model chunk),
+    then `done` with the full message, timings and prompt size, or `error` if generation fails.
+    """
+    session = await sessions.aget(request.session_id)
+    if session is None:
         raise HTTPException(status_code=400, detail="No PDF uploaded for this session. Please upload a PDF first.")
     
-    try:
-        vector_store = vector_stores[request.session_id]
-        
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        if not groq_api_key:
-            raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
-        
-        llm = ChatGroq(
-            api_key=groq_api_key,
-            model_name="llama-3.1-8b-instant",
-            temperature=0.5,  # Lower temperature for faster, more deterministic responses
-            max_tokens=1000  # Limit response length for faster generation
+    llm = llm_pool.get()
+    
+    async def event_stream():
+        start = time.perf_counter()
+        timings = {}
+        try:
+            # One embedding of the question serves both the answer cache and retrieval
+            question_vector = await embed_question(request.question)
+            cache_vector = await answer_cache_vector(session, request.question, question_vector)
+            with stage("answer_cache"):
+                cached_answer = answer_cache.lookup(session.doc_hash, cache_vector) if cache_vector is not None else None
+            
+            messages, context = await prepare_chat(session, request.question, question_vector)
+            timings["retrieval_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            sources = format_sources(context.documents, session.documents)
+            yield sse_event("sources", {"sources": sources})
+            
+            prompt_tokens = None
+            if cached_answer is not None:
+                answer = cached_answer
+                timings["first_token_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                yield sse_event("token", {"content": answer})
+            else:
+                prompt_tokens = context_stats.record("chat", messages, context)
+                parts = []
+                usage_chunk = None
+                llm_start = time.perf_counter()
+                async for chunk in llm.astream(messages):
+                    if getattr(chunk, "usage_metadata", None):
+                        # Usage arrives with the final chunk
+                        usage_chunk = chunk
+                    if not chunk.content:
+                        continue
+                    if not parts:
+                        timings["first_token_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                    parts.append(chunk.content)
+                    yield sse_event("token", {"content": chunk.content})
+                answer = "".join(parts)
+                record_stage("llm", time.perf_counter() - llm_start)
+                record_llm_usage("chat", usage_chunk)
+                
+                if cache_vector is not None:
+                    answer_cache.store(session.doc_hash, cache_vector, request.question, answer)
+            timings["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            
+            # Only a fully generated answer goes into memory
+            await asyncio.to_thread(sessions.add_turn, session, request.question, answer, question_vector)
+            
+            yield sse_event("done", {
+                "id": str(uuid.uuid4()),
+                "author": "FasarliAI",
+                "content": answer,
+                "sources": sources,
+                "timestamp": datetime.now().isoformat(),
+                "cached": cached_answer is not None,
+                "timings": timings,
+                "prompt_tokens": prompt_tokens,
+            })
+        except Exception as e:
+            yield sse_event("error", {"detail": f"Failed to get answer: {str(e)}"})
+    
+    background_tasks.add_task(summarize_memory, session)
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Runs once the stream has finished
+        background=background_tasks,
+    )
+
+QUIZ_QUESTIONS = 5
+FLASHCARD_COUNT = 10
+
+def quiz_prompt(context_text: str, count: int, exclude: List[str], json_mode: bool) -> str:
+    if json_mode:
+        instructions = (
+            f"Create {count} multiple-choice questions. Answer with a JSON object only:\n"
+            '{"questions": [{"question": "...", "a": "...", "b": "...", "c": "...", "d": "...", "correct": "A"}]}'
         )
-        
-        # Optimize: Get fewer, more focused documents for faster processing
-        relevant_docs = vector_store.similarity_search("key concepts main ideas important information", k=2)
-        
-        # Aggressively limit context size for faster LLM processing
-        context_parts = []
-        total_length = 0
-        max_length = 1200  # Reduced to 1200 chars for much faster processing
-        
-        for doc in relevant_docs:
-            content = doc.page_content if hasattr(doc, 'page_content') else str(doc)
-            # Truncate each document to max 600 chars
-            truncated_content = content[:600] if len(content) > 600 else content
-            if total_length + len(truncated_content) > max_length:
-                remaining = max_length - total_length
-                if remaining > 50:
-                    context_parts.append(truncated_content[:remaining])
-                break
-            context_parts.append(truncated_content)
-            total_length += len(truncated_content)
-        
-        context = "\n\n".join(context_parts)
-        
-        # Optimize: Ultra-concise prompt for fastest generation
-        from langchain_core.messages import HumanMessage
-        
-        quiz_prompt = (
-            f"Create 5 multiple-choice questions. Format:\n"
+    else:
+        instructions = (
+            f"Create {count} multiple-choice questions. Format:\n"
             f"Q1: [question]\n"
             f"A) [option]\n"
             f"B) [option]\n"
             f"C) [option]\n"
             f"D) [option]\n"
-            f"Correct: [A/B/C/D]\n\n"
-            f"{context}\n\n"
-            f"Output 5 questions in the format above."
+            f"Correct: [A/B/C/D]"
         )
-        
-        # Direct LLM call (faster than chain)
+    if exclude:
+        instructions += "\n\nDon't repeat these questions:\n" + "\n".join(f"- {question}" for question in exclude)
+    return f"{instructions}\n\n{context_text}\n\nOutput {count} questions {'as JSON' if json_mode else 'in the format above'}."
+
+def flashcard_prompt(context_text: str, count: int, exclude: List[str], json_mode: bool) -> str:
+    if json_mode:
+        instructions = (
+            f"Create {count} flashcards. Answer with a JSON object only:\n"
+            '{"flashcards": [{"front": "concept", "back": "definition"}]}'
+        )
+    else:
+        instructions = (
+            f"Create {count} flashcards. Format:\n"
+            f"Front: [concept]\n"
+            f"Back: [definition]"
+        )
+    if exclude:
+        instructions += "\n\nDon't repeat these concepts:\n" + "\n".join(f"- {front}" for front in exclude)
+    return f"{instructions}\n\n{context_text}\n\nOutput {count} flashcards {'as JSON' if json_mode else 'in the format above'}."
+
+# Set once the API rejected JSON mode for the configured model, so later requests go straight to text
+json_mode_unsupported = False
+
+def json_mode_failure(e: BadRequestError) -> Tuple[Optional[str], str]:
+    """Classify a 400 from a JSON-mode request: (kind, text).
+
+    kind is "invalid_output" when the model's answer wasn't valid JSON (text holds that
+    answer, which Groq returns as `failed_generation`), "unsupported" when the model
+    doesn't accept `response_format`, and None for anything else.
+    """
+    body = e.body if isinstance(e.body, dict) else {}
+    error = body.get("error", body) if isinstance(body.get("error", body), dict) else {}
+    message = str(error.get("message") or e)
+    if error.get("code") == "json_validate_failed":
+        return "invalid_output", str(error.get("failed_generation") or "")
+    if "response_format" in message or "json mode" in message.lower():
+        return "unsupported", message
+    return None, message
+
+async def generate_items(kind: str, llm, context, build_prompt, parse, key, target: int, minimum: int) -> List[Dict]:
+    """Ask the LLM for `target` items, then (up to ARTIFACT_TOPUP_ROUNDS times) only for the missing ones.
+
+    Raises ValueError if fewer than `minimum` valid items came back.
+    """
+    global json_mode_unsupported
+    json_mode = settings.ARTIFACT_JSON_MODE and not json_mode_unsupported
+    items = []
+    seen = set()
+    response_text = ""
+    rounds = 1 + max(0, settings.ARTIFACT_TOPUP_ROUNDS)
+    while rounds > 0:
+        prompt = build_prompt(context.text, target - len(items), [key(item) for item in items], json_mode)
+        messages = [HumanMessage(content=prompt)]
+        context_stats.record(kind, messages, context)
         try:
-            messages = [HumanMessage(content=quiz_prompt)]
-            quiz_response_obj = llm.invoke(messages)
-            
-            # Extract content from response
-            if hasattr(quiz_response_obj, 'content'):
-                quiz_response = quiz_response_obj.content
-            else:
-                quiz_response = str(quiz_response_obj)
-            
-            questions = parse_quiz(quiz_response)
-            
-            # If parsing failed or got too few questions, try a simpler approach
-            if len(questions) < 3:
-                # Fallback: Try to extract questions using regex
-                pattern = r'Q\d+:\s*(.+?)\nA\)\s*(.+?)\nB\)\s*(.+?)\nC\)\s*(.+?)\nD\)\s*(.+?)\nCorrect:\s*([A-D])'
-                matches = re.findall(pattern, quiz_response, re.DOTALL | re.IGNORECASE)
-                if matches:
-                    questions = []
-                    for i, match in enumerate(matches[:5], 1):
-                        questions.append({
-                            'question': match[0].strip(),
-                            'a': match[1].strip(),
-                            'b': match[2].strip(),
-                            'c': match[3].strip(),
-                            'd': match[4].strip(),
-                            'correct': match[5].strip().upper()
-                        })
-            
-            if not questions or len(questions) < 3:
-                raise ValueError(f"Failed to parse quiz. Got {len(questions) if questions else 0} questions. Response: {quiz_response[:200]}")
-                
-        except Exception as parse_error:
-            raise HTTPException(
-                status_code=500, 
-                detail=f"Failed to generate or parse quiz: {str(parse_error)}"
-            )
-        
+            with stage("llm"):
+                if json_mode:
+                    response = await llm.bind(response_format={"type": "json_object"}).ainvoke(messages)
+                else:
+                    response = await llm.ainvoke(messages)
+            record_llm_usage(kind, response)
+            response_text = str(response.content)
+        except BadRequestError as e:
+            failure, text = json_mode_failure(e) if json_mode else (None, "")
+            if failure is None:
+                raise
+            if failure == "unsupported":
+                # Not this round's fault: ask again in the text format without using up a round
+                print(f"JSON mode is not supported by {getattr(llm, 'model_name', 'the model')}, using the text format: {text}")
+                json_mode_unsupported = True
+                json_mode = False
+                continue
+            # Invalid JSON is usually close enough for the lenient parser
+            response_text = text
+        rounds -= 1
+        
+        with stage("parse"):
+            parsed = parse(response_text)
+        for item in parsed:
+            identity = key(item).lower()
+            if identity not in seen:
+                seen.add(identity)
+                items.append(item)
+        if len(items) >= target:
+            break
+    
+    if len(items) < minimum:
+        raise ValueError(f"Failed to parse {kind}. Got {len(items)} items. Response: {response_text[:200]}")
+    return [item.model_dump() for item in items[:target]]
+
+async def create_quiz(vector_store) -> List[Dict]:
+    """Generate 5 quiz questions from the PDF."""
+    llm = llm_pool.get(
+        temperature=0.5,  # Lower temperature for faster, more deterministic responses
+        max_tokens=1000  # Limit response length for faster generation
+    )
+    
+    # Small token budget keeps generation fast; the most relevant chunks fill it first
+    with stage("retrieve"):
+        relevant_docs = await vector_store.ahybrid_search("key concepts main ideas important information", k=4)
+    context = build_context(relevant_docs, settings.CONTEXT_TOKENS_QUIZ)
+    
+    return await generate_items(
+        "quiz", llm, context, quiz_prompt, parse_quiz, lambda question: question.question,
+        target=QUIZ_QUESTIONS, minimum=3,
+    )
+
+async def create_flashcards(vector_store) -> List[Dict]:
+    """Generate 10 flashcards from the PDF."""
+    llm = llm_pool.get(
+        temperature=0.5,  # Lower temperature for faster, more deterministic responses
+        max_tokens=800  # Limit response length for faster generation
+    )
+    
+    # Small token budget keeps generation fast; the most relevant chunks fill it first
+    with stage("retrieve"):
+        relevant_docs = await vector_store.ahybrid_search("key concepts definitions main ideas", k=4)
+    context = build_context(relevant_docs, settings.CONTEXT_TOKENS_FLASHCARDS)
+    
+    return await generate_items(
+        "flashcards", llm, context, flashcard_prompt, parse_flashcards, lambda card: card.front,
+        target=FLASHCARD_COUNT, minimum=3,
+    )
+
+async def create_conversation_name(vector_store) -> str:
+    """Generate a short conversation title from the PDF."""
+    llm = llm_pool.get()
+    
+    # Get relevant content from PDF to understand what it's about
+    with stage("retrieve"):
+        relevant_docs = await vector_store.ahybrid_search("main topic subject title summary overview", k=3)
+    context = build_context(relevant_docs, settings.CONTEXT_TOKENS_NAME)
+    
+    prompt = f"""Based on the following PDF content, generate a short and clear conversation title (maximum 5-6 words). 
+The title should summarize what the PDF is about.
+
+PDF Content:
+{context.text}
+
+Generate only the title, nothing else. Make it concise and descriptive."""
+    
+    messages = [HumanMessage(content=prompt)]
+    context_stats.record("name", messages, context)
+    with stage("llm"):
+        response_obj = await llm.ainvoke(messages)
+    record_llm_usage("name", response_obj)
+    
+    name = response_obj.content.strip() if hasattr(response_obj, 'content') else str(response_obj).strip()
+    
+    # Clean up the name (remove quotes, extra spaces, etc.)
+    name = name.strip('"').strip("'").strip()
+    if len(name) > 60:
+        name = name[:57] + "..."
+    
+    return name
+
+# Artifacts that can be cached per document and precomputed after upload
+ARTIFACT_GENERATORS = {
+    "quiz": create_quiz,
+    "flashcards": create_flashcards,
+    "name": create_conversation_name,
+}
+
+async def session_artifact(session, kind: str, refresh: bool = False):
+    """Get an artifact for the session's document, generating it if it isn't cached."""
+    generate = functools.partial(ARTIFACT_GENERATORS[kind], session.vector_store)
+    if session.doc_hash is None:
+        return await generate()
+    return await artifact_store.get_or_generate(session.doc_hash, kind, generate, refresh=refresh)
+
+def precompute_artifacts(doc_hash: str, vector_store):
+    generators = {
+        kind: functools.partial(ARTIFACT_GENERATORS[kind], vector_store)
+        for kind in settings.ARTIFACT_PRECOMPUTE
+        if kind in ARTIFACT_GENERATORS
+    }
+    artifact_store.precompute(doc_hash, generators)
+
+async def submit_artifact_job(session, kind: str, field: str, refresh: bool) -> JSONResponse:
+    """Generate an artifact in a background job; its result is `{field: artifact}`."""
+    async def run(progress):
+        value = await StageTimer(progress).run("generate", session_artifact(session, kind, refresh=refresh))
+        return {field: value}
+    
+    try:
+        record = await job_runner.submit(kind, ["generate"], run, session_id=session.session_id)
+    except JobQueueFull as e:
+        raise job_queue_full(e)
+    return job_accepted(record)
+
+@app.post("/api/quiz", response_model=QuizResponse)
+async def generate_quiz(request: QuizRequest):
+    """Generate quiz questions from the PDF."""
+    session = await sessions.aget(request.session_id)
+    if session is None:
+        raise HTTPException(status_code=400, detail="No PDF uploaded for this session. Please upload a PDF first.")
+    
+    if request.job:
+        return await submit_artifact_job(session, "quiz", "questions", request.refresh)
+    
+    try:
+        questions = await session_artifact(session, "quiz", refresh=request.refresh)
         return QuizResponse(questions=[QuizQuestion(**q) for q in questions])
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate quiz: {str(e)}")
 
 class ConversationNameRequest(BaseModel):
     session_id: str
+    refresh: bool = False  # Regenerate instead of serving the cached name
 
 class ConversationNameResponse(BaseModel):
     name: str
@@ -395,48 +884,12 @@ class ConversationNameResponse(BaseModel):
 @app.post("/api/generate-conversation-name", response_model=ConversationNameResponse)
 async def generate_conversation_name(request: ConversationNameRequest):
     """Generate a short, clear conversation name based on PDF content."""
-    if request.session_id not in vector_stores:
+    session = await sessions.aget(request.session_id)
+    if session is None:
         raise HTTPException(status_code=400, detail="No PDF uploaded for this session.")
     
     try:
-        vector_store = vector_stores[request.session_id]
-        
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        if not groq_api_key:
-            raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
-        
-        llm = ChatGroq(
-            api_key=groq_api_key,
-            model_name="llama-3.1-8b-instant"
-        )
-        
-        # Get relevant content from PDF to understand what it's about
-        relevant_docs = vector_store.similarity_search("main topic subject title summary overview", k=3)
-        context = "\n\n".join([doc.page_content if hasattr(doc, 'page_content') else str(doc) for doc in relevant_docs])
-        
-        # Limit context size for faster processing
-        if len(context) > 1000:
-            context = context[:1000]
-        
-        prompt = f"""Based on the following PDF content, generate a short and clear conversation title (maximum 5-6 words). 
-The title should summarize what the PDF is about.
-
-PDF Content:
-{context}
-
-Generate only the title, nothing else. Make it concise and descriptive."""
-        
-        from langchain_core.messages import HumanMessage
-        messages = [HumanMessage(content=prompt)]
-        response_obj = llm.invoke(messages)
-        
-        name = response_obj.content.strip() if hasattr(response_obj, 'content') else str(response_obj).strip()
-        
-        # Clean up the name (remove quotes, extra spaces, etc.)
-        name = name.strip('"').strip("'").strip()
-        if len(name) > 60:
-            name = name[:57] + "..."
-        
+        name = await session_artifact(session, "name", refresh=request.refresh)
         return ConversationNameResponse(name=name)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate conversation name: {str(e)}")
@@ -444,97 +897,73 @@ Generate only the title, nothing else. Make it concise and descriptive."""
 @app.post("/api/flashcards", response_model=FlashcardResponse)
 async def generate_flashcards(request: FlashcardRequest):
     """Generate flashcards from the PDF."""
-    if request.session_id not in vector_stores:
+    session = await sessions.aget(request.session_id)
+    if session is None:
         raise HTTPException(status_code=400, detail="No PDF uploaded for this session. Please upload a PDF first.")
     
+    if request.job:
+        return await submit_artifact_job(session, "flashcards", "flashcards", request.refresh)
+    
     try:
-        vector_store = vector_stores[request.session_id]
-        
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        if not groq_api_key:
-            raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
-        
-        llm = ChatGroq(
-            api_key=groq_api_key,
-            model_name="llama-3.1-8b-instant",
-            temperature=0.5,  # Lower temperature for faster, more deterministic responses
-            max_tokens=800  # Limit response length for faster generation
-        )
-        
-        # Optimize: Get fewer, more focused documents for faster processing
-        relevant_docs = vector_store.similarity_search("key concepts definitions main ideas", k=2)
-        
-        # Aggressively limit context size for faster LLM processing
-        context_parts = []
-        total_length = 0
-        max_length = 1200  # Reduced to 1200 chars for much faster processing
-        
-        for doc in relevant_docs:
-            content = doc.page_content if hasattr(doc, 'page_content') else str(doc)
-            # Truncate each document to max 600 chars
-            truncated_content = content[:600] if len(content) > 600 else content
-            if total_length + len(truncated_content) > max_length:
-                remaining = max_length - total_length
-                if remaining > 50:
-                    context_parts.append(truncated_content[:remaining])
-                break
-            context_parts.append(truncated_content)
-            total_length += len(truncated_content)
-        
-        context = "\n\n".join(context_parts)
-        
-        # Optimize: Ultra-concise prompt for fastest generation
-        from langchain_core.messages import HumanMessage
-        
-        flashcard_prompt = (
-            f"Create 10 flashcards. Format:\n"
-            f"Front: [concept]\n"
-            f"Back: [definition]\n\n"
-            f"{context}\n\n"
-            f"Output 10 flashcards in the format above."
-        )
-        
-        # Direct LLM call (faster than chain) with timeout handling
-        try:
-            messages = [HumanMessage(content=flashcard_prompt)]
-            flashcard_response = llm.invoke(messages)
-            
-            # Extract content from response
-            if hasattr(flashcard_response, 'content'):
-                response_text = flashcard_response.content
-            else:
-                response_text = str(flashcard_response)
-            
-            flashcards = parse_flashcards(response_text)
-            
-            # If parsing failed or got too few cards, try a simpler approach
-            if len(flashcards) < 5:
-                # Fallback: Try to extract pairs from the response
-                # Look for Front: ... Back: ... patterns
-                pattern = r'Front:\s*(.+?)\s*Back:\s*(.+?)(?=Front:|$)'
-                matches = re.findall(pattern, response_text, re.DOTALL | re.IGNORECASE)
-                if matches:
-                    flashcards = [{'front': f.strip(), 'back': b.strip()} for f, b in matches[:10]]
-            
-            if not flashcards or len(flashcards) < 3:
-                raise ValueError(f"Failed to parse flashcards. Got {len(flashcards) if flashcards else 0} cards. Response: {response_text[:200]}")
-                
-        except Exception as parse_error:
-            raise HTTPException(
-                status_code=500, 
-                detail=f"Failed to generate or parse flashcards: {str(parse_error)}"
-            )
-        
+        flashcards = await session_artifact(session, "flashcards", refresh=request.refresh)
         return FlashcardResponse(flashcards=[Flashcard(**fc) for fc in flashcards])
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate flashcards: {str(e)}")
 
+@app.get("/api/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """Progress of a background job, and its result or error once it has finished."""
+    record = await asyncio.to_thread(job_store.get, job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_response(record)
+
+@app.delete("/api/jobs/{job_id}", response_model=JobResponse)
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job."""
+    record = await asyncio.to_thread(job_store.get, job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if record["status"] in FINISHED:
+        raise HTTPException(status_code=409, detail=f"Job already {record['status']}")
+    if not await job_runner.cancel(job_id):
+        # Running in another worker process, which stops it at its next check
+        if not await asyncio.to_thread(job_store.request_cancel, job_id):
+            record = await asyncio.to_thread(job_store.get, job_id)
+            raise HTTPException(status_code=409, detail=f"Job already {record['status']}")
+    return job_response(await asyncio.to_thread(job_store.get, job_id))
+
 @app.get("/api/health")
 async def health():
     """Health check endpoint."""
-    return {"status": "ok"}
+    return {
+        "status": "ok" if embedding_engine.ready else "starting",
+        "embeddings": embedding_engine.status(),
+        "ingest": ingest_pool.status(),
+        "index_cache": index_cache.status(),
+        "sessions": sessions.status(),
+        "llm": llm_pool.status(),
+        "answer_cache": answer_cache.status(),
+        "artifacts": artifact_store.status(),
+        "context": context_stats.status(),
+        "memory": memory_summarizer.status(),
+        "jobs": job_runner.status(),
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Stage latencies, chunk counts, prompt sizes and LLM token usage in the Prometheus text format."""
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if settings.SERVER_WORKERS > 1:
+        if not settings.SESSION_SHARED:
+            print("Warning: SESSION_SHARED is off, so each worker only knows the sessions it created")
+        # Each worker imports the app itself
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=settings.SERVER_WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
 
@@ -0,0 +1,189 @@
+"""Per-session conversation memory: a rolling summary plus the most recent turns.
+
+Chat prompts include the summary, up to MEMORY_RECALL_TURNS older exchanges whose
+questions are similar to the new one, and the latest exchanges not yet summarized, all
+within HISTORY_TOKENS_CHAT. After each answer is sent, turns older than the last
+MEMORY_RECENT_TURNS are folded into the summary by a short background LLM call, so
+prompt size stays bounded however long the conversation runs. At most MEMORY_MAX_TURNS
+exchanges are stored per session.
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.messages import HumanMessage
+
+import settings
+from context import fit_history, token_counter
+from llm import llm_pool
+from metrics import record_llm_usage, stage
+
+# Each answer is shortened to this many tokens before it is summarized
+MAX_SUMMARIZED_ANSWER_TOKENS = 300
+
+SUMMARY_PROMPT = (
+    "Update the summary of this conversation between a user and an assistant about the user's PDF "
+    "documents. Keep facts, names, numbers and open questions the user may refer back to. "
+    "Answer with the summary only, in at most {words} words.\n\n"
+    "Current summary:\n{summary}\n\n"
+    "New exchanges:\n{turns}\n\n"
+    "Updated summary:"
+)
+
+
+class ConversationMemory:
+    """Stored turns of one conversation and the summary of all but the most recent ones.
+
+    `turns` holds (question, answer) tuples, oldest first; `vectors` holds the matching
+    question embeddings (None for turns reloaded from disk), used to recall older turns.
+    """
+
+    def __init__(self, turns: Optional[List[Tuple[str, str]]] = None, summary: str = "",
+                 summarized: int = 0, max_turns: int = 50, total: Optional[int] = None):
+        self.turns: List[Tuple[str, str]] = list(turns or [])
+        self.vectors: List[Optional[np.ndarray]] = [None] * len(self.turns)
+        self.summary = summary
+        self.max_turns = max(1, max_turns)
+        # Turns ever added (more than `turns` holds once the cap dropped some), and how
+        # many of those are covered by `summary`
+        self.total = max(total or 0, len(self.turns))
+        self.summarized = min(summarized, self.total)
+        # One summary update at a time per conversation
+        self.lock = asyncio.Lock()
+
+    @property
+    def _offset(self) -> int:
+        """Absolute number of the oldest stored turn."""
+        return self.total - len(self.turns)
+
+    def add(self, question: str, answer: str, question_vector: Optional[np.ndarray] = None):
+        self.turns.append((question, answer))
+        self.vectors.append(question_vector)
+        self.total += 1
+        overflow = len(self.turns) - self.max_turns
+        if overflow > 0:
+            del self.turns[:overflow]
+            del self.vectors[:overflow]
+
+    def unsummarized(self) -> List[Tuple[str, str]]:
+        return self.turns[max(0, self.summarized - self._offset):]
+
+    def recall(self, question_vector: Optional[np.ndarray], limit: int, min_similarity: float) -> List[Tuple[str, str]]:
+        """Up to `limit` summarized turns whose questions resemble the new one, oldest first."""
+        if question_vector is None or limit <= 0:
+            return []
+        candidates = [
+            position for position in range(max(0, self.summarized - self._offset))
+            if self.vectors[position] is not None
+        ]
+        if not candidates:
+            return []
+        # Embeddings are normalized, so the dot product is the cosine similarity
+        similarities = np.stack([self.vectors[position] for position in candidates]) @ question_vector
+        ranked = sorted(zip(similarities.tolist(), candidates), reverse=True)
+        chosen = sorted(position for similarity, position in ranked[:limit] if similarity >= min_similarity)
+        return [self.turns[position] for position in chosen]
+
+    def prompt_text(self, question_vector: Optional[np.ndarray] = None,
+                    budget: int = settings.HISTORY_TOKENS_CHAT) -> str:
+        """Summary, recalled turns and recent turns for the next prompt, within `budget` tokens.
+
+        Recent turns are kept first, then the summary, then recalled turns.
+        """
+        recent = fit_history(self.unsummarized(), budget, max_turns=0)
+        remaining = budget - token_counter.count(recent)
+        summary = token_counter.truncate(self.summary, remaining, hard=True) if self.summary else ""
+        remaining -= token_counter.count(summary)
+        recalled = fit_history(
+            self.recall(question_vector, settings.MEMORY_RECALL_TURNS, settings.MEMORY_RECALL_MIN_SIMILARITY),
+            remaining, max_turns=0,
+        )
+
+        sections = []
+        if summary:
+            sections.append(f"Summary of the earlier conversation:\n{summary}")
+        if recalled:
+            sections.append(f"Related earlier exchanges:\n{recalled}")
+        if recent:
+            sections.append(recent)
+        return "\n\n".join(sections)
+
+    def to_dict(self) -> Dict:
+        return {
+            "summary": self.summary,
+            # Stored turns already covered by the summary
+            "summarized": max(0, self.summarized - self._offset),
+        }
+
+
+class MemorySummarizer:
+    """Folds older turns into each conversation's summary after the answer is sent."""
+
+    def __init__(self, recent_turns: int, summary_tokens: int):
+        self.recent_turns = max(0, recent_turns)
+        self.summary_tokens = summary_tokens
+        self.updates = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+
+    async def update(self, memory: ConversationMemory) -> bool:
+        """Summarize every turn but the last `recent_turns`; returns whether the summary changed."""
+        async with memory.lock:
+            target = memory.total - self.recent_turns
+            if target <= memory.summarized:
+                return False
+            start = max(memory.summarized, memory._offset)
+            new_turns = memory.turns[start - memory._offset:target - memory._offset]
+            if not new_turns:
+                # Older turns were dropped by the cap before they could be summarized
+                memory.summarized = target
+                return True
+            turns_text = "\n".join(
+                f"Q: {question}\nA: {token_counter.truncate(answer, MAX_SUMMARIZED_ANSWER_TOKENS, hard=True)}"
+                for question, answer in new_turns
+            )
+            prompt = SUMMARY_PROMPT.format(
+                # ~0.75 words per token
+                words=int(self.summary_tokens * 0.75),
+                summary=memory.summary or "(none yet)",
+                turns=turns_text,
+            )
+            llm = llm_pool.get(temperature=0, max_tokens=self.summary_tokens)
+            started = time.perf_counter()
+            try:
+                with stage("summarize"):
+                    response = await llm.ainvoke([HumanMessage(content=prompt)])
+            except Exception as e:
+                # The turns stay unsummarized and are retried after the next answer
+                self.failed += 1
+                print(f"Conversation summary update failed: {e}")
+                return False
+            self.total_seconds += time.perf_counter() - started
+            self.updates += 1
+            record_llm_usage("summary", response)
+            memory.summary = str(response.content).strip()
+            memory.summarized = target
+            return True
+
+    def status(self) -> dict:
+        return {
+            "recent_turns": self.recent_turns,
+            "summary_tokens": self.summary_tokens,
+            "updates": self.updates,
+            "failed": self.failed,
+            "mean_seconds": round(self.total_seconds / self.updates, 3) if self.updates else None,
+        }
+
+
+def new_memory(turns: Optional[List[Tuple[str, str]]] = None, summary: str = "", summarized: int = 0,
+               total: Optional[int] = None) -> ConversationMemory:
+    return ConversationMemory(
+        turns, summary=summary, summarized=summarized, max_turns=settings.MEMORY_MAX_TURNS, total=total
+    )
+
+
+memory_summarizer = MemorySummarizer(
+    recent_turns=settings.MEMORY_RECENT_TURNS,
+    summary_tokens=settings.MEMORY_SUMMARY_TOKENS,
+)
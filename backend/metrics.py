@@ -0,0 +1,333 @@
+"""Per-stage latency tracing and Prometheus metrics.
+
+Every request gets a trace (a context variable set by MetricsMiddleware). `stage(name)`
+times a block, records it in the `pdfchat_stage_seconds{endpoint, stage}` histogram and
+adds it to the trace, which becomes the response's `Server-Timing` header when
+METRICS_SERVER_TIMING is on. `/metrics` renders everything in the Prometheus text format.
+
+With METRICS_ENABLED=false, `stage()` returns a shared no-op context manager, observations
+return immediately and the middleware is not installed.
+"""
+import bisect
+import contextvars
+import itertools
+import threading
+import time
+from contextlib import nullcontext
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import settings
+
+LATENCY_BUCKETS_SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+CHUNK_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 65536)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Cumulative-bucket histogram (upper bounds inclusive, plus +Inf)."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.total += value
+            self.count += 1
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        """(cumulative bucket counts including +Inf, sum, count)."""
+        with self._lock:
+            return list(itertools.accumulate(self.counts)), self.total, self.count
+
+    def status(self) -> dict:
+        cumulative, total, count = self.snapshot()
+        labels = [str(bound) for bound in self.buckets] + ["+Inf"]
+        return {
+            "buckets": dict(zip(labels, cumulative)),
+            "count": count,
+            "mean": round(total / count, 3) if count else None,
+        }
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class HistogramFamily:
+    """Histograms of one metric, one per combination of label values."""
+
+    def __init__(self, registry: "MetricsRegistry", name: str, help_text: str,
+                 buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str) -> Histogram:
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, Histogram(self.buckets))
+        return child
+
+    def observe(self, value: float, *labelvalues: str):
+        if not self.registry.enabled:
+            return
+        self.labels(*labelvalues).observe(value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        # labels() may add a child from another thread while this renders
+        with self._lock:
+            children = sorted(self._children.items())
+        for key, histogram in children:
+            cumulative, total, count = histogram.snapshot()
+            for bound, value in zip([_number(b) for b in histogram.buckets] + ["+Inf"], cumulative):
+                le = 'le="' + bound + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {value}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class CounterFamily:
+    """Monotonic counters of one metric, one per combination of label values."""
+
+    def __init__(self, registry: "MetricsRegistry", name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labelvalues: str):
+        if not self.registry.enabled:
+            return
+        key = tuple(str(value) for value in labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in items)
+        return lines
+
+
+class _ExistingHistogram:
+    """Renders a Histogram owned by another component (e.g. the embedding batcher)."""
+
+    def __init__(self, name: str, help_text: str, histogram: Histogram):
+        self.name = name
+        self.help = help_text
+        self.histogram = histogram
+
+    def render(self) -> List[str]:
+        family = HistogramFamily(None, self.name, self.help, self.histogram.buckets)
+        family._children[()] = self.histogram
+        return family.render()
+
+
+class MetricsRegistry:
+    def __init__(self, enabled: bool, server_timing: bool):
+        self.enabled = enabled
+        self.server_timing = enabled and server_timing
+        self._families: List = []
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float],
+                  labelnames: Sequence[str] = ()) -> HistogramFamily:
+        family = HistogramFamily(self, name, help_text, buckets, labelnames)
+        self._families.append(family)
+        return family
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> CounterFamily:
+        family = CounterFamily(self, name, help_text, labelnames)
+        self._families.append(family)
+        return family
+
+    def register_histogram(self, name: str, help_text: str, histogram: Histogram):
+        self._families.append(_ExistingHistogram(name, help_text, histogram))
+
+    def render(self) -> str:
+        return "\n".join(line for family in self._families for line in family.render()) + "\n"
+
+
+metrics = MetricsRegistry(enabled=settings.METRICS_ENABLED, server_timing=settings.METRICS_SERVER_TIMING)
+
+REQUEST_SECONDS = metrics.histogram(
+    "pdfchat_http_request_duration_seconds", "HTTP request latency until the response is complete.",
+    LATENCY_BUCKETS_SECONDS, ("method", "route", "status"),
+)
+STAGE_SECONDS = metrics.histogram(
+    "pdfchat_stage_seconds", "Latency of one pipeline stage within a request.",
+    LATENCY_BUCKETS_SECONDS, ("endpoint", "stage"),
+)
+DOCUMENT_CHUNKS = metrics.histogram(
+    "pdfchat_document_chunks", "Chunks per ingested PDF.", CHUNK_BUCKETS, ("endpoint",),
+)
+DOCUMENT_PAGES = metrics.histogram(
+    "pdfchat_document_pages", "Pages per extracted PDF.", CHUNK_BUCKETS, ("endpoint",),
+)
+DUPLICATE_CHUNKS = metrics.counter(
+    "pdfchat_duplicate_chunks_total", "Chunks kept out of the index as exact or near duplicates.", ("kind",),
+)
+FURNITURE_LINES = metrics.counter(
+    "pdfchat_furniture_lines_total", "Repeated header/footer lines stripped from extracted pages.",
+)
+# Prompt metrics are labelled by prompt kind (chat, quiz, flashcards, name, summary) rather than
+# route, because quizzes, flashcards and titles are also generated in the background after uploads
+RETRIEVED_CHUNKS = metrics.histogram(
+    "pdfchat_retrieved_chunks", "Chunks retrieved (kind=retrieved) and chunks that fit the context (kind=used).",
+    (1, 2, 3, 4, 6, 8, 12, 16, 24, 32), ("prompt", "kind"),
+)
+PROMPT_TOKENS = metrics.histogram(
+    "pdfchat_prompt_tokens", "Tokens in each LLM prompt, by our own count.", TOKEN_BUCKETS, ("prompt",),
+)
+CONTEXT_TOKENS = metrics.histogram(
+    "pdfchat_context_tokens", "Tokens of retrieved context in each LLM prompt.", TOKEN_BUCKETS, ("prompt",),
+)
+LLM_TOKENS = metrics.counter(
+    "pdfchat_llm_tokens_total", "Tokens billed by the LLM API, from its usage reports.", ("prompt", "type"),
+)
+LLM_COMPLETION_TOKENS = metrics.histogram(
+    "pdfchat_llm_completion_tokens", "Completion tokens per LLM call, from its usage reports.",
+    TOKEN_BUCKETS, ("prompt",),
+)
+
+
+class Trace:
+    """Stages timed during one request, in the order they finished."""
+
+    __slots__ = ("scope", "stages")
+
+    def __init__(self, scope: Optional[dict] = None):
+        self.scope = scope
+        self.stages: List[Tuple[str, float]] = []
+
+    @property
+    def endpoint(self) -> str:
+        # The router fills in the matched route once the request reaches it
+        route = (self.scope or {}).get("route")
+        return getattr(route, "path", None) or "unmatched"
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+_NO_OP = nullcontext()
+
+
+def current_endpoint() -> str:
+    trace = _current_trace.get()
+    return trace.endpoint if trace is not None else "background"
+
+
+def detached_context() -> contextvars.Context:
+    """Copy of the current context without the request's trace, for tasks that outlive it."""
+    context = contextvars.copy_context()
+    context.run(_current_trace.set, None)
+    return context
+
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_stage(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def stage(name: str):
+    """Context manager timing a block as stage `name` of the current request."""
+    if not metrics.enabled:
+        return _NO_OP
+    return _Stage(name)
+
+
+def record_stage(name: str, seconds: float):
+    """Record an already-measured stage (StageTimer reports through this)."""
+    if not metrics.enabled:
+        return
+    trace = _current_trace.get()
+    STAGE_SECONDS.observe(seconds, trace.endpoint if trace is not None else "background", name)
+    if trace is not None:
+        trace.stages.append((name, seconds))
+
+
+def record_llm_usage(prompt: str, message):
+    """Add an LLM response's reported token usage (if any) to the token metrics."""
+    if not metrics.enabled:
+        return
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return
+    LLM_TOKENS.inc(usage.get("input_tokens", 0), prompt, "prompt")
+    LLM_TOKENS.inc(usage.get("output_tokens", 0), prompt, "completion")
+    LLM_COMPLETION_TOKENS.observe(usage.get("output_tokens", 0), prompt)
+
+
+def server_timing(trace: Trace, total: float) -> str:
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in trace.stages]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: per-request trace, request latency histogram, Server-Timing header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        trace = Trace(scope)
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if metrics.server_timing:
+                    headers = list(message.get("headers", []))
+                    value = server_timing(trace, time.perf_counter() - start)
+                    headers.append((b"server-timing", value.encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, scope["method"], trace.endpoint, status)
+            _current_trace.reset(token)
@@ -0,0 +1,390 @@
+"""Hybrid retrieval: BM25 over the chunk text fused with FAISS similarity.
+
+Dense search misses exact terms such as formula names and section numbers, so every
+vector store also carries a BM25 inverted index over the same chunks. The two rankings
+are combined with reciprocal rank fusion (score = sum of 1 / (RETRIEVAL_RRF_K + rank)).
+"""
+import asyncio
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.vectorstores import FAISS
+
+import settings
+from vector_index import create_index, reconstruct
+
+# Words, numbers and dotted/hyphenated compounds such as "3.2.1", "e-mc2" or "H2O"
+TOKEN_PATTERN = re.compile(r"\w+(?:[.\-]\w+)*")
+COMPOUND_SEPARATORS = re.compile(r"[.\-]")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased tokens; compounds are kept whole and also split into their parts."""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = COMPOUND_SEPARATORS.split(token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+class _Segment:
+    """Postings of a contiguous run of chunks, stored as CSR numpy arrays.
+
+    Postings for term t are positions[offsets[t]:offsets[t + 1]] with matching term
+    frequencies, where a position is the chunk's position in the FAISS index and term
+    ids are local to the segment. The segment covers positions start, start + 1, ...
+    with one entry in `lengths` each.
+    """
+
+    def __init__(self, terms: Sequence[str], offsets: np.ndarray, positions: np.ndarray,
+                 frequencies: np.ndarray, lengths: np.ndarray, start: int = 0,
+                 vocabulary: Optional[Dict[str, int]] = None):
+        self.terms = list(terms)
+        self.vocabulary = vocabulary if vocabulary is not None else {term: i for i, term in enumerate(self.terms)}
+        self.offsets = offsets
+        self.positions = positions
+        self.frequencies = frequencies
+        self.lengths = lengths
+        self.start = start
+        self.total_length = float(lengths.sum())
+
+    @property
+    def postings(self) -> int:
+        return len(self.positions)
+
+    def _term_ids(self) -> np.ndarray:
+        """Term id of every posting (the CSR row index)."""
+        return np.repeat(np.arange(len(self.terms), dtype=np.int64), np.diff(self.offsets))
+
+    def lookup(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """(positions, frequencies) of `term`, or None if no chunk here contains it."""
+        term_id = self.vocabulary.get(term)
+        if term_id is None:
+            return None
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        if start == end:
+            return None
+        return self.positions[start:end], self.frequencies[start:end]
+
+    @classmethod
+    def from_postings(cls, terms: List[str], vocabulary: Dict[str, int], term_ids: np.ndarray,
+                      positions: np.ndarray, frequencies: np.ndarray, lengths: np.ndarray,
+                      start: int) -> "_Segment":
+        order = np.argsort(term_ids, kind="stable")
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=offsets[1:])
+        return cls(terms, offsets, positions[order], frequencies[order], lengths, start, vocabulary=vocabulary)
+
+    @classmethod
+    def tokenize(cls, texts: Iterable[str], start: int) -> "_Segment":
+        terms: List[str] = []
+        vocabulary: Dict[str, int] = {}
+        term_ids: List[int] = []
+        positions: List[int] = []
+        frequencies: List[int] = []
+        lengths: List[int] = []
+        for position, text in enumerate(texts, start=start):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                term_id = vocabulary.get(term)
+                if term_id is None:
+                    term_id = vocabulary[term] = len(terms)
+                    terms.append(term)
+                term_ids.append(term_id)
+                positions.append(position)
+                frequencies.append(frequency)
+        return cls.from_postings(
+            terms,
+            vocabulary,
+            np.asarray(term_ids, dtype=np.int64),
+            np.asarray(positions, dtype=np.int32),
+            np.asarray(frequencies, dtype=np.float32),
+            np.asarray(lengths, dtype=np.float32),
+            start,
+        )
+
+    @classmethod
+    def merge(cls, segments: Sequence["_Segment"]) -> "_Segment":
+        """One segment holding the postings of consecutive `segments`."""
+        if len(segments) == 1:
+            return segments[0]
+        # The first segment is usually the largest, so its term ids are kept as they are
+        first = segments[0]
+        terms = list(first.terms)
+        vocabulary = dict(first.vocabulary)
+        term_ids = [first._term_ids()]
+        for segment in segments[1:]:
+            mapping = np.empty(len(segment.terms), dtype=np.int64)
+            for local_id, term in enumerate(segment.terms):
+                term_id = vocabulary.get(term)
+                if term_id is None:
+                    term_id = vocabulary[term] = len(terms)
+                    terms.append(term)
+                mapping[local_id] = term_id
+            term_ids.append(mapping[segment._term_ids()])
+        return cls.from_postings(
+            terms,
+            vocabulary,
+            np.concatenate(term_ids),
+            np.concatenate([segment.positions for segment in segments]),
+            np.concatenate([segment.frequencies for segment in segments]),
+            np.concatenate([segment.lengths for segment in segments]),
+            first.start,
+        )
+
+    def remove(self, removed: np.ndarray) -> "_Segment":
+        """Segment without the positions flagged in `removed`; later positions shift down."""
+        keep = ~removed[self.positions]
+        # Number of removed positions at or before each position
+        shift = np.cumsum(removed).astype(np.int32)
+        return _Segment.from_postings(
+            self.terms,
+            self.vocabulary,
+            self._term_ids()[keep],
+            (self.positions - shift[self.positions])[keep],
+            self.frequencies[keep],
+            self.lengths[~removed[self.start:self.start + len(self.lengths)]],
+            self.start,
+        )
+
+
+class BM25Index:
+    """Inverted index over chunk text, kept as a few immutable CSR segments.
+
+    Each `extend` tokenizes only the new texts into a segment of their own. A segment is
+    merged into the one before it once that one is no more than twice its size, so there
+    are O(log n) segments and each posting is re-sorted O(log n) times over the life of
+    the index: appending costs about the size of the append, not of the index. BM25
+    weights are computed at query time over the query terms' postings in every segment.
+    Instances are never modified in place; `extend` and `remove` return new ones.
+    """
+
+    def __init__(self, segments: Sequence[_Segment] = (), k1: float = 1.5, b: float = 0.75):
+        self.segments = tuple(segments)
+        self.k1 = k1
+        self.b = b
+        self.count = sum(len(segment.lengths) for segment in self.segments)
+        total_length = sum(segment.total_length for segment in self.segments)
+        self.average_length = (total_length / self.count if self.count else 0.0) or 1.0
+
+    @classmethod
+    def empty(cls, k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        return cls((), k1, b)
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        return cls.empty(k1, b).extend(texts)
+
+    def _merged(self) -> _Segment:
+        if not self.segments:
+            return _Segment.tokenize((), 0)
+        return _Segment.merge(self.segments)
+
+    def extend(self, texts: Iterable[str]) -> "BM25Index":
+        """Index with `texts` appended at positions count, count + 1, ..."""
+        added = _Segment.tokenize(texts, self.count)
+        if not len(added.lengths):
+            return self
+        segments = list(self.segments) + [added]
+        while len(segments) > 1 and segments[-2].postings <= 2 * segments[-1].postings:
+            segments[-2:] = [_Segment.merge(segments[-2:])]
+        return BM25Index(segments, self.k1, self.b)
+
+    def remove(self, positions: Iterable[int]) -> "BM25Index":
+        """Index without the chunks at `positions`; later positions shift down to stay contiguous.
+
+        Compacts the index into a single segment.
+        """
+        removed = np.zeros(self.count, dtype=bool)
+        removed[np.fromiter(positions, dtype=np.int64)] = True
+        return BM25Index([self._merged().remove(removed)], self.k1, self.b)
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k (position, score) pairs; chunks sharing no term with the query are skipped."""
+        if k <= 0:
+            return []
+        all_positions = []
+        all_weights = []
+        for term in set(tokenize(query)):
+            postings = [(segment, segment.lookup(term)) for segment in self.segments]
+            postings = [(segment, found) for segment, found in postings if found is not None]
+            if not postings:
+                continue
+            df = sum(len(positions) for _, (positions, _) in postings)
+            idf = np.log1p((self.count - df + 0.5) / (df + 0.5))
+            for segment, (positions, tf) in postings:
+                lengths = segment.lengths[positions - segment.start]
+                norm = self.k1 * (1 - self.b + self.b * lengths / self.average_length)
+                all_positions.append(positions)
+                all_weights.append(idf * tf * (self.k1 + 1) / (tf + norm))
+        if not all_positions:
+            return []
+        scores = np.bincount(np.concatenate(all_positions), weights=np.concatenate(all_weights),
+                             minlength=self.count)
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(position), float(scores[position])) for position in matched]
+
+    def save(self, path: Path):
+        segment = self._merged()
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                terms=np.asarray(segment.terms, dtype=str),
+                offsets=segment.offsets,
+                positions=segment.positions,
+                frequencies=segment.frequencies,
+                lengths=segment.lengths,
+                params=np.asarray([self.k1, self.b]),
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> "BM25Index":
+        with np.load(path, allow_pickle=False) as data:
+            k1, b = data["params"].tolist()
+            segment = _Segment(
+                data["terms"].tolist(),
+                data["offsets"],
+                data["positions"],
+                data["frequencies"],
+                data["lengths"],
+            )
+        return cls([segment] if len(segment.lengths) else [], k1, b)
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int) -> List[int]:
+    """Merge rankings of positions, best first, by summed 1 / (k + rank)."""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, position in enumerate(ranking, start=1):
+            scores[position] = scores.get(position, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridFAISS(FAISS):
+    """FAISS vector store that also keeps a BM25 index over the same chunks.
+
+    Adding or deleting chunks updates both indexes under `lock`, which searches also
+    take, so a session can grow while it is being queried. An index memory-mapped from
+    the cache (`read_only`) is copied into memory before its first modification.
+    """
+
+    def __init__(self, *args: Any, sparse_index: Optional[BM25Index] = None, read_only: bool = False,
+                 **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._sparse_index = sparse_index
+        self.read_only = read_only
+        self.lock = threading.RLock()
+
+    def build_sparse_index(self) -> BM25Index:
+        self._sparse_index = BM25Index.build(
+            (self._document(position).page_content for position in range(self.index.ntotal)),
+            k1=settings.BM25_K1,
+            b=settings.BM25_B,
+        )
+        return self._sparse_index
+
+    @property
+    def sparse_index(self) -> BM25Index:
+        sparse_index = self._sparse_index
+        if sparse_index is None or sparse_index.count != self.index.ntotal:
+            sparse_index = self.build_sparse_index()
+        return sparse_index
+
+    def _make_writable(self):
+        if self.read_only:
+            # clone_index would keep viewing the mapped file; a serialized copy owns its memory
+            self.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+            self.read_only = False
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        embeddings = self.embedding_function.embed_documents(texts)
+        return self.add_embeddings(zip(texts, embeddings), metadatas=metadatas, ids=ids, **kwargs)
+
+    def add_embeddings(self, text_embeddings: Iterable[Tuple[str, Sequence[float]]],
+                       metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None,
+                       **kwargs: Any) -> List[str]:
+        """Append chunks; BM25 work is amortized over the new chunks (see BM25Index)."""
+        text_embeddings = list(text_embeddings)
+        with self.lock:
+            self._make_writable()
+            ids = super().add_embeddings(text_embeddings, metadatas=metadatas, ids=ids, **kwargs)
+            if self._sparse_index is not None:
+                self._sparse_index = self._sparse_index.extend(text for text, _ in text_embeddings)
+            return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """Delete chunks by docstore id from both indexes.
+
+        Flat indexes remove in place. The other backends can't renumber their vectors,
+        so they are rebuilt from the remaining ones (re-embedded for pq, which only keeps
+        lossy codes).
+        """
+        if not ids:
+            raise ValueError("No ids provided to delete.")
+        doomed = set(ids)
+        with self.lock:
+            positions = sorted(p for p, doc_id in self.index_to_docstore_id.items() if doc_id in doomed)
+            if len(positions) != len(doomed):
+                raise ValueError(f"Some specified ids do not exist in the current store: {sorted(doomed)}")
+            self._make_writable()
+            if isinstance(self.index, faiss.IndexFlat):
+                super().delete(ids, **kwargs)
+            else:
+                self._rebuild_without(positions)
+                self.docstore.delete(ids)
+            if self._sparse_index is not None:
+                self._sparse_index = self._sparse_index.remove(positions)
+            return True
+
+    def _rebuild_without(self, positions: List[int]):
+        removed = set(positions)
+        kept = [p for p in range(self.index.ntotal) if p not in removed]
+        vectors = reconstruct(self.index, kept)
+        if vectors is None:
+            texts = [self._document(p).page_content for p in kept]
+            vectors = np.asarray(self.embedding_function.embed_documents(texts), dtype=np.float32)
+        index = create_index(vectors)
+        if len(kept):
+            index.add(vectors)
+        self.index_to_docstore_id = {i: self.index_to_docstore_id[p] for i, p in enumerate(kept)}
+        self.index = index
+
+    def _document(self, position: int) -> Document:
+        return self.docstore.search(self.index_to_docstore_id[position])
+
+    def hybrid_search_by_vector(self, query: str, embedding: Sequence[float], k: int = 4) -> List[Document]:
+        """Top-k chunks for `query`, fusing dense (via `embedding`) and BM25 rankings."""
+        vector = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        with self.lock:
+            if self.index.ntotal == 0:
+                return []
+            candidates = min(max(k, settings.RETRIEVAL_CANDIDATES), self.index.ntotal)
+            _, found = self.index.search(vector, candidates)
+            dense = [int(position) for position in found[0] if position >= 0]
+            if not settings.RETRIEVAL_HYBRID:
+                return [self._document(position) for position in dense[:k]]
+            sparse = [position for position, _ in self.sparse_index.search(query, candidates)]
+            fused = reciprocal_rank_fusion([dense, sparse], settings.RETRIEVAL_RRF_K)
+            return [self._document(position) for position in fused[:k]]
+
+    def hybrid_search(self, query: str, k: int = 4) -> List[Document]:
+        return self.hybrid_search_by_vector(query, self.embedding_function.embed_query(query), k)
+
+    async def ahybrid_search(self, query: str, k: int = 4) -> List[Document]:
+        embedding = await self.embedding_function.aembed_query(query)
+        return await asyncio.to_thread(self.hybrid_search_by_vector, query, embedding, k)
+
@@ -0,0 +1,427 @@
+"""Bounded in-memory store for per-session vector stores and conversation memory.
+
+Sessions are evicted least-recently-used first when their estimated memory use exceeds
+SESSION_MEMORY_BUDGET_MB, and after SESSION_IDLE_TTL_SECONDS without a request. Evicted
+sessions are spilled to SESSION_SPILL_DIR and transparently reloaded on their next request.
+
+With SESSION_SHARED, every session is also written to the shared on-disk state (see
+shared_sessions.py) so any worker process can serve it; the resident sessions are then a
+per-process read cache that is checked against the shared versions on each request.
+"""
+import asyncio
+import hashlib
+import json
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from langchain_community.vectorstores import FAISS
+
+import settings
+from embeddings import embedding_engine
+from index_cache import CHUNKS_FILE, load_index, prune_lru, save_index
+from memory import ConversationMemory, new_memory
+from shared_sessions import SessionConflict, SharedSessionState
+from vector_index import index_bytes
+
+# Session IDs become directory names, so only accept plain identifiers
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+HISTORY_FILE = "history.json"
+SESSION_FILE = "session.json"
+
+# Rough per-chunk overhead of the Document object, docstore dict and id mapping
+CHUNK_OVERHEAD_BYTES = 400
+
+
+def estimate_bytes(vector_store: FAISS) -> int:
+    """Approximate resident size of a FAISS vector store (index + chunk text)."""
+    total = index_bytes(vector_store.index)
+    for doc in vector_store.docstore._dict.values():
+        total += len(doc.page_content) + CHUNK_OVERHEAD_BYTES
+    return total
+
+
+class Session:
+    def __init__(self, session_id: str, vector_store: FAISS, memory: Optional[ConversationMemory] = None,
+                 documents: Optional[Dict[str, dict]] = None):
+        self.session_id = session_id
+        self.vector_store = vector_store
+        self.memory: ConversationMemory = memory if memory is not None else new_memory()
+        # document_id (the PDF's SHA-256) -> {"document_id", "filename", "chunks", "pages"}, in upload order
+        self.documents: Dict[str, dict] = documents if documents is not None else {}
+        # Serialises appends/removals of documents in this session
+        self.lock = asyncio.Lock()
+        self.nbytes = estimate_bytes(vector_store)
+        self.last_access = time.monotonic()
+        # Shared-state versions this copy reflects (unused without SESSION_SHARED)
+        self.index_version = 0
+        self.memory_version = 0
+
+    @property
+    def doc_hash(self) -> Optional[str]:
+        """Content key for the answer and artifact caches.
+
+        The PDF's hash for single-document sessions, otherwise a hash over all of them.
+        """
+        if not self.documents:
+            return None
+        if len(self.documents) == 1:
+            return next(iter(self.documents))
+        return hashlib.sha256("\n".join(sorted(self.documents)).encode("utf-8")).hexdigest()
+
+    def touch(self):
+        self.last_access = time.monotonic()
+
+
+class SessionStore:
+    def __init__(self, budget_bytes: int, idle_ttl: float, spill_dir: Optional[Path],
+                 spill_max_bytes: int, shared: Optional[SharedSessionState] = None):
+        self.budget_bytes = budget_bytes
+        self.idle_ttl = idle_ttl
+        # Shared sessions are already on disk, so evicting them needs no spill
+        self.spill_dir = spill_dir if shared is None else None
+        self.spill_max_bytes = spill_max_bytes
+        self.shared = shared
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        # Evicted sessions whose spill is still being written, with a token per eviction;
+        # they are served from here until the spill is complete
+        self._spilling: Dict[str, Tuple[Session, object]] = {}
+        # Serialises spill writes and reloads; never acquired while holding `_lock`
+        self._spill_lock = threading.Lock()
+        self.stats: Dict[str, int] = {
+            "evicted_lru": 0,
+            "evicted_idle": 0,
+            "spilled": 0,
+            "rehydrated": 0,
+            "spill_pruned": 0,
+        }
+
+    def __contains__(self, session_id: str) -> bool:
+        if self.shared is not None:
+            return self.shared.versions(session_id) is not None
+        with self._lock:
+            if session_id in self._sessions or session_id in self._spilling:
+                return True
+        return self._spill_path(session_id) is not None
+
+    def _spill_path(self, session_id: str) -> Optional[Path]:
+        if self.spill_dir is None or not SESSION_ID_PATTERN.match(session_id):
+            return None
+        directory = self.spill_dir / session_id
+        return directory if (directory / SESSION_FILE).exists() else None
+
+    def create(self, session_id: str, vector_store: FAISS,
+               documents: Optional[Dict[str, dict]] = None) -> Session:
+        session = Session(session_id, vector_store, documents=documents)
+        if self.shared is not None:
+            session.index_version, session.memory_version = self.shared.create(session_id, vector_store, documents)
+        with self._lock:
+            self._insert(session)
+        self.evict(keep=session_id)
+        return session
+
+    def _insert(self, session: Session):
+        previous = self._sessions.pop(session.session_id, None)
+        if previous is not None:
+            self._bytes -= previous.nbytes
+        self._sessions[session.session_id] = session
+        self._bytes += session.nbytes
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """Return the session, reloading it from the spill directory if it was evicted.
+
+        Shared sessions are (re)loaded from the shared state when this process has no
+        copy or another worker changed them.
+        """
+        if self.shared is not None:
+            return self._get_shared(session_id, self.shared.versions(session_id))
+        with self._lock:
+            session = self._resident(session_id)
+            if session is not None:
+                return session
+        with self._spill_lock:
+            with self._lock:
+                # Reloaded by another thread while this one waited
+                session = self._resident(session_id)
+                if session is not None:
+                    return session
+            session = self._rehydrate(session_id)
+            if session is None:
+                return None
+            with self._lock:
+                self._insert(session)
+        self.evict(keep=session_id)
+        return session
+
+    def _resident(self, session_id: str) -> Optional[Session]:
+        """The session if it is in memory, taking it back if its spill is still being written."""
+        session = self._sessions.get(session_id)
+        if session is None and session_id in self._spilling:
+            session = self._spilling.pop(session_id)[0]
+            self._insert(session)
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+            session.touch()
+        return session
+
+    async def aget(self, session_id: str) -> Optional[Session]:
+        """Async `get`: resident sessions are returned inline, others load on a thread."""
+        if self.shared is not None:
+            # A SQLite read; it can wait on another worker's write, so keep it off the event loop
+            versions = await asyncio.to_thread(self.shared.versions, session_id)
+            with self._lock:
+                session = self._sessions.get(session_id)
+                if versions is None or (session is not None and self._is_current(session, versions)):
+                    return self._get_shared(session_id, versions)
+            return await asyncio.to_thread(self._get_shared, session_id, versions)
+        with self._lock:
+            if session_id in self._sessions or session_id in self._spilling:
+                return self.get(session_id)
+        if self._spill_path(session_id) is None:
+            return None
+        return await asyncio.to_thread(self.get, session_id)
+
+    @staticmethod
+    def _is_current(session: Session, versions: Tuple[int, int]) -> bool:
+        return (session.index_version, session.memory_version) == versions
+
+    def _get_shared(self, session_id: str, versions: Optional[Tuple[int, int]]) -> Optional[Session]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if versions is None:
+                # Expired and pruned by some worker
+                if session is not None:
+                    self._bytes -= self._sessions.pop(session_id).nbytes
+                return None
+            if session is not None and session.index_version == versions[0]:
+                if session.memory_version != versions[1]:
+                    # Another worker answered in this conversation; its documents are unchanged
+                    loaded = self.shared.load_memory(session_id)
+                    if loaded is not None:
+                        session.memory, session.memory_version = loaded
+                self._sessions.move_to_end(session_id)
+                session.touch()
+                return session
+        loaded = self.shared.load(session_id)
+        if loaded is None:
+            return None
+        vector_store, documents, memory, (index_version, memory_version) = loaded
+        session = Session(session_id, vector_store, memory=memory, documents=documents)
+        session.index_version, session.memory_version = index_version, memory_version
+        with self._lock:
+            self._insert(session)
+        self.evict(keep=session_id)
+        return session
+
+    def add_turn(self, session: Session, question: str, answer: str, question_vector=None):
+        """Add an answered question to the session's memory (and the shared state).
+
+        Blocking (it may write to disk); call it from a worker thread.
+        """
+        session.memory.add(question, answer, question_vector)
+        if self.shared is not None:
+            version = self.shared.add_turn(session.session_id, question, answer, session.memory_version)
+            # None: another worker wrote meanwhile, so the next request reloads the memory
+            session.memory_version = version if version is not None else -1
+        else:
+            # Evicted while the answer was generated: its spilled copy lacks this turn
+            self._reclaim(session)
+
+    def _reclaim(self, session: Session):
+        """Make `session` resident again if it was evicted, discarding its now stale spill."""
+        with self._lock:
+            if self._sessions.get(session.session_id) is session:
+                return
+            pending = self._spilling.get(session.session_id)
+            if pending is not None and pending[0] is session:
+                # The spill writer sees its token is gone and removes what it wrote
+                del self._spilling[session.session_id]
+                self._insert(session)
+                return
+        with self._spill_lock:
+            directory = self._spill_path(session.session_id)
+            if directory is not None:
+                shutil.rmtree(directory, ignore_errors=True)
+            with self._lock:
+                self._insert(session)
+        self.evict(keep=session.session_id)
+
+    def save_summary(self, session: Session, memory: ConversationMemory):
+        """Persist a summary update made by MemorySummarizer (shared state only)."""
+        if self.shared is None:
+            return
+        version = self.shared.save_summary(session.session_id, memory.summary, memory.summarized,
+                                           session.memory_version)
+        if session.memory is memory:
+            session.memory_version = version if version is not None else -1
+
+    def resize(self, session: Session):
+        """Re-measure a session after its vector store changed.
+
+        With shared state, also publishes the new index; raises SessionConflict (and drops
+        this process's now inconsistent copy) if another worker changed the session first.
+        """
+        if self.shared is not None:
+            try:
+                session.index_version = self.shared.publish_index(
+                    session.session_id, session.vector_store, session.documents, session.index_version
+                )
+            except SessionConflict:
+                with self._lock:
+                    if self._sessions.get(session.session_id) is session:
+                        self._bytes -= self._sessions.pop(session.session_id).nbytes
+                raise
+        nbytes = estimate_bytes(session.vector_store)
+        with self._lock:
+            resident = self._sessions.get(session.session_id) is session
+            if resident:
+                self._bytes += nbytes - session.nbytes
+            session.nbytes = nbytes
+        if not resident:
+            # Evicted while it was being modified: its spilled copy is stale
+            self._reclaim(session)
+        self.evict(keep=session.session_id)
+
+    def evict(self, keep: Optional[str] = None):
+        """Evict idle sessions, then least recently used ones until under the memory budget.
+
+        Evicted sessions are chosen under the lock and spilled to disk after releasing it,
+        so requests for other sessions don't wait for the writes. Must not be called with
+        the lock held.
+        """
+        evicted = []
+        with self._lock:
+            if self.idle_ttl > 0:
+                cutoff = time.monotonic() - self.idle_ttl
+                for session_id, session in list(self._sessions.items()):
+                    if session.last_access < cutoff and session_id != keep:
+                        evicted.append(self._evict(session_id))
+                        self.stats["evicted_idle"] += 1
+            for session_id in list(self._sessions.keys()):
+                if self._bytes <= self.budget_bytes:
+                    break
+                if session_id == keep:
+                    continue
+                evicted.append(self._evict(session_id))
+                self.stats["evicted_lru"] += 1
+        for session, token in evicted:
+            if token is not None:
+                self._write_spill(session, token)
+
+    def _evict(self, session_id: str) -> Tuple[Session, Optional[object]]:
+        """Remove a session from memory; returns it and, if it is to be spilled, its spill token."""
+        session = self._sessions.pop(session_id)
+        self._bytes -= session.nbytes
+        if self.spill_dir is None:
+            return session, None
+        token = object()
+        self._spilling[session_id] = (session, token)
+        return session, token
+
+    def _write_spill(self, session: Session, token: object):
+        session_id = session.session_id
+        with self._spill_lock:
+            with self._lock:
+                if self._spilling.get(session_id, (None, None))[1] is not token:
+                    # Taken back before its turn came
+                    return
+            try:
+                self._spill(session)
+            except Exception as e:
+                print(f"Failed to spill session {session_id}: {e}")
+            with self._lock:
+                if self._spilling.get(session_id, (None, None))[1] is token:
+                    del self._spilling[session_id]
+                    return
+            # Taken back while it was being written, so this copy is already stale
+            shutil.rmtree(self.spill_dir / session_id, ignore_errors=True)
+
+    def _spill(self, session: Session):
+        directory = self.spill_dir / session.session_id
+        save_index(session.vector_store, directory)
+        with open(directory / HISTORY_FILE, "w", encoding="utf-8") as f:
+            json.dump([list(turn) for turn in session.memory.turns], f, ensure_ascii=False)
+        # Written last: its presence marks the spill as complete
+        with open(directory / SESSION_FILE, "w", encoding="utf-8") as f:
+            json.dump({
+                "session_id": session.session_id,
+                "documents": list(session.documents.values()),
+                "memory": session.memory.to_dict(),
+            }, f, ensure_ascii=False)
+        self.stats["spilled"] += 1
+        self.stats["spill_pruned"] += prune_lru(
+            [d for d in self.spill_dir.iterdir() if d.is_dir()], self.spill_max_bytes
+        )
+
+    def _rehydrate(self, session_id: str) -> Optional[Session]:
+        directory = self._spill_path(session_id)
+        if directory is None or not (directory / CHUNKS_FILE).exists():
+            return None
+        try:
+            with open(directory / SESSION_FILE, encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(directory / HISTORY_FILE, encoding="utf-8") as f:
+                history = [tuple(turn) for turn in json.load(f)]
+            vector_store = load_index(directory, embedding_engine.get())
+        except Exception as e:
+            print(f"Failed to reload spilled session {session_id}: {e}")
+            return None
+        # The session is resident again; the spill copy is rewritten on the next eviction
+        shutil.rmtree(directory, ignore_errors=True)
+        self.stats["rehydrated"] += 1
+        documents = {document["document_id"]: document for document in meta["documents"]}
+        memory = new_memory(history, **meta["memory"])
+        return Session(session_id, vector_store, memory=memory, documents=documents)
+
+    def status(self) -> dict:
+        spilled = 0
+        if self.spill_dir is not None and self.spill_dir.exists():
+            spilled = sum(1 for d in self.spill_dir.iterdir() if (d / SESSION_FILE).exists())
+        with self._lock:
+            return {
+                "resident": len(self._sessions),
+                "spilling": len(self._spilling),
+                "resident_bytes": self._bytes,
+                "budget_bytes": self.budget_bytes,
+                "idle_ttl_seconds": self.idle_ttl,
+                "spilled_on_disk": spilled,
+                **self.stats,
+                "shared": self.shared.status() if self.shared is not None else None,
+            }
+
+    def sweep(self):
+        """Apply the idle TTL and, with shared state, delete expired shared sessions."""
+        self.evict()
+        if self.shared is not None:
+            self.shared.prune()
+
+    def close(self):
+        if self.shared is not None:
+            self.shared.close()
+
+
+async def sweep_periodically(store: SessionStore, interval: float):
+    """Background task that applies the idle TTL even when no new sessions arrive."""
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.to_thread(store.sweep)
+
+
+sessions = SessionStore(
+    budget_bytes=settings.SESSION_MEMORY_BUDGET_MB * 1024 * 1024,
+    idle_ttl=settings.SESSION_IDLE_TTL_SECONDS,
+    spill_dir=Path(settings.SESSION_SPILL_DIR) if settings.SESSION_SPILL else None,
+    spill_max_bytes=settings.SESSION_SPILL_MAX_MB * 1024 * 1024,
+    shared=SharedSessionState(
+        Path(settings.SESSION_SHARED_DIR),
+        ttl=settings.SESSION_SHARED_TTL_SECONDS,
+        max_turns=settings.MEMORY_MAX_TURNS,
+    ) if settings.SESSION_SHARED else None,
+)
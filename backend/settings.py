@@ -0,0 +1,168 @@
+"""Runtime configuration for the backend, read from the environment / .env file."""
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+
+# Load environment variables from backend directory
+env_path = Path(__file__).parent / ".env"
+load_dotenv(dotenv_path=env_path, override=True)
+
+
+def env_str(name: str, default: str) -> str:
+    value = os.getenv(name)
+    return value if value not in (None, "") else default
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+def env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Embeddings
+EMBEDDING_MODEL = env_str("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_DEVICE = env_str("EMBEDDING_DEVICE", "cpu")
+# Refuse to download weights at startup; the model must already be in the local HF cache
+EMBEDDING_LOCAL_FILES_ONLY = env_bool("EMBEDDING_LOCAL_FILES_ONLY", True)
+# Concurrent encode requests are coalesced into batches of up to this many texts
+EMBEDDING_BATCH_SIZE = env_int("EMBEDDING_BATCH_SIZE", 64)
+# How long the first request in a batch waits for others to join it
+EMBEDDING_BATCH_WAIT_MS = env_float("EMBEDDING_BATCH_WAIT_MS", 5.0)
+
+# PDF ingestion worker pool
+INGEST_EXECUTOR = env_str("INGEST_EXECUTOR", "thread")  # "thread" or "process"
+INGEST_WORKERS = env_int("INGEST_WORKERS", 2)
+# Uploads allowed to wait for a free worker before new ones are rejected with 503
+INGEST_QUEUE_SIZE = env_int("INGEST_QUEUE_SIZE", 4)
+INGEST_RETRY_AFTER_SECONDS = env_int("INGEST_RETRY_AFTER_SECONDS", 5)
+
+# On-disk FAISS index cache, keyed by the SHA-256 of the uploaded PDF
+INDEX_CACHE_DIR = env_str("INDEX_CACHE_DIR", str(Path(__file__).parent / ".cache" / "indexes"))
+INDEX_CACHE_MAX_MB = env_int("INDEX_CACHE_MAX_MB", 1024)  # 0 disables the cache
+INDEX_CACHE_MMAP = env_bool("INDEX_CACHE_MMAP", True)
+
+# FAISS index backend: "auto" picks by chunk count, or force "flat", "hnsw", "ivf" or "pq"
+INDEX_BACKEND = env_str("INDEX_BACKEND", "auto").lower()
+INDEX_HNSW_MIN_CHUNKS = env_int("INDEX_HNSW_MIN_CHUNKS", 5000)
+INDEX_IVF_MIN_CHUNKS = env_int("INDEX_IVF_MIN_CHUNKS", 20000)
+INDEX_PQ_MIN_CHUNKS = env_int("INDEX_PQ_MIN_CHUNKS", 100000)
+INDEX_HNSW_M = env_int("INDEX_HNSW_M", 32)
+INDEX_HNSW_EF_SEARCH = env_int("INDEX_HNSW_EF_SEARCH", 64)
+INDEX_IVF_NPROBE = env_int("INDEX_IVF_NPROBE", 16)
+INDEX_PQ_SUBQUANTIZERS = env_int("INDEX_PQ_SUBQUANTIZERS", 48)  # bytes per vector; must divide the dimension
+INDEX_TRAIN_SAMPLE = env_int("INDEX_TRAIN_SAMPLE", 16384)  # max vectors used to train IVF/PQ
+# Queries used to measure recall@k of approximate backends against exact search (0 disables)
+INDEX_EVAL_QUERIES = env_int("INDEX_EVAL_QUERIES", 64)
+# Uploads with more chunks skip the recall measurement (its brute-force search grows with the index)
+INDEX_EVAL_MAX_VECTORS = env_int("INDEX_EVAL_MAX_VECTORS", 100000)
+
+# Hybrid retrieval: BM25 over chunk text fused with FAISS results by reciprocal rank fusion
+RETRIEVAL_HYBRID = env_bool("RETRIEVAL_HYBRID", True)  # false = dense (FAISS) only
+RETRIEVAL_CANDIDATES = env_int("RETRIEVAL_CANDIDATES", 20)  # taken from each ranking before fusion
+RETRIEVAL_RRF_K = env_int("RETRIEVAL_RRF_K", 60)
+BM25_K1 = env_float("BM25_K1", 1.5)
+BM25_B = env_float("BM25_B", 0.75)
+
+# Prompt context token budgets (retrieved text per LLM call, filled by relevance)
+CONTEXT_TOKENIZER = env_str("CONTEXT_TOKENIZER", "cl100k_base")  # tiktoken encoding used for counting
+CONTEXT_TOKENS_CHAT = env_int("CONTEXT_TOKENS_CHAT", 1000)
+CONTEXT_TOKENS_QUIZ = env_int("CONTEXT_TOKENS_QUIZ", 300)
+CONTEXT_TOKENS_FLASHCARDS = env_int("CONTEXT_TOKENS_FLASHCARDS", 300)
+CONTEXT_TOKENS_NAME = env_int("CONTEXT_TOKENS_NAME", 250)
+HISTORY_TOKENS_CHAT = env_int("HISTORY_TOKENS_CHAT", 400)  # conversation memory included in chat prompts
+
+# Conversation memory: rolling summary + latest turns (+ recalled similar turns)
+MEMORY_RECENT_TURNS = env_int("MEMORY_RECENT_TURNS", 1)  # kept verbatim; older turns are summarized
+MEMORY_SUMMARY_TOKENS = env_int("MEMORY_SUMMARY_TOKENS", 200)  # max length of the rolling summary
+MEMORY_MAX_TURNS = env_int("MEMORY_MAX_TURNS", 50)  # turns stored per session
+MEMORY_RECALL_TURNS = env_int("MEMORY_RECALL_TURNS", 2)  # 0 disables recall of older turns
+MEMORY_RECALL_MIN_SIMILARITY = env_float("MEMORY_RECALL_MIN_SIMILARITY", 0.6)
+
+# Background jobs (uploads, quiz and flashcard generation with ?job=true / "job": true)
+JOBS_MAX_CONCURRENCY = env_int("JOBS_MAX_CONCURRENCY", 2)
+JOBS_MAX_QUEUED = env_int("JOBS_MAX_QUEUED", 32)  # queued + running; more are rejected with 503
+JOBS_TTL_SECONDS = env_int("JOBS_TTL_SECONDS", 86400)  # finished jobs are kept this long (0 = forever)
+# How often a worker checks whether another worker was asked to cancel one of its jobs
+JOBS_CANCEL_POLL_SECONDS = env_float("JOBS_CANCEL_POLL_SECONDS", 1.0)
+# A queued or running job not renewed by its worker for this long is marked failed
+JOBS_LEASE_SECONDS = env_float("JOBS_LEASE_SECONDS", 30.0)
+# SQLite file holding job state; empty keeps jobs in memory only
+JOBS_DB = env_str("JOBS_DB", str(Path(__file__).parent / ".cache" / "jobs.sqlite3"))
+
+# Metrics: Prometheus text format at /metrics; per-stage timings optionally in a Server-Timing header
+METRICS_ENABLED = env_bool("METRICS_ENABLED", True)
+METRICS_SERVER_TIMING = env_bool("METRICS_SERVER_TIMING", False)
+
+# In-memory session store (vector stores + chat histories)
+SESSION_MEMORY_BUDGET_MB = env_int("SESSION_MEMORY_BUDGET_MB", 1024)
+SESSION_IDLE_TTL_SECONDS = env_int("SESSION_IDLE_TTL_SECONDS", 3600)  # 0 disables idle eviction
+SESSION_SWEEP_INTERVAL_SECONDS = env_int("SESSION_SWEEP_INTERVAL_SECONDS", 60)
+# Evicted sessions are written here and reloaded on their next request
+SESSION_SPILL = env_bool("SESSION_SPILL", True)
+SESSION_SPILL_DIR = env_str("SESSION_SPILL_DIR", str(Path(__file__).parent / ".cache" / "sessions"))
+SESSION_SPILL_MAX_MB = env_int("SESSION_SPILL_MAX_MB", 2048)
+
+# Worker processes started by `python main.py`; more than one needs the shared session state
+SERVER_WORKERS = env_int("SERVER_WORKERS", 1)
+# Shared session state (SQLite + memory-mapped indexes) so any worker on the host can serve any session
+SESSION_SHARED = env_bool("SESSION_SHARED", SERVER_WORKERS > 1)
+SESSION_SHARED_DIR = env_str("SESSION_SHARED_DIR", str(Path(__file__).parent / ".cache" / "shared"))
+SESSION_SHARED_TTL_SECONDS = env_int("SESSION_SHARED_TTL_SECONDS", 7 * 24 * 3600)  # since last write; 0 = forever
+
+# Groq LLM
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+LLM_MAX_CONNECTIONS = env_int("LLM_MAX_CONNECTIONS", 20)
+LLM_KEEPALIVE_CONNECTIONS = env_int("LLM_KEEPALIVE_CONNECTIONS", 10)
+LLM_TIMEOUT_SECONDS = env_float("LLM_TIMEOUT_SECONDS", 60.0)
+
+# Semantic answer cache for /api/chat
+ANSWER_CACHE_THRESHOLD = env_float("ANSWER_CACHE_THRESHOLD", 0.95)  # cosine similarity
+ANSWER_CACHE_TTL_SECONDS = env_int("ANSWER_CACHE_TTL_SECONDS", 24 * 3600)  # 0 = never expire
+ANSWER_CACHE_MAX_PER_DOCUMENT = env_int("ANSWER_CACHE_MAX_PER_DOCUMENT", 256)  # 0 disables the cache
+ANSWER_CACHE_MAX_DOCUMENTS = env_int("ANSWER_CACHE_MAX_DOCUMENTS", 1000)
+ANSWER_CACHE_INCLUDE_HISTORY = env_bool("ANSWER_CACHE_INCLUDE_HISTORY", False)
+
+# Generated quiz / flashcards / conversation name, cached per document hash
+ARTIFACT_CACHE_DIR = env_str("ARTIFACT_CACHE_DIR", str(Path(__file__).parent / ".cache" / "artifacts"))
+ARTIFACT_MEMORY_ENTRIES = env_int("ARTIFACT_MEMORY_ENTRIES", 512)
+# Artifacts generated in the background right after an upload (comma-separated: name, quiz,
+# flashcards; empty disables). Quiz and flashcards cost an LLM call each, so they are opt-in
+ARTIFACT_PRECOMPUTE = [
+    kind.strip() for kind in env_str("ARTIFACT_PRECOMPUTE", "name").split(",")
+    if kind.strip()
+]
+# Ask the LLM for quiz / flashcards as JSON (Groq's JSON mode); falls back to the text format on error
+ARTIFACT_JSON_MODE = env_bool("ARTIFACT_JSON_MODE", True)
+# Follow-up requests for just the missing questions / cards when an answer came back short
+ARTIFACT_TOPUP_ROUNDS = env_int("ARTIFACT_TOPUP_ROUNDS", 1)
+
+# Chunking
+CHUNK_SIZE = env_int("CHUNK_SIZE", 1000)  # characters
+CHUNK_OVERLAP = env_int("CHUNK_OVERLAP", 100)
+# Drop header/footer lines repeated on most pages in a window of CHUNK_FURNITURE_WINDOW pages
+CHUNK_STRIP_FURNITURE = env_bool("CHUNK_STRIP_FURNITURE", True)
+CHUNK_FURNITURE_EDGE_LINES = env_int("CHUNK_FURNITURE_EDGE_LINES", 3)  # lines at the top and bottom of a page
+CHUNK_FURNITURE_WINDOW = env_int("CHUNK_FURNITURE_WINDOW", 12)
+CHUNK_FURNITURE_MIN_FRACTION = env_float("CHUNK_FURNITURE_MIN_FRACTION", 0.5)
+# Drop exact and near-duplicate chunks (MinHash Jaccard estimate >= threshold; 0 = exact only)
+CHUNK_DEDUPE = env_bool("CHUNK_DEDUPE", True)
+CHUNK_NEAR_DUPLICATE_THRESHOLD = env_float("CHUNK_NEAR_DUPLICATE_THRESHOLD", 0.85)
+# Embed short segments and join them into chunks at the least similar neighbours
+CHUNK_SEMANTIC = env_bool("CHUNK_SEMANTIC", False)
+CHUNK_SEMANTIC_SEGMENT_SIZE = env_int("CHUNK_SEMANTIC_SEGMENT_SIZE", 250)
+
+# Page-parallel PDF text extraction
+PDF_EXTRACT_PROCESSES = env_int("PDF_EXTRACT_PROCESSES", min(4, os.cpu_count() or 1))
+PDF_PARALLEL_MIN_PAGES = env_int("PDF_PARALLEL_MIN_PAGES", 32)  # smaller PDFs are extracted inline
+PDF_PAGES_PER_TASK = env_int("PDF_PAGES_PER_TASK", 0)  # 0 = split pages evenly across processes
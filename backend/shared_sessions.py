@@ -0,0 +1,256 @@
+"""Session state shared by every worker process on the host (SESSION_SHARED=true).
+
+With several uvicorn/gunicorn workers a session's requests can land on any of them, so
+its state lives on local disk instead of in one process:
+
+    <SESSION_SHARED_DIR>/sessions.sqlite3            documents, conversation summary and turns
+    <SESSION_SHARED_DIR>/<session_id>/<version_id>/  index.faiss, chunks.json, bm25.npz
+
+Indexes are written once per version and memory-mapped by readers; appending or removing
+a PDF writes a new version directory and switches the row to it. Each row carries an
+index version and a memory version, so a worker keeps sessions in its own read cache
+(the bounded SessionStore) and reloads only the part another worker changed.
+"""
+import json
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from langchain_community.vectorstores import FAISS
+
+from embeddings import embedding_engine
+from index_cache import load_index, save_index
+from memory import ConversationMemory, new_memory
+
+DB_FILE = "sessions.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    index_dir TEXT NOT NULL,
+    index_version INTEGER NOT NULL,
+    documents TEXT NOT NULL,
+    summary TEXT NOT NULL DEFAULT '',
+    summarized INTEGER NOT NULL DEFAULT 0,
+    turns_total INTEGER NOT NULL DEFAULT 0,
+    memory_version INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS turns_by_session ON turns (session_id, id);
+"""
+
+# (index_version, memory_version) of a session row
+Versions = Tuple[int, int]
+
+
+class SessionConflict(Exception):
+    """Raised when another worker changed a session's documents first."""
+
+
+class SharedSessionState:
+    """SQLite rows plus versioned index directories. Safe to call from any thread."""
+
+    def __init__(self, root: Path, ttl: float, max_turns: int):
+        self.root = root
+        self.ttl = ttl
+        self.max_turns = max(1, max_turns)
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.stats: Dict[str, int] = {"loaded": 0, "memory_loads": 0, "published": 0, "pruned": 0}
+
+    def open(self):
+        with self._lock:
+            if self._db is not None:
+                return
+            self.root.mkdir(parents=True, exist_ok=True)
+            # Workers write concurrently; wait for their transactions instead of failing
+            self._db = sqlite3.connect(
+                str(self.root / DB_FILE), timeout=30, check_same_thread=False, isolation_level=None
+            )
+            self._db.row_factory = sqlite3.Row
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        if self._db is None:
+            self.open()
+        with self._lock:
+            return self._db.execute(sql, params)
+
+    @contextmanager
+    def _transaction(self, write: bool = True):
+        """Transaction; write transactions take SQLite's write lock up front."""
+        if self._db is None:
+            self.open()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _write_index(self, session_id: str, vector_store: FAISS) -> str:
+        index_dir = uuid.uuid4().hex
+        save_index(vector_store, self.root / session_id / index_dir)
+        return index_dir
+
+    def versions(self, session_id: str) -> Optional[Versions]:
+        row = self._execute(
+            "SELECT index_version, memory_version FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        return (row["index_version"], row["memory_version"]) if row is not None else None
+
+    def create(self, session_id: str, vector_store: FAISS, documents: Dict[str, dict]) -> Versions:
+        index_dir = self._write_index(session_id, vector_store)
+        self._execute(
+            "INSERT INTO sessions (id, index_dir, index_version, documents, updated_at) VALUES (?, ?, 1, ?, ?)",
+            (session_id, index_dir, json.dumps(list(documents.values()), ensure_ascii=False), time.time()),
+        )
+        self.stats["published"] += 1
+        return 1, 0
+
+    def load(self, session_id: str) -> Optional[Tuple[FAISS, Dict[str, dict], ConversationMemory, Versions]]:
+        """(vector_store, documents, memory, versions), or None for an unknown session."""
+        # A writer may remove the version directory between reading the row and loading it
+        for attempt in range(3):
+            row = self._execute("SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            try:
+                vector_store = load_index(self.root / session_id / row["index_dir"], embedding_engine.get(), mmap=True)
+                break
+            except (OSError, RuntimeError):
+                if attempt == 2:
+                    raise
+        documents = {document["document_id"]: document for document in json.loads(row["documents"])}
+        loaded = self.load_memory(session_id)
+        if loaded is None:
+            return None
+        memory, memory_version = loaded
+        self.stats["loaded"] += 1
+        return vector_store, documents, memory, (row["index_version"], memory_version)
+
+    def load_memory(self, session_id: str) -> Optional[Tuple[ConversationMemory, int]]:
+        """(memory, memory_version), or None for an unknown session."""
+        with self._transaction(write=False) as db:
+            row = db.execute(
+                "SELECT summary, summarized, turns_total, memory_version FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            turns = db.execute(
+                "SELECT question, answer FROM turns WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, self.max_turns),
+            ).fetchall()
+        if row is None:
+            return None
+        turns = [(turn["question"], turn["answer"]) for turn in reversed(turns)]
+        self.stats["memory_loads"] += 1
+        memory = new_memory(turns, summary=row["summary"], summarized=row["summarized"], total=row["turns_total"])
+        return memory, row["memory_version"]
+
+    def publish_index(self, session_id: str, vector_store: FAISS, documents: Dict[str, dict],
+                      expected_version: int) -> int:
+        """Make a modified vector store the session's current version; returns the new version.
+
+        Raises SessionConflict if the session moved past `expected_version` meanwhile.
+        Every version is a complete copy of the index (readers keep mapping the old one),
+        so publishing costs O(index size) however few chunks changed.
+        """
+        index_dir = self._write_index(session_id, vector_store)
+        try:
+            with self._transaction() as db:
+                row = db.execute(
+                    "SELECT index_dir, index_version FROM sessions WHERE id = ?", (session_id,)
+                ).fetchone()
+                if row is None or row["index_version"] != expected_version:
+                    raise SessionConflict("The session's documents were changed by another request")
+                db.execute(
+                    "UPDATE sessions SET index_dir = ?, index_version = ?, documents = ?, updated_at = ? WHERE id = ?",
+                    (index_dir, expected_version + 1, json.dumps(list(documents.values()), ensure_ascii=False),
+                     time.time(), session_id),
+                )
+        except BaseException:
+            shutil.rmtree(self.root / session_id / index_dir, ignore_errors=True)
+            raise
+        # Readers that already mapped the old files keep them until they reload
+        shutil.rmtree(self.root / session_id / row["index_dir"], ignore_errors=True)
+        self.stats["published"] += 1
+        return expected_version + 1
+
+    def _bump_memory(self, db: sqlite3.Connection, session_id: str, expected_version: int) -> Optional[int]:
+        """Advance the memory version; returns it, or None if another worker wrote in between."""
+        previous = db.execute("SELECT memory_version FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if previous is None:
+            return None
+        db.execute(
+            "UPDATE sessions SET memory_version = memory_version + 1, updated_at = ? WHERE id = ?",
+            (time.time(), session_id),
+        )
+        return previous["memory_version"] + 1 if previous["memory_version"] == expected_version else None
+
+    def add_turn(self, session_id: str, question: str, answer: str, expected_version: int) -> Optional[int]:
+        """Append a turn, keeping at most `max_turns` rows; see `_bump_memory` for the result."""
+        with self._transaction() as db:
+            if db.execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone() is None:
+                return None
+            version = self._bump_memory(db, session_id, expected_version)
+            db.execute(
+                "INSERT INTO turns (session_id, question, answer) VALUES (?, ?, ?)", (session_id, question, answer)
+            )
+            db.execute("UPDATE sessions SET turns_total = turns_total + 1 WHERE id = ?", (session_id,))
+            db.execute(
+                "DELETE FROM turns WHERE session_id = ? AND id <= ("
+                "SELECT id FROM turns WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (session_id, session_id, self.max_turns),
+            )
+        return version
+
+    def save_summary(self, session_id: str, summary: str, summarized: int, expected_version: int) -> Optional[int]:
+        """Store a newer summary; one covering fewer turns than the stored one is ignored."""
+        with self._transaction() as db:
+            stored = db.execute("SELECT summarized FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if stored is None or stored["summarized"] >= summarized:
+                return None
+            version = self._bump_memory(db, session_id, expected_version)
+            db.execute(
+                "UPDATE sessions SET summary = ?, summarized = ? WHERE id = ?", (summary, summarized, session_id)
+            )
+        return version
+
+    def prune(self) -> int:
+        """Delete sessions not written to for SESSION_SHARED_TTL_SECONDS."""
+        if self.ttl <= 0:
+            return 0
+        cutoff = time.time() - self.ttl
+        with self._transaction() as db:
+            expired = [row["id"] for row in db.execute("SELECT id FROM sessions WHERE updated_at < ?", (cutoff,))]
+            for session_id in expired:
+                db.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+                db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        for session_id in expired:
+            shutil.rmtree(self.root / session_id, ignore_errors=True)
+        self.stats["pruned"] += len(expired)
+        return len(expired)
+
+    def status(self) -> dict:
+        count = self._execute("SELECT COUNT(*) AS count FROM sessions").fetchone()["count"] if self._db else None
+        return {"root": str(self.root), "sessions": count, **self.stats}
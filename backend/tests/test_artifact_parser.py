@@ -0,0 +1,157 @@
+import json
+
+from artifact_parser import Flashcard, QuizQuestion, parse_flashcards, parse_quiz
+
+PLAIN_QUIZ = """Q1: What is the capital of France?
+A) Berlin
+B) Madrid
+C) Paris
+D) Rome
+Correct: C
+
+Q2: Which planet is largest?
+A) Jupiter
+B) Mars
+C) Venus
+D) Earth
+Correct: A
+"""
+
+BOLD_QUIZ = """**Q1:** What is the capital of France?
+**A)** Berlin
+**B)** Madrid
+**C)** Paris
+**D)** Rome
+**Answer:** C
+
+__Question 2:__ Which planet is largest?
+- A) Jupiter
+- B) Mars
+- C) Venus
+- D) Earth
+__Correct Answer__: A
+"""
+
+NUMBERED_QUIZ = """Here are your questions:
+
+1. What is the capital of France?
+   A. Berlin
+   B. Madrid
+   C. Paris
+   D. Rome
+   Answer: (C)
+
+2) Which planet is largest?
+   A. Jupiter
+   B. Mars
+   C. Venus
+   D. Earth
+   Correct answer - A
+"""
+
+DASH_QUIZ = """Q1: What is the capital of France?
+A - Berlin
+B - Madrid
+C – Paris
+D — Rome
+Answer: C
+
+Q2: Which planet is largest?
+A - Jupiter
+B - Mars
+C - Venus
+D - Earth
+Answer - A
+"""
+
+EXPECTED_QUIZ = [
+    QuizQuestion(question="What is the capital of France?", a="Berlin", b="Madrid", c="Paris", d="Rome", correct="C"),
+    QuizQuestion(question="Which planet is largest?", a="Jupiter", b="Mars", c="Venus", d="Earth", correct="A"),
+]
+
+
+def test_quiz_plain():
+    assert parse_quiz(PLAIN_QUIZ) == EXPECTED_QUIZ
+
+
+def test_quiz_bold_labels():
+    assert parse_quiz(BOLD_QUIZ) == EXPECTED_QUIZ
+
+
+def test_quiz_numbered():
+    assert parse_quiz(NUMBERED_QUIZ) == EXPECTED_QUIZ
+
+
+def test_quiz_dash_separated_options():
+    assert parse_quiz(DASH_QUIZ) == EXPECTED_QUIZ
+
+
+def test_quiz_option_text_starting_with_a_hyphenated_word():
+    quiz = PLAIN_QUIZ.replace("B) Madrid", "B) B-tree of Madrid")
+    assert parse_quiz(quiz)[0].b == "B-tree of Madrid"
+
+
+def test_quiz_partial_drops_incomplete_question():
+    truncated = PLAIN_QUIZ[:PLAIN_QUIZ.index("C) Venus")]
+    assert parse_quiz(truncated) == EXPECTED_QUIZ[:1]
+
+
+def test_quiz_deduplicates_questions():
+    assert parse_quiz(PLAIN_QUIZ + PLAIN_QUIZ.replace("Q1", "Q3")) == EXPECTED_QUIZ
+
+
+def test_quiz_json():
+    payload = {"questions": [
+        {"question": "What is the capital of France?", "a": "Berlin", "b": "Madrid", "c": "Paris", "d": "Rome",
+         "correct": "c"},
+        {"Question": "Which planet is largest?", "options": ["A) Jupiter", "B) Mars", "C) Venus", "D) Earth"],
+         "answer": "Jupiter"},
+    ]}
+    text = "Sure, here you go:\n```json\n" + json.dumps(payload) + "\n```"
+    assert parse_quiz(text) == EXPECTED_QUIZ
+
+
+def test_quiz_json_partial_drops_invalid_items():
+    payload = {"questions": [
+        {"question": "What is the capital of France?", "options": {"A": "Berlin", "B": "Madrid", "C": "Paris",
+                                                                   "D": "Rome"}, "correct": "Option C"},
+        {"question": "Which planet is largest?", "a": "Jupiter", "b": "Mars", "correct": "A"},
+        "not a question",
+    ]}
+    assert parse_quiz(json.dumps(payload)) == EXPECTED_QUIZ[:1]
+
+
+def test_quiz_without_items():
+    assert parse_quiz("I could not find enough material for a quiz [sorry].") == []
+
+
+EXPECTED_CARDS = [
+    Flashcard(front="Photosynthesis", back="How plants turn light into chemical energy"),
+    Flashcard(front="Mitochondria", back="The organelle that produces ATP"),
+]
+
+
+def test_flashcards_plain():
+    text = ("Front: Photosynthesis\nBack: How plants turn light into chemical energy\n\n"
+            "Front: Mitochondria\nBack: The organelle that produces ATP\n")
+    assert parse_flashcards(text) == EXPECTED_CARDS
+
+
+def test_flashcards_bold_and_numbered():
+    text = ("1. **Front:** Photosynthesis\n   **Back:** How plants turn light into chemical energy\n"
+            "2. __Term__: Mitochondria\n   __Definition__: The organelle that produces ATP\n")
+    assert parse_flashcards(text) == EXPECTED_CARDS
+
+
+def test_flashcards_partial_drops_card_without_back():
+    text = "Front: Photosynthesis\nBack: How plants turn light into chemical energy\nFront: Mitochondria\n"
+    assert parse_flashcards(text) == EXPECTED_CARDS[:1]
+
+
+def test_flashcards_json():
+    payload = [
+        {"front": "Photosynthesis", "back": "How plants turn light into chemical energy"},
+        {"term": "Mitochondria", "definition": "The organelle that produces ATP"},
+        {"front": "Ribosome"},
+    ]
+    assert parse_flashcards(json.dumps({"flashcards": payload})) == EXPECTED_CARDS
@@ -0,0 +1,98 @@
+from typing import List
+
+import numpy as np
+from langchain_core.documents import Document
+
+import settings
+from chunking import FurnitureFilter, deduplicate, group_segments
+from ingest import split_pages
+
+
+TOPICS = ["solar", "wind", "hydro", "nuclear", "coal", "gas", "biomass", "geothermal", "tidal", "storage"]
+
+
+def body_lines(number: int) -> List[str]:
+    topic = TOPICS[number % len(TOPICS)]
+    return [
+        f"This part of the report discusses {topic} capacity (part {number}).",
+        f"Investment in {topic} projects is summarised in the tables below.",
+        f"Most {topic} sites met their targets for the year.",
+        f"Outlook: further {topic} growth is expected.",
+    ]
+
+
+def make_page(number: int) -> str:
+    return "\n".join(["ACME Corp. Annual Report 2023", "Confidential", ""] + body_lines(number) + [
+        "",
+        f"Page {number} of 20",
+    ])
+
+
+def test_furniture_filter_strips_repeated_headers_and_footers():
+    furniture = FurnitureFilter()
+    pages = list(furniture.filter((number, make_page(number)) for number in range(1, 21)))
+
+    assert [number for number, _ in pages] == list(range(1, 21))
+    for number, text in pages:
+        assert "ACME Corp." not in text
+        assert "Confidential" not in text
+        assert "Page " not in text
+        assert text.strip().split("\n") == body_lines(number)
+    assert furniture.lines_removed == 3 * 20
+
+
+def test_furniture_filter_keeps_lines_of_short_documents():
+    pages = [(1, make_page(1)), (2, make_page(2))]
+    assert list(FurnitureFilter().filter(pages)) == pages
+
+
+def test_deduplicate_collapses_exact_and_near_duplicates():
+    passage = ("The mitochondria is the powerhouse of the cell and produces most of the chemical "
+               "energy needed to power the biochemical reactions of the cell, stored as ATP.")
+    chunks = [
+        Document(page_content=passage, metadata={"page": 1}),
+        Document(page_content="  " + passage.upper() + "\n", metadata={"page": 2}),
+        Document(page_content=passage.replace("stored as ATP.", "stored as ATP!"), metadata={"page": 3}),
+        Document(page_content="Photosynthesis converts light energy into chemical energy in the "
+                              "chloroplasts of plant cells.", metadata={"page": 4}),
+        Document(page_content="The ribosome assembles proteins from amino acids, following the "
+                              "sequence read from messenger RNA.", metadata={"page": 5}),
+    ]
+    kept, stats = deduplicate(chunks)
+
+    assert [chunk.metadata["page"] for chunk in kept] == [1, 4, 5]
+    assert stats["exact_duplicates"] == 1
+    assert stats["near_duplicates"] == 1
+    assert stats["duplicate_chars"] == len(chunks[1].page_content) + len(chunks[2].page_content)
+
+
+def test_deduplicate_keeps_distinct_chunks_without_near_detection():
+    chunks = [Document(page_content=f"Chapter {number} covers topic number {number} in depth.")
+              for number in range(10)]
+    near = Document(page_content=chunks[0].page_content.replace("depth.", "depth!"))
+    kept, stats = deduplicate(chunks + [near], near_threshold=0)
+    assert len(kept) == 11
+    assert stats["near_duplicates"] == 0
+
+
+def test_grouped_segments_match_their_source_offsets(monkeypatch):
+    monkeypatch.setattr(settings, "CHUNK_SEMANTIC", True)
+    monkeypatch.setattr(settings, "CHUNK_SEMANTIC_SEGMENT_SIZE", 120)
+    monkeypatch.setattr(settings, "CHUNK_SIZE", 400)
+    monkeypatch.setattr(settings, "CHUNK_STRIP_FURNITURE", False)
+    pages = [(number, "\n".join(body_lines(number)) + "\n\n") for number in range(1, 13)]
+    # A page repeated word for word, so deduplication leaves a gap between segments
+    pages.insert(4, (99, pages[2][1]))
+    text = "".join(page for _, page in pages)
+
+    segments, stats = split_pages(pages)
+    assert stats["exact_duplicates"] > 0
+    vectors = np.random.default_rng(0).normal(size=(len(segments), 8)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    chunks, chunk_vectors = group_segments(segments, vectors, settings.CHUNK_SIZE)
+
+    assert len(chunks) == len(chunk_vectors) < len(segments)
+    for chunk in chunks:
+        start = chunk.metadata["start_index"]
+        assert text[start:start + len(chunk.page_content)] == chunk.page_content
+        assert len(chunk.page_content) <= settings.CHUNK_SIZE
@@ -0,0 +1,72 @@
+import pytest
+from langchain_core.documents import Document
+
+from context import build_context, token_counter
+
+SENTENCE = "Enzymes lower the activation energy of the reactions they catalyse. "
+
+
+@pytest.fixture(autouse=True)
+def approximate_tokens(monkeypatch):
+    # ~4 characters per token, so the tests don't need the tiktoken encoding downloaded
+    monkeypatch.setattr(token_counter, "_loaded", True)
+    monkeypatch.setattr(token_counter, "_encoding", None)
+    monkeypatch.setattr(token_counter, "exact", False)
+
+
+def chunk(text: str, start: int, document_id: str = "doc") -> Document:
+    return Document(page_content=text, metadata={"document_id": document_id, "start_index": start})
+
+
+def test_context_stays_within_budget():
+    docs = [chunk(f"Passage {number}. " + SENTENCE * 6, number * 1000) for number in range(20)]
+    for budget in (60, 150, 400, 1000):
+        built = build_context(docs, budget)
+        assert 0 < built.tokens <= budget
+        assert built.truncated
+        # Whole chunks are taken most relevant first
+        assert built.documents == docs[:len(built.documents)]
+
+
+def test_context_keeps_everything_that_fits():
+    docs = [chunk(SENTENCE, 0), chunk(SENTENCE, 500)]
+    built = build_context(docs, 1000)
+    assert not built.truncated
+    assert built.documents == docs
+    assert built.text == SENTENCE.strip() + "\n\n" + SENTENCE.strip()
+
+
+def test_oversized_first_chunk_is_cut_at_a_sentence():
+    text = SENTENCE * 50
+    budget = 100
+    assert token_counter.count(text) > budget
+    built = build_context([chunk(text, 0)], budget)
+    assert 0 < built.tokens <= budget
+    assert built.truncated
+    assert text.startswith(built.text)
+    assert built.text.endswith("catalyse.")
+
+
+def test_oversized_first_chunk_without_sentences_is_cut_between_words():
+    text = " ".join(f"word{number}" for number in range(2000))
+    built = build_context([chunk(text, 0)], 80)
+    assert 0 < built.tokens <= 80
+    assert text.startswith(built.text)
+
+
+def test_oversized_later_chunk_keeps_whole_sentences_only():
+    first = SENTENCE * 2
+    second = "x" * 4000  # one "word" far larger than what's left of the budget
+    built = build_context([chunk(first, 0), chunk(second, 5000)], 120)
+    assert built.tokens <= 120
+    assert built.text == first.strip()
+    assert len(built.documents) == 1
+    assert built.truncated
+
+
+def test_overlapping_chunks_are_not_repeated():
+    text = SENTENCE * 4
+    overlap = len(SENTENCE)
+    docs = [chunk(text, 0), chunk(text, len(text) - overlap)]
+    built = build_context(docs, 1000)
+    assert built.text == (text + text[overlap:]).strip()
@@ -0,0 +1,87 @@
+import zlib
+from typing import List
+
+import numpy as np
+import pytest
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.embeddings import Embeddings
+
+from retrieval import BM25Index, HybridFAISS
+from vector_index import MIN_POINTS_PER_CENTROID, PQ_CENTROIDS, backend_name, create_index, reconstruct
+
+DIMENSION = 16
+DOCUMENTS = ("alpha", "beta", "gamma")
+
+
+class SeededEmbeddings(Embeddings):
+    """The same text always gets the same random unit vector."""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = np.random.default_rng(zlib.crc32(text.encode())).normal(size=DIMENSION)
+        return (vector / np.linalg.norm(vector)).astype(np.float32).tolist()
+
+
+def chunk_text(document: str, number: int) -> str:
+    # Each chunk carries a term no other chunk has, so BM25 finds exactly one position for it
+    return f"{document} section {number} mentions {document}{number}"
+
+
+def make_store(backend: str, per_document: int) -> HybridFAISS:
+    embeddings = SeededEmbeddings()
+    texts = [chunk_text(document, number) for document in DOCUMENTS for number in range(per_document)]
+    metadatas = [{"document_id": document} for document in DOCUMENTS for _ in range(per_document)]
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    store = HybridFAISS(
+        embedding_function=embeddings,
+        index=create_index(vectors, backend),
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+    store.add_embeddings(zip(texts, vectors), metadatas=metadatas)
+    store.build_sparse_index()
+    return store
+
+
+@pytest.mark.parametrize("backend, per_document", [
+    ("flat", 40),
+    ("hnsw", 40),
+    ("ivf", 16 * MIN_POINTS_PER_CENTROID // 3 + 1),
+    ("pq", PQ_CENTROIDS * MIN_POINTS_PER_CENTROID // 3 + 1),
+])
+def test_remove_document_keeps_indexes_aligned(backend, per_document):
+    store = make_store(backend, per_document)
+    assert backend_name(store.index) == backend
+
+    doomed = [doc_id for doc_id, doc in store.docstore._dict.items() if doc.metadata["document_id"] == "beta"]
+    store.delete(doomed)
+
+    total = 2 * per_document
+    assert store.index.ntotal == total
+    assert store.sparse_index.count == total
+    assert sorted(store.index_to_docstore_id) == list(range(total))
+    assert not store.sparse_index.search("beta", total)
+
+    for position in range(0, total, max(1, total // 25)):
+        document = store._document(position)
+        assert document.metadata["document_id"] != "beta"
+        unique_term = document.page_content.rsplit(" ", 1)[1]
+        assert store.sparse_index.search(unique_term, 3)[0][0] == position
+        vectors = reconstruct(store.index, [position])
+        if vectors is not None:
+            np.testing.assert_allclose(vectors[0], store.embedding_function.embed_query(document.page_content),
+                                       atol=1e-5)
+
+
+def test_bm25_appends_match_a_single_build():
+    texts = [chunk_text(document, number) for document in DOCUMENTS for number in range(50)]
+    built = BM25Index.build(texts)
+    appended = BM25Index.empty()
+    for start in range(0, len(texts), 7):
+        appended = appended.extend(texts[start:start + 7])
+    assert appended.count == built.count
+    for query in ("alpha section 3", "gamma49 beta", "section"):
+        assert appended.search(query, 10) == pytest.approx(built.search(query, 10))
+    assert appended.remove([0, 75, 149]).search("beta 3", 10) == built.remove([0, 75, 149]).search("beta 3", 10)
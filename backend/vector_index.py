@@ -0,0 +1,198 @@
+"""FAISS index factory: picks an index backend by chunk count.
+
+    flat  exact search over uncompressed vectors (small documents, the default)
+    hnsw  graph index; faster search, more memory than flat
+    ivf   inverted lists over k-means cells (IVF-Flat); searches INDEX_IVF_NPROBE cells
+    pq    IVF with product-quantized codes; ~32x smaller than flat, approximate distances
+
+All backends use L2 distance over the normalized vectors from the embedding engine.
+"""
+import math
+import time
+from typing import Dict, List, Optional, Sequence
+
+import faiss
+import numpy as np
+
+import settings
+
+BACKENDS = ("flat", "hnsw", "ivf", "pq")
+
+# k-means needs this many training points per centroid to give stable cells
+MIN_POINTS_PER_CENTROID = 39
+MIN_IVF_LISTS = 16
+PQ_CENTROIDS = 256  # 8-bit codes
+
+
+def choose_backend(count: int) -> str:
+    """Backend for an index of `count` vectors under the configured policy."""
+    if settings.INDEX_BACKEND != "auto":
+        return settings.INDEX_BACKEND
+    if count >= settings.INDEX_PQ_MIN_CHUNKS:
+        return "pq"
+    if count >= settings.INDEX_IVF_MIN_CHUNKS:
+        return "ivf"
+    if count >= settings.INDEX_HNSW_MIN_CHUNKS:
+        return "hnsw"
+    return "flat"
+
+
+def _ivf_lists(count: int) -> int:
+    # ~4*sqrt(n) cells, capped so each cell still gets enough training points
+    return min(int(4 * math.sqrt(count)), count // MIN_POINTS_PER_CENTROID)
+
+
+def _pq_subquantizers(dimension: int) -> int:
+    m = min(settings.INDEX_PQ_SUBQUANTIZERS, dimension)
+    while dimension % m:
+        m -= 1
+    return m
+
+
+def _training_sample(vectors: np.ndarray, size: int) -> np.ndarray:
+    if len(vectors) <= size:
+        return vectors
+    rng = np.random.default_rng(0)
+    return vectors[rng.choice(len(vectors), size, replace=False)]
+
+
+def create_index(vectors: np.ndarray, backend: Optional[str] = None) -> faiss.Index:
+    """Return an empty index for `vectors`, trained on them when the backend needs it.
+
+    Inputs too small to train the requested backend fall back to the next simpler one
+    (pq -> ivf -> flat); the caller adds the vectors afterwards.
+    """
+    count, dimension = vectors.shape
+    backend = backend or choose_backend(count)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown index backend '{backend}' (expected one of {', '.join(BACKENDS)})")
+
+    nlist = _ivf_lists(count)
+    if backend == "pq" and count < PQ_CENTROIDS * MIN_POINTS_PER_CENTROID:
+        backend = "ivf"
+    if backend in ("ivf", "pq") and nlist < MIN_IVF_LISTS:
+        backend = "flat"
+
+    if backend == "flat":
+        return faiss.IndexFlatL2(dimension)
+    if backend == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, settings.INDEX_HNSW_M)
+        index.hnsw.efConstruction = max(2 * settings.INDEX_HNSW_EF_SEARCH, 40)
+        configure_search(index)
+        return index
+
+    quantizer = faiss.IndexFlatL2(dimension)
+    if backend == "ivf":
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+    else:
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, _pq_subquantizers(dimension), 8)
+    # Sample large inputs: k-means cost grows with the training set, quality barely does
+    sample = _training_sample(vectors, max(settings.INDEX_TRAIN_SAMPLE, nlist * MIN_POINTS_PER_CENTROID))
+    index.train(np.ascontiguousarray(sample, dtype=np.float32))
+    configure_search(index)
+    return index
+
+
+def configure_search(index: faiss.Index):
+    """Apply the configured search-time parameters (also to indexes loaded from disk)."""
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = settings.INDEX_HNSW_EF_SEARCH
+        return
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return
+    ivf.nprobe = min(settings.INDEX_IVF_NPROBE, ivf.nlist)
+
+
+def backend_name(index: faiss.Index) -> str:
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def index_bytes(index: faiss.Index) -> int:
+    """Approximate resident size of the vectors, codes and search structures."""
+    if isinstance(index, faiss.IndexHNSW):
+        # Neighbour lists are int32
+        return index_bytes(faiss.downcast_index(index.storage)) + index.hnsw.neighbors.size() * 4
+    if isinstance(index, faiss.IndexIVF):
+        # Codes plus an int64 id per vector, plus the coarse centroids
+        return index.ntotal * (index.code_size + 8) + index.nlist * index.d * 4
+    return index.ntotal * (getattr(index, "code_size", 0) or index.d * 4)
+
+
+def reconstruct(index: faiss.Index, positions: Sequence[int]) -> Optional[np.ndarray]:
+    """Stored vectors at `positions`, or None when the backend only keeps lossy codes (pq)."""
+    keys = np.asarray(positions, dtype=np.int64)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return None
+    if len(keys) == 0:
+        return np.empty((0, index.d), dtype=np.float32)
+    if isinstance(index, faiss.IndexIVF):
+        # IVF needs an id -> list lookup table; build it on a copy so the original stays read-only
+        index = faiss.clone_index(index)
+        index.make_direct_map()
+    return index.reconstruct_batch(keys)
+
+
+def recall_at_k(index: faiss.Index, vectors: np.ndarray, k: int = 4, queries: int = 64) -> Optional[float]:
+    """Fraction of the exact top-k neighbours that `index` also returns.
+
+    Queries are normalized midpoints of random pairs of the indexed vectors, so they
+    lie near the document's content without trivially matching one stored vector. The
+    exact neighbours come from a brute-force search over `vectors` in place, without
+    building a second (flat) index.
+    """
+    count = len(vectors)
+    if count <= k or queries <= 0:
+        return None
+    rng = np.random.default_rng(0)
+    pairs = rng.integers(0, count, size=(queries, 2))
+    query_vectors = vectors[pairs[:, 0]] + vectors[pairs[:, 1]]
+    norms = np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    query_vectors = np.ascontiguousarray(query_vectors / np.maximum(norms, 1e-12), dtype=np.float32)
+
+    _, truth = faiss.knn(query_vectors, np.ascontiguousarray(vectors, dtype=np.float32), k)
+    _, found = index.search(query_vectors, k)
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth.tolist(), found.tolist()))
+    return hits / (queries * k)
+
+
+def describe(index: faiss.Index, vectors: Optional[np.ndarray] = None, k: int = 4,
+             max_vectors: Optional[int] = None) -> Dict:
+    """Backend, vector count and memory footprint.
+
+    recall@k too when `vectors` are given, unless there are more than `max_vectors`.
+    """
+    report = {
+        "backend": backend_name(index),
+        "vectors": index.ntotal,
+        "bytes": index_bytes(index),
+        "flat_bytes": index.ntotal * index.d * 4,
+    }
+    measured = vectors is not None and (max_vectors is None or len(vectors) <= max_vectors)
+    if measured and report["backend"] != "flat":
+        recall = recall_at_k(index, vectors, k=k, queries=settings.INDEX_EVAL_QUERIES)
+        if recall is not None:
+            report[f"recall_at_{k}"] = round(recall, 4)
+    return report
+
+
+def compare_backends(vectors: np.ndarray, k: int = 4) -> List[Dict]:
+    """Build every backend over `vectors` and report build time, memory and recall@k (bench.py --compare-indexes)."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    reports = []
+    for backend in BACKENDS:
+        start = time.perf_counter()
+        index = create_index(vectors, backend)
+        index.add(vectors)
+        report = describe(index, vectors, k=k)
+        report["requested"] = backend
+        report["build_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        reports.append(report)
+    return reports
@@ -26,7 +26,7 @@ export function FlashcardPanel() {
   const [isLoading, setIsLoading] = useState(false)
   const [error, setError] = useState<string | null>(null)
 
-  const generateFlashcards = async () => {
+  const generateFlashcards = async (refresh = false) => {
     if (!sessionId) {
       setError('Please upload a PDF first')
       return
@@ -50,7 +50,7 @@ export function FlashcardPanel() {
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ sessionId }),
+        body: JSON.stringify({ sessionId, refresh }),
         signal: controller.signal,
       })
 
@@ -146,14 +146,14 @@ export function FlashcardPanel() {
       ) : error ? (
         <div className="text-center py-8">
           <p className="text-sm text-red-500 mb-4">{error}</p>
-          <Button onClick={generateFlashcards} variant="outline" size="sm">
+          <Button onClick={() => generateFlashcards()} variant="outline" size="sm">
             Retry
           </Button>
         </div>
       ) : flashcards.length === 0 ? (
         <div className="text-center py-8">
           <Button 
-            onClick={generateFlashcards} 
+            onClick={() => generateFlashcards()} 
             className="bg-gradient-to-r from-purple-600 to-blue-600 text-white"
           >
             Generate Flashcards
@@ -235,7 +235,7 @@ export function FlashcardPanel() {
 
           {/* Generate New */}
           <Button
-            onClick={generateFlashcards}
+            onClick={() => generateFlashcards(true)}
             variant="outline"
             className="w-full border-purple-600 text-purple-600"
           >
@@ -23,7 +23,7 @@ export function QuizPanel() {
   const [isLoading, setIsLoading] = useState(false)
   const [error, setError] = useState<string | null>(null)
 
-  const generateQuiz = async () => {
+  const generateQuiz = async (refresh = false) => {
     if (!sessionId) {
       setError('Please upload a PDF first')
       return
@@ -43,7 +43,7 @@ export function QuizPanel() {
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ sessionId }),
+        body: JSON.stringify({ sessionId, refresh }),
       })
 
       if (!response.ok) {
@@ -130,14 +130,14 @@ export function QuizPanel() {
       ) : error ? (
         <div className="text-center py-8">
           <p className="text-sm text-red-500 mb-4">{error}</p>
-          <Button onClick={generateQuiz} variant="outline" size="sm">
+          <Button onClick={() => generateQuiz()} variant="outline" size="sm">
             Retry
           </Button>
         </div>
       ) : questions.length === 0 ? (
         <div className="text-center py-8">
           <Button 
-            onClick={generateQuiz} 
+            onClick={() => generateQuiz()} 
             className="bg-gradient-to-r from-purple-600 to-blue-600 text-white"
           >
             Generate Quiz
@@ -228,7 +228,7 @@ export function QuizPanel() {
                       </p>
                     </div>
                     <Button
-                      onClick={generateQuiz}
+                      onClick={() => generateQuiz(true)}
                       variant="outline"
                       className="w-full border-purple-600 text-purple-600"
                     >